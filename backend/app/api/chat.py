@@ -1,14 +1,23 @@
-from fastapi import APIRouter, HTTPException, Depends, Query, Path, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, Depends, Query, Path, WebSocket, WebSocketDisconnect, status
 from fastapi.responses import JSONResponse
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 import logging
 import json
 import asyncio
+import time
+from sqlalchemy.orm import Session
 
 from ..schemas.chat import ChatMessageCreate, ChatMessageRead, ChatCreate, ChatRead, ChatListResponse
 from ..services.chat_service import chat_service
-from ..services.auth_service import get_current_user
+from ..services.chat_writer import chat_message_writer, ChatWriterOverloadedError, PendingMessage
+from ..services.chat_search import chat_search_index, SearchUnavailableError
+from ..services.moderation_pipeline import moderation_pipeline
+from ..services.auth_service import get_current_user, get_user_from_token
 from ..models.user import User
+from ..database import get_db
+from ..utils.websocket_manager import EncodedFrame, IdleTracker
+from ..utils.presence import presence_service
+from ..config.settings import settings
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -18,13 +27,25 @@ class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[int, WebSocket] = {}
         self._lock = asyncio.Lock()  # Для потокобезопасности
+        self.idle_tracker = IdleTracker()
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        self.stats = {
+            'pings_sent': 0,
+            'ping_timeouts': 0,
+            'connections_reaped': 0
+        }
 
     async def connect(self, websocket: WebSocket, user_id: int):
         """Безопасное подключение пользователя"""
         try:
             await websocket.accept()
             async with self._lock:
+                replaced = user_id in self.active_connections
                 self.active_connections[user_id] = websocket
+            if not replaced:
+                presence_service.acquire(user_id)
+            self.idle_tracker.touch(user_id)
+            self.start_heartbeat()
             logger.info(f"Пользователь {user_id} подключился к WebSocket")
         except Exception as e:
             logger.error(f"Ошибка подключения пользователя {user_id}: {e}")
@@ -35,16 +56,18 @@ class ConnectionManager:
         try:
             if user_id in self.active_connections:
                 del self.active_connections[user_id]
+                self.idle_tracker.remove(user_id)
+                presence_service.release(user_id)
                 logger.info(f"Пользователь {user_id} отключился от WebSocket")
         except Exception as e:
             logger.error(f"Ошибка отключения пользователя {user_id}: {e}")
 
-    async def send_personal_message(self, message: str, user_id: int):
+    async def send_personal_message(self, message: Union[str, EncodedFrame], user_id: int):
         """Безопасная отправка сообщения"""
         try:
             if user_id in self.active_connections:
                 websocket = self.active_connections[user_id]
-                await websocket.send_text(message)
+                await websocket.send_text(message.text if isinstance(message, EncodedFrame) else message)
                 return True
             return False
         except Exception as e:
@@ -52,14 +75,15 @@ class ConnectionManager:
             self.disconnect(user_id)
             return False
 
-    async def broadcast_message(self, message: str, exclude_user_id: Optional[int] = None):
+    async def broadcast_message(self, message: Union[str, EncodedFrame], exclude_user_id: Optional[int] = None):
         """Отправка сообщения всем подключенным пользователям"""
+        text = message.text if isinstance(message, EncodedFrame) else message
         disconnected_users = []
-        for user_id, websocket in self.active_connections.items():
+        for user_id, websocket in list(self.active_connections.items()):
             if user_id == exclude_user_id:
                 continue
             try:
-                await websocket.send_text(message)
+                await websocket.send_text(text)
             except Exception as e:
                 logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
                 disconnected_users.append(user_id)
@@ -68,6 +92,83 @@ class ConnectionManager:
         for user_id in disconnected_users:
             self.disconnect(user_id)
 
+    def touch(self, user_id: int):
+        """Отмечает входящую активность пользователя"""
+        if user_id in self.active_connections:
+            self.idle_tracker.touch(user_id)
+
+    def start_heartbeat(self):
+        """Запускает фоновый heartbeat, если он еще не запущен"""
+        if self.heartbeat_task is None or self.heartbeat_task.done():
+            self.heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop_heartbeat(self):
+        """Останавливает фоновый heartbeat"""
+        if self.heartbeat_task and not self.heartbeat_task.done():
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+        self.heartbeat_task = None
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(settings.websocket_heartbeat_interval)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"Ошибка heartbeat чата: {e}")
+
+    async def _close_socket(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.close(code=1001), settings.websocket_send_timeout)
+        except Exception:
+            pass
+
+    async def _ping(self, user_id: int, frame: EncodedFrame) -> bool:
+        """Пинг с ограничением времени: не успевший принять кадр клиент отключается"""
+        websocket = self.active_connections.get(user_id)
+        try:
+            return await asyncio.wait_for(self.send_personal_message(frame, user_id), settings.websocket_send_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Пользователь {user_id} не принял ping за {settings.websocket_send_timeout} с, отключаем")
+            self.stats['ping_timeouts'] += 1
+            # Пользователь мог переподключиться, пока шел ping
+            if websocket is not None and self.active_connections.get(user_id) is websocket:
+                self.disconnect(user_id)
+                await self._close_socket(websocket)
+            return False
+
+    async def heartbeat(self, now: Optional[float] = None) -> int:
+        """Вытесняет неактивные соединения и пингует простаивающие, O(просроченных)
+
+        Закрытия и пинги выполняются параллельно, каждый со своим таймаутом,
+        поэтому медленный клиент не задерживает обход остальных.
+        """
+        now = time.monotonic() if now is None else now
+
+        expired = self.idle_tracker.pop_expired(now - settings.websocket_idle_timeout)
+        sockets = []
+        for user_id in expired:
+            websocket = self.active_connections.get(user_id)
+            self.disconnect(user_id)
+            if websocket is not None:
+                sockets.append(websocket)
+        if sockets:
+            await asyncio.gather(*(self._close_socket(websocket) for websocket in sockets))
+        self.stats['connections_reaped'] += len(expired)
+
+        presence_service.refresh_local()
+
+        idle = self.idle_tracker.idle_since(now - settings.websocket_heartbeat_interval)
+        if idle:
+            ping = EncodedFrame.from_data({"type": "ping"})
+            results = await asyncio.gather(*(self._ping(user_id, ping) for user_id in idle))
+            self.stats['pings_sent'] += sum(results)
+
+        return len(expired)
+
     def get_connected_users(self) -> List[int]:
         """Получить список подключенных пользователей"""
         return list(self.active_connections.keys())
@@ -78,77 +179,272 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+# Сколько сообщений одного чата отдается при докачке за раз
+RESUME_BATCH_SIZE = 100
+RESUME_MAX_MESSAGES = 500
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 100
+
+def new_message_payload(message) -> Dict[str, Any]:
+    """Кадр нового сообщения чата"""
+    return {
+        "type": "new_message",
+        "chat_id": message.chat_id,
+        "message": {
+            "id": message.id,
+            "seq": message.seq,
+            "message": message.message,
+            "timestamp": message.timestamp.isoformat(),
+            "user_from_id": message.user_from_id,
+            "user_to_id": message.user_to_id
+        }
+    }
+
+def pending_message_payload(pending: PendingMessage) -> Dict[str, Any]:
+    """Сообщение, принятое в очередь записи: id и seq появятся после коммита"""
+    return {
+        "type": "new_message",
+        "chat_id": pending.chat_id,
+        "provisional_id": pending.provisional_id,
+        "message": {
+            "id": None,
+            "seq": None,
+            "message": pending.message,
+            "timestamp": pending.timestamp.isoformat(),
+            "user_from_id": pending.user_from_id,
+            "user_to_id": pending.user_to_id
+        }
+    }
+
+async def on_messages_persisted(batch: List[PendingMessage]):
+    """Сообщает участникам чата постоянные id и seq записанного пакета"""
+    for pending in batch:
+        if pending.error:
+            # Получатель уже видел сообщение с временным id - отзываем его
+            await manager.send_personal_message(
+                EncodedFrame.from_data({
+                    "type": "error",
+                    "chat_id": pending.chat_id,
+                    "provisional_id": pending.provisional_id,
+                    "message": pending.error
+                }),
+                pending.user_from_id
+            )
+            await manager.send_personal_message(
+                EncodedFrame.from_data({
+                    "type": "message_retracted",
+                    "chat_id": pending.chat_id,
+                    "provisional_id": pending.provisional_id
+                }),
+                pending.user_to_id
+            )
+            continue
+        
+        moderation_pipeline.submit("message", pending.message_id, pending.user_from_id, pending.message)
+        persisted = {
+            "chat_id": pending.chat_id,
+            "provisional_id": pending.provisional_id,
+            "message_id": pending.message_id,
+            "seq": pending.seq
+        }
+        await manager.send_personal_message(
+            EncodedFrame.from_data({"type": "message_sent", **persisted}),
+            pending.user_from_id
+        )
+        await manager.send_personal_message(
+            EncodedFrame.from_data({"type": "message_persisted", **persisted}),
+            pending.user_to_id
+        )
+
+chat_message_writer.on_persisted = on_messages_persisted
+
+async def resume_chats(user_id: int, last_seen: Dict[str, Any]):
+    """Отправляет сообщения с seq больше последнего увиденного клиентом
+    
+    Клиент присылает {"type": "resume", "chats": {"<chat_id>": <last_seq>, ...}}.
+    Для каждого чата выполняется один диапазонный запрос по индексу (chat_id, seq);
+    если пропущено больше RESUME_MAX_MESSAGES, клиент получает has_more=True
+    и догружает историю страницами.
+    """
+    resumed: Dict[str, Any] = {}
+    for raw_chat_id, raw_seq in last_seen.items():
+        try:
+            chat_id, after_seq = int(raw_chat_id), int(raw_seq or 0)
+            messages = chat_service.get_messages_since(chat_id, user_id, after_seq, limit=RESUME_MAX_MESSAGES + 1)
+        except (TypeError, ValueError):
+            continue
+        except Exception as e:
+            logger.error(f"Ошибка докачки чата {raw_chat_id} для пользователя {user_id}: {e}")
+            continue
+        
+        has_more = len(messages) > RESUME_MAX_MESSAGES
+        messages = messages[:RESUME_MAX_MESSAGES]
+        for start in range(0, len(messages), RESUME_BATCH_SIZE):
+            batch = messages[start:start + RESUME_BATCH_SIZE]
+            await manager.send_personal_message(
+                EncodedFrame.from_data({
+                    "type": "resume_batch",
+                    "chat_id": chat_id,
+                    "messages": [new_message_payload(message)["message"] for message in batch]
+                }),
+                user_id
+            )
+        
+        resumed[str(chat_id)] = {
+            "last_seq": messages[-1].seq if messages else after_seq,
+            "count": len(messages),
+            "has_more": has_more
+        }
+    
+    await manager.send_personal_message(
+        EncodedFrame.from_data({"type": "resume_complete", "chats": resumed}),
+        user_id
+    )
+
+async def send_history_page(user_id: int, request: Dict[str, Any]):
+    """Страница истории чата по курсору before_id/after_id
+    
+    Запрашивается на один элемент больше, чтобы вернуть has_more без COUNT.
+    """
+    chat_id = request.get("chat_id")
+    try:
+        limit = min(max(int(request.get("limit") or HISTORY_PAGE_SIZE), 1), HISTORY_MAX_PAGE_SIZE)
+        before_id = request.get("before_id")
+        after_id = request.get("after_id") if before_id is None else None
+        messages = chat_service.get_messages(
+            chat_id, user_id, limit + 1,
+            before_id=int(before_id) if before_id is not None else None,
+            after_id=int(after_id) if after_id is not None else None
+        )
+    except (TypeError, ValueError):
+        await manager.send_personal_message(
+            EncodedFrame.from_data({"type": "error", "chat_id": chat_id, "message": "Некорректный запрос истории"}),
+            user_id
+        )
+        return
+    except Exception as e:
+        logger.error(f"Ошибка загрузки истории чата {chat_id} для пользователя {user_id}: {e}")
+        await manager.send_personal_message(
+            EncodedFrame.from_data({"type": "error", "chat_id": chat_id, "message": "Ошибка загрузки истории"}),
+            user_id
+        )
+        return
+    
+    # Сообщения идут от новых к старым, лишний элемент - самый дальний от курсора
+    has_more = len(messages) > limit
+    if has_more:
+        messages = messages[1:] if after_id is not None else messages[:limit]
+    
+    await manager.send_personal_message(
+        EncodedFrame.from_data({
+            "type": "history",
+            "chat_id": chat_id,
+            "messages": [new_message_payload(message)["message"] for message in messages],
+            "has_more": has_more
+        }),
+        user_id
+    )
+
 @router.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int):
-    """WebSocket эндпоинт для real-time чата"""
+async def websocket_endpoint(
+    websocket: WebSocket,
+    user_id: int,
+    token: Optional[str] = Query(None, description="Access-токен (браузер не передает заголовки в WebSocket)"),
+    db: Session = Depends(get_db)
+):
+    """WebSocket эндпоинт для real-time чата
+    
+    Соединение принимается только с access-токеном владельца user_id:
+    через сокет отдаются докачка и история всех чатов пользователя.
+    """
+    try:
+        current_user = get_user_from_token(token, db)
+    except HTTPException:
+        current_user = None
+    if current_user is None or current_user.id != user_id:
+        logger.warning(f"Отклонено WebSocket подключение к /ws/{user_id} без действительного токена")
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
     await manager.connect(websocket, user_id)
+    # Участники чатов пользователя нужны для typing/read без запросов к БД
+    chat_service.warm_membership_cache(user_id)
     try:
         while True:
             # Получение сообщения от клиента
             data = await websocket.receive_text()
+            manager.touch(user_id)
             message_data = json.loads(data)
             
             # Обработка сообщения
             if message_data.get("type") == "message":
+                # client_id клиента возвращается в ответах, чтобы он связал их со своим сообщением
+                client_id = message_data.get("client_id")
                 try:
-                    # Создание сообщения в базе данных
-                    chat_message = ChatMessageCreate(message=message_data.get("message", ""))
-                    message = chat_service.send_message(
-                        message_data.get("chat_id"), 
-                        user_id, 
-                        chat_message
+                    chat_id = message_data.get("chat_id")
+                    recipient_id = chat_service.get_other_participant(chat_id, user_id)
+                    if recipient_id is None:
+                        raise ValueError("Чат не найден или нет доступа")
+                    
+                    # Сообщение ставится в очередь групповой записи, коммит не ждем
+                    pending = chat_message_writer.submit(
+                        chat_id,
+                        user_id,
+                        recipient_id,
+                        message_data.get("message", "")
                     )
                     
-                    # Отправка сообщения получателю
-                    chat = chat_service.get_chat(message_data.get("chat_id"), user_id)
-                    if chat:
-                        recipient_id = chat.user2_id if chat.user1_id == user_id else chat.user1_id
-                        
-                        # Подготовка сообщения для отправки
-                        response_message = {
-                            "type": "new_message",
-                            "chat_id": message.chat_id,
-                            "message": {
-                                "id": message.id,
-                                "message": message.message,
-                                "timestamp": message.timestamp.isoformat(),
-                                "user_from_id": message.user_from_id,
-                                "user_to_id": message.user_to_id
-                            }
-                        }
-                        
-                        # Отправка получателю
-                        await manager.send_personal_message(
-                            json.dumps(response_message), 
-                            recipient_id
-                        )
-                        
-                        # Подтверждение отправителю
-                        await manager.send_personal_message(
-                            json.dumps({"type": "message_sent", "message_id": message.id}), 
-                            user_id
-                        )
-                        
+                    # Отправка получателю с временным id
+                    await manager.send_personal_message(
+                        EncodedFrame.from_data(pending_message_payload(pending)), 
+                        recipient_id
+                    )
+                    
+                    # Подтверждение отправителю, message_sent придет после коммита
+                    await manager.send_personal_message(
+                        EncodedFrame.from_data({"type": "message_accepted", "chat_id": chat_id, "provisional_id": pending.provisional_id, "client_id": client_id}), 
+                        user_id
+                    )
+                    
+                except ValueError as e:
+                    await manager.send_personal_message(
+                        EncodedFrame.from_data({"type": "error", "message": str(e), "client_id": client_id}), 
+                        user_id
+                    )
+                except ChatWriterOverloadedError as e:
+                    # Сообщение не принято: клиент помечает его неотправленным, retry - можно повторить
+                    logger.warning(f"Очередь записи сообщений заполнена, отклонено сообщение пользователя {user_id}")
+                    await manager.send_personal_message(
+                        EncodedFrame.from_data({"type": "error", "chat_id": chat_id, "message": str(e), "client_id": client_id, "retry": True}), 
+                        user_id
+                    )
                 except Exception as e:
                     logger.error(f"Ошибка обработки WebSocket сообщения: {e}")
                     await manager.send_personal_message(
-                        json.dumps({"type": "error", "message": "Ошибка отправки сообщения"}), 
+                        EncodedFrame.from_data({"type": "error", "message": "Ошибка отправки сообщения", "client_id": client_id}), 
                         user_id
                     )
             
+            elif message_data.get("type") == "resume":
+                # Докачка сообщений, пропущенных за время разрыва соединения
+                await resume_chats(user_id, message_data.get("chats") or {})
+            
+            elif message_data.get("type") == "history":
+                # Постраничная загрузка истории по курсору
+                await send_history_page(user_id, message_data)
+            
             elif message_data.get("type") == "typing":
                 # Уведомление о наборе текста
                 chat_id = message_data.get("chat_id")
-                chat = chat_service.get_chat(chat_id, user_id)
-                if chat:
-                    recipient_id = chat.user2_id if chat.user1_id == user_id else chat.user1_id
+                recipient_id = chat_service.get_other_participant(chat_id, user_id)
+                if recipient_id is not None:
                     typing_message = {
                         "type": "typing",
                         "chat_id": chat_id,
                         "user_id": user_id
                     }
                     await manager.send_personal_message(
-                        json.dumps(typing_message), 
+                        EncodedFrame.from_data(typing_message), 
                         recipient_id
                     )
             
@@ -159,9 +455,8 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
                     count = chat_service.mark_messages_as_read(chat_id, user_id)
                     if count > 0:
                         # Уведомление отправителя о прочтении
-                        chat = chat_service.get_chat(chat_id, user_id)
-                        if chat:
-                            sender_id = chat.user1_id if chat.user2_id == user_id else chat.user2_id
+                        sender_id = chat_service.get_other_participant(chat_id, user_id)
+                        if sender_id is not None:
                             read_message = {
                                 "type": "messages_read",
                                 "chat_id": chat_id,
@@ -169,7 +464,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
                                 "count": count
                             }
                             await manager.send_personal_message(
-                                json.dumps(read_message), 
+                                EncodedFrame.from_data(read_message), 
                                 sender_id
                             )
                 except Exception as e:
@@ -181,6 +476,43 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
         logger.error(f"Ошибка WebSocket соединения для пользователя {user_id}: {e}")
         manager.disconnect(user_id)
 
+@router.get("/presence", response_model=Dict[str, Any])
+async def get_presence(
+    user_ids: str = Query(..., description="ID пользователей через запятую (до 100)"),
+    current_user: User = Depends(get_current_user)
+):
+    """Онлайн-статус пользователей на всех воркерах одним запросом"""
+    try:
+        ids = [int(user_id) for user_id in user_ids.split(",") if user_id.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный список ID пользователей")
+    if len(ids) > 100:
+        raise HTTPException(status_code=400, detail="Не более 100 пользователей за запрос")
+    
+    presence = presence_service.get_presence(ids)
+    return {
+        "presence": {str(user_id): status for user_id, status in presence.items()}
+    }
+
+@router.get("/search", response_model=Dict[str, Any])
+async def search_messages(
+    q: str = Query(..., min_length=2, max_length=200, description="Поисковый запрос"),
+    limit: int = Query(20, ge=1, le=50, description="Количество результатов"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы"),
+    current_user: User = Depends(get_current_user)
+):
+    """Полнотекстовый поиск по сообщениям чатов пользователя"""
+    try:
+        return chat_search_index.search(current_user.id, q, limit, cursor)
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SearchUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Ошибка поиска сообщений пользователя {current_user.id}: {e}")
+        raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
+
 @router.post("/", response_model=ChatRead)
 async def create_chat(
     chat_data: ChatCreate,
@@ -231,11 +563,21 @@ async def get_chat_messages(
     chat_id: int = Path(..., description="ID чата"),
     current_user: User = Depends(get_current_user),
     limit: int = Query(50, ge=1, le=100, description="Количество сообщений"),
-    offset: int = Query(0, ge=0, description="Смещение")
+    offset: int = Query(0, ge=0, description="Смещение"),
+    after_seq: Optional[int] = Query(None, ge=0, description="Только сообщения с seq больше указанного"),
+    before_id: Optional[int] = Query(None, ge=1, description="Курсор: сообщения старше указанного ID"),
+    after_id: Optional[int] = Query(None, ge=0, description="Курсор: сообщения новее указанного ID")
 ):
     """Получение сообщений чата"""
     try:
-        messages = chat_service.get_messages(chat_id, current_user.id, limit, offset)
+        if after_seq is not None:
+            return chat_service.get_messages_since(chat_id, current_user.id, after_seq, limit)
+        if before_id is not None and after_id is not None:
+            raise ValueError("Укажите только один курсор: before_id или after_id")
+        messages = chat_service.get_messages(
+            chat_id, current_user.id, limit, offset,
+            before_id=before_id, after_id=after_id
+        )
         return messages
         
     except ValueError as e:
@@ -1,12 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any
+import asyncio
 import logging
 
 from ..database import get_db
 from ..services.moderation_service import moderation_service
+from ..services.auth_service import get_current_user, get_admin_user
 from ..models.user import User
 from ..models.ride import Ride
+from ..utils.moderation_matcher import UnsafePatternError
 from ..schemas.moderation import (
     ReportCreate, ReportResponse, ActionCreate, ActionResponse,
     ContentCheckRequest, ContentCheckResponse, TrustScoreResponse,
@@ -86,6 +89,70 @@ async def get_reports(
             detail="Ошибка получения жалоб"
         )
 
+@router.post("/queue/claim", response_model=List[ReportResponse])
+async def claim_reports(
+    limit: int = 10,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Выдача модератору следующих жалоб из очереди в аренду"""
+    try:
+        reports = moderation_service.claim_reports(db, current_user.id, limit)
+        return [report.to_dict() for report in reports]
+
+    except Exception as e:
+        logger.error(f"Ошибка выдачи жалоб из очереди: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ошибка выдачи жалоб из очереди"
+        )
+
+@router.post("/reports/{report_id}/lease", response_model=ReportResponse)
+async def extend_report_lease(
+    report_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Продление аренды жалобы"""
+    try:
+        report = moderation_service.extend_lease(db, report_id, current_user.id)
+        return report.to_dict()
+
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка продления аренды жалобы: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ошибка продления аренды жалобы"
+        )
+
+@router.delete("/reports/{report_id}/lease")
+async def release_report(
+    report_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Возврат жалобы в очередь"""
+    try:
+        moderation_service.release_report(db, report_id, current_user.id)
+        return {"message": "Жалоба возвращена в очередь"}
+
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка возврата жалобы в очередь: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ошибка возврата жалобы в очередь"
+        )
+
 @router.post("/reports/{report_id}/review", response_model=ActionResponse)
 async def review_report(
     report_id: int,
@@ -171,6 +238,109 @@ async def get_user_violations(
             detail="Ошибка получения нарушений пользователя"
         )
 
+@router.get("/rules", response_model=List[RuleResponse])
+async def get_rules(db: Session = Depends(get_db)):
+    """Получение правил модерации"""
+    try:
+        return [rule.to_dict() for rule in moderation_service.get_rules(db)]
+
+    except Exception as e:
+        logger.error(f"Ошибка получения правил модерации: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ошибка получения правил модерации"
+        )
+
+@router.post("/rules", response_model=RuleResponse)
+async def create_rule(
+    rule_data: RuleCreate,
+    current_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Создание правила модерации (применяется без перезапуска)
+
+    Шаблон проверяется пробным прогоном до сохранения, поэтому запрос
+    выполняется в потоке.
+    """
+    try:
+        rule = await asyncio.to_thread(
+            moderation_service.create_rule,
+            db=db,
+            name=rule_data.name,
+            pattern=rule_data.pattern,
+            action=rule_data.action,
+            severity=rule_data.severity,
+            description=rule_data.description
+        )
+        logger.info(f"Правило модерации {rule.id} создано пользователем {current_user.id}")
+        return rule.to_dict()
+
+    except UnsafePatternError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка создания правила модерации: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ошибка создания правила модерации"
+        )
+
+@router.put("/rules/{rule_id}", response_model=RuleResponse)
+async def update_rule(
+    rule_id: int,
+    rule_data: RuleCreate,
+    current_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Изменение правила модерации"""
+    try:
+        rule = await asyncio.to_thread(moderation_service.update_rule, db, rule_id, **rule_data.dict())
+        logger.info(f"Правило модерации {rule_id} изменено пользователем {current_user.id}")
+        return rule.to_dict()
+
+    except UnsafePatternError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка изменения правила модерации: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ошибка изменения правила модерации"
+        )
+
+@router.delete("/rules/{rule_id}", response_model=RuleResponse)
+async def deactivate_rule(
+    rule_id: int,
+    current_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Отключение правила модерации"""
+    try:
+        rule = moderation_service.update_rule(db, rule_id, is_active=False)
+        logger.info(f"Правило модерации {rule_id} отключено пользователем {current_user.id}")
+        return rule.to_dict()
+
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка отключения правила модерации: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ошибка отключения правила модерации"
+        )
+
 @router.get("/stats", response_model=ModerationStatsResponse)
 async def get_moderation_stats(
     days: int = 30,
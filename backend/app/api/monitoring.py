@@ -2,41 +2,34 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import Dict, Any, List
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 import json
 
 from ..database import get_db
 from ..utils.error_handler import api_error_handler
 from ..utils.logger import get_logger
+from ..utils.monitoring_store import monitoring_store
+from ..monitoring.metrics import api_metrics
+from ..monitoring.db_queries import query_tracker
+from ..monitoring.slow_queries import slow_query_log
+from ..services.auth_service import get_admin_user
+from ..models.user import User
 from ..schemas.monitoring import FrontendError
 
 logger = get_logger("monitoring")
 router = APIRouter()
 
-# Хранилище метрик (в продакшене лучше использовать Redis или базу данных)
-metrics_store = []
-errors_store = []
-
 @router.post("/metrics")
 async def receive_metrics(metrics_data: Dict[str, Any]):
     """Получение метрик производительности от фронтенда"""
     try:
-        # Добавляем временную метку
-        metrics_data["received_at"] = datetime.now().isoformat()
-        
-        # Сохраняем метрики
-        metrics_store.append(metrics_data)
-        
-        # Ограничиваем количество хранимых метрик
-        if len(metrics_store) > 1000:
-            metrics_store.pop(0)
+        # Кольцевой буфер и агрегат текущей минуты обновляются сразу
+        alerts = monitoring_store.record_metrics(metrics_data)
         
         # Логируем важные метрики
-        if metrics_data.get("errorRate", 0) > 10:
-            logger.warning(f"Высокий процент ошибок: {metrics_data.get('errorRate')}%")
-        
-        if metrics_data.get("avgResponseTime", 0) > 5000:
-            logger.warning(f"Медленный ответ API: {metrics_data.get('avgResponseTime')}ms")
+        for alert in alerts:
+            if alert["severity"] == "warning":
+                logger.warning(alert["message"])
         
         return {"success": True, "message": "Метрики получены"}
         
@@ -49,12 +42,7 @@ async def receive_errors(error_data: FrontendError):
     """Получение ошибок от фронтенда"""
     try:
         logger.error(f"Frontend error: {error_data.type} - {error_data.data.get('message', 'Unknown error')}")
-        # Добавляем временную метку
-        error_dict = error_data.dict()
-        error_dict["received_at"] = datetime.now().isoformat()
-        errors_store.append(error_dict)
-        if len(errors_store) > 500:
-            errors_store.pop(0)
+        monitoring_store.record_error(error_data.dict())
         return {"success": True, "message": "Ошибка зарегистрирована"}
     except Exception as e:
         logger.error(f"Ошибка обработки ошибок: {str(e)}")
@@ -62,60 +50,84 @@ async def receive_errors(error_data: FrontendError):
 
 @router.get("/stats")
 async def get_monitoring_stats():
-    """Получение статистики мониторинга"""
+    """Получение статистики мониторинга (поминутные агрегаты за последний час)"""
     try:
-        now = datetime.now()
-        last_hour = now - timedelta(hours=1)
-        last_24h = now - timedelta(hours=24)
-        
-        # Фильтруем метрики по времени
-        recent_metrics = [
-            m for m in metrics_store 
-            if datetime.fromisoformat(m["received_at"]) > last_hour
-        ]
-        
-        recent_errors = [
-            e for e in errors_store 
-            if datetime.fromisoformat(e["received_at"]) > last_hour
-        ]
-        
-        # Вычисляем статистику
-        total_sessions = len(set(m.get("sessionId") for m in recent_metrics))
-        total_api_calls = sum(m.get("apiCalls", 0) for m in recent_metrics)
-        total_errors = sum(m.get("errors", 0) for m in recent_metrics)
-        
-        avg_response_time = 0
-        if recent_metrics:
-            response_times = [m.get("avgResponseTime", 0) for m in recent_metrics]
-            avg_response_time = sum(response_times) / len(response_times)
-        
-        avg_cache_hit_rate = 0
-        if recent_metrics:
-            hit_rates = [m.get("cacheHitRate", 0) for m in recent_metrics]
-            avg_cache_hit_rate = sum(hit_rates) / len(hit_rates)
-        
-        # Статистика ошибок
-        error_types = {}
-        for error in recent_errors:
-            error_type = error.get("type", "unknown")
-            error_types[error_type] = error_types.get(error_type, 0) + 1
-        
         return {
             "period": "last_hour",
-            "total_sessions": total_sessions,
-            "total_api_calls": total_api_calls,
-            "total_errors": total_errors,
-            "avg_response_time": round(avg_response_time, 2),
-            "avg_cache_hit_rate": round(avg_cache_hit_rate, 2),
-            "error_rate": round((total_errors / total_api_calls * 100) if total_api_calls > 0 else 0, 2),
-            "error_types": error_types,
-            "timestamp": now.isoformat()
+            **monitoring_store.get_stats(60),
+            "timestamp": datetime.now().isoformat()
         }
         
     except Exception as e:
         logger.error(f"Ошибка получения статистики: {str(e)}")
         raise api_error_handler.handle_server_error(e, "get_monitoring_stats")
 
+@router.get("/latency")
+async def get_latency_stats(merged: bool = True):
+    """Квантили времени ответа по шаблонам маршрутов и классам статусов
+
+    merged=true - сводные по всем воркерам (через Redis), false - только этого воркера.
+    """
+    try:
+        return {
+            "overall": api_metrics.get_response_time_stats(merged),
+            "endpoints": api_metrics.get_endpoint_metrics(merged),
+            "histograms": api_metrics.latency.get_stats(),
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except Exception as e:
+        logger.error(f"Ошибка получения квантилей времени ответа: {str(e)}")
+        raise api_error_handler.handle_server_error(e, "get_latency_stats")
+
+@router.get("/db-queries")
+async def get_db_query_stats(
+    limit: int = 20,
+    order_by: str = "total_ms",
+    current_user: User = Depends(get_admin_user)
+):
+    """Отпечатки SQL-запросов этого воркера с наибольшим временем (order_by: total_ms, count, avg_ms, max_ms)"""
+    try:
+        return {
+            "queries": query_tracker.top(min(limit, 200), order_by),
+            "stats": query_tracker.get_stats(),
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except Exception as e:
+        logger.error(f"Ошибка получения статистики запросов к БД: {str(e)}")
+        raise api_error_handler.handle_server_error(e, "get_db_query_stats")
+
+@router.get("/slow-queries")
+async def get_slow_queries(
+    limit: int = 20,
+    order_by: str = "total_ms",
+    with_plans: bool = False,
+    current_user: User = Depends(get_admin_user)
+):
+    """Медленные запросы этого воркера: сводка по отпечаткам с планами EXPLAIN и последние записи
+
+    order_by: total_ms, count, avg_ms, max_ms. with_plans - полный JSON плана.
+    """
+    try:
+        limit = min(limit, 200)
+        return {
+            "fingerprints": slow_query_log.top(limit, order_by, with_plans),
+            "recent": slow_query_log.latest(limit),
+            "stats": slow_query_log.get_stats(),
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except Exception as e:
+        logger.error(f"Ошибка получения медленных запросов: {str(e)}")
+        raise api_error_handler.handle_server_error(e, "get_slow_queries")
+
+@router.delete("/slow-queries")
+async def clear_slow_queries(current_user: User = Depends(get_admin_user)):
+    """Очистка журнала медленных запросов этого воркера"""
+    slow_query_log.clear()
+    return {"success": True, "message": "Журнал медленных запросов очищен"}
+
 @router.get("/health")
 async def health_check():
     """Проверка здоровья системы"""
@@ -154,53 +166,11 @@ async def health_check():
 async def get_alerts():
     """Получение активных алертов"""
     try:
-        alerts = []
-        now = datetime.now()
-        last_hour = now - timedelta(hours=1)
-        
-        # Проверяем метрики за последний час
-        recent_metrics = [
-            m for m in metrics_store 
-            if datetime.fromisoformat(m["received_at"]) > last_hour
-        ]
-        
-        # Алерт на высокий процент ошибок
-        for metric in recent_metrics:
-            if metric.get("errorRate", 0) > 10:
-                alerts.append({
-                    "type": "high_error_rate",
-                    "severity": "warning",
-                    "message": f"Высокий процент ошибок: {metric.get('errorRate')}%",
-                    "session_id": metric.get("sessionId"),
-                    "timestamp": metric.get("received_at")
-                })
-        
-        # Алерт на медленные ответы
-        for metric in recent_metrics:
-            if metric.get("avgResponseTime", 0) > 5000:
-                alerts.append({
-                    "type": "slow_response",
-                    "severity": "warning",
-                    "message": f"Медленный ответ API: {metric.get('avgResponseTime')}ms",
-                    "session_id": metric.get("sessionId"),
-                    "timestamp": metric.get("received_at")
-                })
-        
-        # Алерт на низкий hit rate кэша
-        for metric in recent_metrics:
-            if metric.get("cacheHitRate", 100) < 50:
-                alerts.append({
-                    "type": "low_cache_hit_rate",
-                    "severity": "info",
-                    "message": f"Низкий hit rate кэша: {metric.get('cacheHitRate')}%",
-                    "session_id": metric.get("sessionId"),
-                    "timestamp": metric.get("received_at")
-                })
-        
+        alerts = monitoring_store.get_alerts(60)
         return {
             "alerts": alerts,
             "total_alerts": len(alerts),
-            "timestamp": now.isoformat()
+            "timestamp": datetime.now().isoformat()
         }
         
     except Exception as e:
@@ -211,9 +181,7 @@ async def get_alerts():
 async def clear_monitoring_data():
     """Очистка данных мониторинга"""
     try:
-        global metrics_store, errors_store
-        metrics_store.clear()
-        errors_store.clear()
+        monitoring_store.clear()
         
         logger.info("Данные мониторинга очищены")
         return {"success": True, "message": "Данные мониторинга очищены"}
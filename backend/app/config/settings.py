@@ -49,6 +49,7 @@ class Settings(BaseSettings):
     algorithm: str = Field(default="HS256", env="ALGORITHM")
     access_token_expire_minutes: int = Field(default=30, env="ACCESS_TOKEN_EXPIRE_MINUTES")
     refresh_token_expire_days: int = Field(default=7, env="REFRESH_TOKEN_EXPIRE_DAYS")
+    admin_telegram_ids: str = Field(default="", env="ADMIN_TELEGRAM_IDS")  # через запятую: модераторы и администраторы
     
     # Telegram
     telegram_bot_token: str = Field(default="8187393599:AAEudOluahmhNJixt_hW8mvWjWC0eh1YIlA", env="TELEGRAM_BOT_TOKEN")
@@ -63,6 +64,25 @@ class Settings(BaseSettings):
     # Мониторинг
     enable_metrics: bool = Field(default=True, env="ENABLE_METRICS")
     metrics_port: int = Field(default=8001, env="METRICS_PORT")
+    monitoring_use_redis: bool = Field(default=True, env="MONITORING_USE_REDIS")  # при заданном REDIS_URL
+    monitoring_metrics_buffer_size: int = Field(default=1000, env="MONITORING_METRICS_BUFFER_SIZE")
+    monitoring_errors_buffer_size: int = Field(default=500, env="MONITORING_ERRORS_BUFFER_SIZE")
+    monitoring_alerts_buffer_size: int = Field(default=500, env="MONITORING_ALERTS_BUFFER_SIZE")
+    monitoring_retention_minutes: int = Field(default=1440, env="MONITORING_RETENTION_MINUTES")  # поминутные агрегаты
+    latency_relative_error: float = Field(default=0.01, env="LATENCY_RELATIVE_ERROR")  # точность квантилей времени ответа
+    latency_flush_interval: float = Field(default=10.0, env="LATENCY_FLUSH_INTERVAL")  # секунд между сбросами в Redis
+    prometheus_multiproc_dir: Optional[str] = Field(default=None, env="PROMETHEUS_MULTIPROC_DIR")  # общий каталог воркеров
+    prometheus_sync_interval: float = Field(default=15.0, env="PROMETHEUS_SYNC_INTERVAL")  # перенос словарей stats, секунд
+    metrics_token: Optional[str] = Field(default=None, env="METRICS_TOKEN")  # Bearer-токен сборщика, без него /metrics закрыт
+    db_query_budget: int = Field(default=50, env="DB_QUERY_BUDGET")  # SQL-запросов на HTTP запрос до предупреждения
+    db_n_plus_one_threshold: int = Field(default=10, env="DB_N_PLUS_ONE_THRESHOLD")  # повторов одного SELECT
+    db_fingerprint_stats_size: int = Field(default=2000, env="DB_FINGERPRINT_STATS_SIZE")
+    db_server_timing: bool = Field(default=True, env="DB_SERVER_TIMING")  # заголовок Server-Timing с временем БД
+    slow_query_threshold_ms: float = Field(default=200.0, env="SLOW_QUERY_THRESHOLD_MS")
+    slow_query_log_size: int = Field(default=500, env="SLOW_QUERY_LOG_SIZE")  # последних медленных запросов
+    slow_query_explain_sample_rate: float = Field(default=0.1, env="SLOW_QUERY_EXPLAIN_SAMPLE_RATE")  # доля с EXPLAIN ANALYZE
+    slow_query_explain_interval: int = Field(default=600, env="SLOW_QUERY_EXPLAIN_INTERVAL")  # секунд между EXPLAIN одного отпечатка
+    slow_query_explain_timeout_ms: int = Field(default=5000, env="SLOW_QUERY_EXPLAIN_TIMEOUT_MS")
     
     # Кэширование
     redis_url: Optional[str] = Field(default=None, env="REDIS_URL")
@@ -71,9 +91,50 @@ class Settings(BaseSettings):
     # Уведомления
     notification_queue_size: int = Field(default=1000, env="NOTIFICATION_QUEUE_SIZE")
     
+    # WebSocket
+    websocket_send_queue_size: int = Field(default=256, env="WEBSOCKET_SEND_QUEUE_SIZE")
+    websocket_overflow_policy: str = Field(default="drop_oldest", env="WEBSOCKET_OVERFLOW_POLICY")  # drop_oldest, drop_newest, disconnect
+    websocket_heartbeat_interval: float = Field(default=30.0, env="WEBSOCKET_HEARTBEAT_INTERVAL")  # секунды
+    websocket_idle_timeout: float = Field(default=90.0, env="WEBSOCKET_IDLE_TIMEOUT")  # секунды
+    websocket_send_timeout: float = Field(default=5.0, env="WEBSOCKET_SEND_TIMEOUT")  # секунды на ping/закрытие в heartbeat чата
+    websocket_max_subscription_length: int = Field(default=128, env="WEBSOCKET_MAX_SUBSCRIPTION_LENGTH")
+    websocket_max_subscriptions: int = Field(default=64, env="WEBSOCKET_MAX_SUBSCRIPTIONS")  # на соединение
+    
+    # Чат: групповая запись сообщений, кэш участников, архив, поиск
+    chat_write_batch_size: int = Field(default=100, env="CHAT_WRITE_BATCH_SIZE")
+    chat_write_batch_interval_ms: float = Field(default=5.0, env="CHAT_WRITE_BATCH_INTERVAL_MS")
+    chat_write_queue_size: int = Field(default=1000, env="CHAT_WRITE_QUEUE_SIZE")  # принятых, но не записанных сообщений на воркер
+    chat_membership_cache_size: int = Field(default=10000, env="CHAT_MEMBERSHIP_CACHE_SIZE")
+    chat_membership_warm_limit: int = Field(default=200, env="CHAT_MEMBERSHIP_WARM_LIMIT")  # чатов при подключении WebSocket
+    chat_archive_dir: str = Field(default="archive/chat", env="CHAT_ARCHIVE_DIR")  # относительно каталога backend
+    chat_archive_days: int = Field(default=90, env="CHAT_ARCHIVE_DAYS")
+    chat_archive_batch_size: int = Field(default=1000, env="CHAT_ARCHIVE_BATCH_SIZE")
+    chat_search_batch_size: int = Field(default=500, env="CHAT_SEARCH_BATCH_SIZE")
+    chat_search_index_interval: float = Field(default=2.0, env="CHAT_SEARCH_INDEX_INTERVAL")  # секунды
+    
     # Модерация
     auto_moderation: bool = Field(default=True, env="AUTO_MODERATION")
     moderation_threshold: float = Field(default=0.7, env="MODERATION_THRESHOLD")
+    moderation_workers: int = Field(default=0, env="MODERATION_WORKERS")  # процессов на веб-воркер, 0 - проверка в потоке (см. gunicorn.conf.py)
+    moderation_queue_size: int = Field(default=10000, env="MODERATION_QUEUE_SIZE")
+    moderation_batch_size: int = Field(default=64, env="MODERATION_BATCH_SIZE")
+    moderation_batch_interval_ms: float = Field(default=50.0, env="MODERATION_BATCH_INTERVAL_MS")
+    near_duplicate_threshold: float = Field(default=0.8, env="NEAR_DUPLICATE_THRESHOLD")  # сходство Жаккара
+    near_duplicate_window_seconds: float = Field(default=3600.0, env="NEAR_DUPLICATE_WINDOW_SECONDS")
+    near_duplicate_min_senders: int = Field(default=3, env="NEAR_DUPLICATE_MIN_SENDERS")
+    near_duplicate_max_entries: int = Field(default=100000, env="NEAR_DUPLICATE_MAX_ENTRIES")  # без Redis, ~90 МБ на воркер
+    near_duplicate_snapshot_path: str = Field(default="data/near_duplicates.bin", env="NEAR_DUPLICATE_SNAPSHOT_PATH")  # относительно каталога backend, + .<слот> воркера
+    near_duplicate_maintenance_interval: float = Field(default=300.0, env="NEAR_DUPLICATE_MAINTENANCE_INTERVAL")  # чистка и снимок, секунд
+    moderation_rules_poll_interval: float = Field(default=5.0, env="MODERATION_RULES_POLL_INTERVAL")  # секунды
+    moderation_rule_max_pattern_length: int = Field(default=300, env="MODERATION_RULE_MAX_PATTERN_LENGTH")
+    moderation_rule_trial_timeout: float = Field(default=1.0, env="MODERATION_RULE_TRIAL_TIMEOUT")  # секунды на пробный прогон
+    moderation_lease_seconds: int = Field(default=300, env="MODERATION_LEASE_SECONDS")  # аренда жалобы модератором
+    moderation_claim_limit: int = Field(default=50, env="MODERATION_CLAIM_LIMIT")
+    trust_score_cache_size: int = Field(default=10000, env="TRUST_SCORE_CACHE_SIZE")
+    trust_score_cache_ttl: float = Field(default=60.0, env="TRUST_SCORE_CACHE_TTL")  # секунды
+    
+    # Статистика: почасовые и суточные агрегаты
+    stats_hourly_retention_days: int = Field(default=14, env="STATS_HOURLY_RETENTION_DAYS")
     
     # Timezone настройки
     timezone: str = Field(default="Europe/Moscow", env="TIMEZONE")
@@ -92,6 +153,15 @@ class Settings(BaseSettings):
         except pytz.exceptions.UnknownTimeZoneError:
             return "Europe/Moscow"  # Fallback на московское время
     
+    @validator('chat_archive_dir', 'near_duplicate_snapshot_path')
+    def resolve_backend_path(cls, v):
+        """Абсолютный путь: веб-воркеры, cron-скрипты и тесты запускаются из разных каталогов"""
+        path = os.path.expanduser(v)
+        if not os.path.isabs(path):
+            backend_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            path = os.path.join(backend_dir, path)
+        return os.path.normpath(path)
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
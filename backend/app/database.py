@@ -40,7 +40,7 @@ def init_db():
     """Инициализация базы данных"""
     try:
         # Импорт всех моделей для создания таблиц
-        from .models import user, ride, chat, upload, notification, moderation, rating
+        from .models import user, ride, chat, upload, notification, moderation, rating, stats
         
         # Создание всех таблиц
         Base.metadata.create_all(bind=engine)
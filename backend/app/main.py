@@ -1,18 +1,22 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import logging
 import os
 import sys
 import time
+from typing import Optional
 
 from .config.settings import get_settings, settings
-from .database import init_db, check_db_connection
+from .database import engine, init_db, check_db_connection
 from .api import auth, rides, profile, chat, upload, notifications, moderation, rating, monitoring, cache
 from .middleware.performance import PerformanceMiddleware, MemoryMonitor
 from .middleware.rate_limit import rate_limit_middleware
 from .utils.logger import get_logger, performance_logger
 from .monitoring.metrics import metrics_collector, api_metrics
+from .monitoring import prometheus
+from .monitoring.db_queries import query_tracker
+from .monitoring.slow_queries import slow_query_log
 
 # Настройка логирования с использованием новой системы
 logger = get_logger("main")
@@ -26,6 +30,12 @@ app = FastAPI(
     redoc_url="/redoc" if settings.debug else None
 )
 
+# События пула соединений БД для /metrics и замер всех SQL-запросов
+prometheus.instrument_db_pool(engine)
+query_tracker.install(engine)
+slow_query_log.install(engine)
+query_tracker.add_slow_query_handler(slow_query_log.record)
+
 # Добавляем middleware производительности
 app.add_middleware(PerformanceMiddleware)
 
@@ -108,6 +118,26 @@ async def startup_event():
         # Логируем использование памяти при запуске
         MemoryMonitor.log_memory_usage("startup")
         
+        # Периодический сброс гистограмм времени ответа в общий Redis
+        api_metrics.latency.start()
+        
+        # Словари stats кэша и WebSocket переносятся в метрики Prometheus
+        from .utils.cache_manager import cache_manager
+        from .utils.websocket_manager import websocket_manager
+        from .api.chat import manager as chat_connection_manager
+        prometheus.stats_exporter.register("cache", lambda: cache_manager.stats, prometheus.CACHE_OPERATIONS)
+        prometheus.stats_exporter.register(
+            "websocket", lambda: websocket_manager.stats, prometheus.WEBSOCKET_EVENTS,
+            labels=("notifications",), gauges={"active_connections": prometheus.WEBSOCKET_CONNECTIONS}
+        )
+        prometheus.stats_exporter.register(
+            "chat_websocket",
+            lambda: {**chat_connection_manager.stats, "active_connections": len(chat_connection_manager.active_connections)},
+            prometheus.WEBSOCKET_EVENTS,
+            labels=("chat",), gauges={"active_connections": prometheus.WEBSOCKET_CONNECTIONS}
+        )
+        prometheus.stats_exporter.start()
+        
         # Проверка подключения к базе данных
         logger.info("Проверка подключения к базе данных...")
         if not check_db_connection():
@@ -125,6 +155,23 @@ async def startup_event():
         init_db()
         logger.info("База данных инициализирована")
         
+        # Правила модерации из базы собираются в автомат проверки текста
+        from .database import SessionLocal
+        from .services.moderation_service import moderation_service
+        db = SessionLocal()
+        try:
+            moderation_service.load_rules(db)
+        finally:
+            db.close()
+        
+        # Конвейер модерации: пул процессов получает загруженные правила
+        from .services.moderation_pipeline import moderation_pipeline
+        moderation_pipeline.start()
+        
+        # Фоновое индексирование сообщений чата для поиска
+        from .services.chat_search import chat_search_index
+        chat_search_index.start()
+        
         # Логируем время запуска
         startup_duration = (time.time() - start_time) * 1000
         performance_logger.api_request(
@@ -157,6 +204,26 @@ async def shutdown_event():
         # Логируем использование памяти при остановке
         MemoryMonitor.log_memory_usage("shutdown")
         
+        # Остановка WebSocket heartbeat
+        from .utils.websocket_manager import websocket_manager
+        from .api.chat import manager as chat_connection_manager
+        await websocket_manager.stop_heartbeat()
+        await chat_connection_manager.stop_heartbeat()
+        
+        # Дописываем сообщения чата, принятые в очередь групповой записи
+        from .services.chat_writer import chat_message_writer
+        await chat_message_writer.stop()
+        
+        from .services.chat_search import chat_search_index
+        await chat_search_index.stop()
+        
+        from .services.moderation_pipeline import moderation_pipeline
+        await moderation_pipeline.stop()
+        
+        await api_metrics.latency.stop()
+        await prometheus.stats_exporter.stop()
+        slow_query_log.stop()
+        
         # Закрытие сессии уведомлений
         from .services.notification_service import notification_service
         await notification_service.close_session()
@@ -208,6 +275,17 @@ async def api_info():
         }
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(authorization: Optional[str] = Header(None)):
+    """Метрики в формате Prometheus (все воркеры в режиме нескольких процессов)
+
+    Доступ только сборщику с токеном METRICS_TOKEN, иначе 404.
+    """
+    if not settings.enable_metrics or not prometheus.scrape_allowed(authorization):
+        raise HTTPException(status_code=404, detail="Not Found")
+    content, content_type = prometheus.render_metrics()
+    return Response(content=content, media_type=content_type)
+
 @app.get("/api/metrics")
 async def get_metrics():
     """Метрики производительности приложения"""
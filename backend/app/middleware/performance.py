@@ -1,73 +1,107 @@
+import re
 import time
-import os
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+import uuid
+from typing import Optional
+from urllib.parse import parse_qs
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
 from ..utils.logger import performance_logger, get_logger
+from ..monitoring.metrics import api_metrics
+from ..monitoring.latency import UNMATCHED_ROUTE
+from ..monitoring.prometheus import HTTP_REQUESTS_IN_PROGRESS, method_label, observe_http_request
+from ..monitoring.db_queries import current_queries, query_tracker
+from ..config.settings import settings
 
 logger = get_logger("performance_middleware")
 
-class PerformanceMiddleware(BaseHTTPMiddleware):
-    """Middleware для мониторинга производительности API"""
+REQUEST_ID_HEADER = b"x-request-id"
+# Входящий X-Request-ID (от nginx или клиента) принимается, только если он короткий и безопасный
+REQUEST_ID_PATTERN = re.compile(rb"^[A-Za-z0-9._-]{1,64}$")
+
+def route_template(scope: Scope) -> str:
+    """Шаблон сопоставленного маршрута (/api/rides/{ride_id}) вместо конкретного URL"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+def request_id_from(scope: Scope) -> str:
+    for name, value in scope.get("headers", ()):
+        if name == REQUEST_ID_HEADER:
+            if REQUEST_ID_PATTERN.match(value):
+                return value.decode("ascii")
+            break
+    return uuid.uuid4().hex
+
+def query_user_id(scope: Scope) -> Optional[str]:
+    query_string = scope.get("query_string", b"")
+    if b"user_id=" not in query_string:
+        return None
+    values = parse_qs(query_string.decode("latin-1")).get("user_id")
+    return values[0] if values else None
+
+class PerformanceMiddleware:
+    """ASGI middleware для мониторинга производительности API
+
+    Работает напрямую с ASGI-сообщениями, без BaseHTTPMiddleware: тело ответа
+    не буферизуется и не проходит через отдельную задачу, потоковые ответы
+    отдаются как есть. Время - по монотонным часам, метка запроса - шаблон
+    маршрута. X-Response-Time - время до начала ответа, в метрики и лог идет
+    полное время до отправки тела. Server-Timing - число и время SQL-запросов,
+    выполненных до начала ответа.
+    """
     
-    async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # Получаем информацию о запросе
-        method = request.method
-        url = str(request.url)
-        user_id = None
+        start = time.perf_counter()
+        method = scope["method"]
+        request_id = request_id_from(scope)
+        # Доступен обработчикам как request.state.request_id
+        scope.setdefault("state", {})["request_id"] = request_id
+        status_code = 500
         
-        # Пытаемся получить user_id из заголовков или параметров
-        try:
-            # Проверяем заголовки авторизации
-            auth_header = request.headers.get("authorization")
-            if auth_header:
-                # Здесь можно добавить логику извлечения user_id из токена
-                pass
-            
-            # Проверяем параметры запроса
-            if "user_id" in request.query_params:
-                user_id = request.query_params.get("user_id")
-        except Exception as e:
-            logger.debug(f"Не удалось получить user_id: {str(e)}")
+        async def send_with_headers(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Response-Time", f"{(time.perf_counter() - start) * 1000:.2f}ms")
+                headers.append("X-Request-ID", request_id)
+                queries = current_queries.get()
+                if settings.db_server_timing and queries is not None:
+                    headers.append("Server-Timing", queries.server_timing())
+            await send(message)
         
-        # Выполняем запрос
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method_label(method))
+        in_progress.inc()
+        queries_token = query_tracker.begin()
         try:
-            response = await call_next(request)
-            
-            # Рассчитываем время выполнения
-            duration_ms = (time.time() - start_time) * 1000
-            
-            # Логируем производительность
-            performance_logger.api_request(
-                endpoint=url,
-                method=method,
-                duration_ms=duration_ms,
-                status_code=response.status_code,
-                user_id=user_id
-            )
-            
-            # Добавляем заголовки с метриками
-            response.headers["X-Response-Time"] = f"{duration_ms:.2f}ms"
-            response.headers["X-Request-ID"] = str(int(start_time * 1000))
-            
-            return response
-            
+            await self.app(scope, receive, send_with_headers)
         except Exception as e:
-            # Рассчитываем время до ошибки
-            duration_ms = (time.time() - start_time) * 1000
+            # Если ответ еще не начат, в метрики попадет 500
+            logger.error(f"Ошибка обработки запроса {request_id}: {str(e)}")
+            raise
+        finally:
+            in_progress.dec()
+            duration_ms = (time.perf_counter() - start) * 1000
+            route = route_template(scope)
+            query_tracker.finish(queries_token, method, route)
             
-            # Логируем ошибку
             performance_logger.api_request(
-                endpoint=url,
+                endpoint=route,
                 method=method,
                 duration_ms=duration_ms,
-                status_code=500,
-                user_id=user_id
+                status_code=status_code,
+                user_id=query_user_id(scope)
             )
-            
-            logger.error(f"Ошибка в middleware производительности: {str(e)}")
-            raise
+            api_metrics.record_request(route, method, status_code, duration_ms)
+            observe_http_request(method, route, status_code, duration_ms / 1000)
 
 class MemoryMonitor:
     """Монитор использования памяти (без psutil)"""
@@ -95,41 +129,3 @@ class MemoryMonitor:
             performance_logger.memory_usage(memory_mb, component)
         except Exception as e:
             logger.error(f"Ошибка логирования использования памяти: {str(e)}")
-
-class DatabasePerformanceMonitor:
-    """Монитор производительности базы данных"""
-    
-    def __init__(self):
-        self.query_times = {}
-    
-    def start_query(self, query_type: str, table: str):
-        """Начать отслеживание запроса"""
-        query_key = f"{query_type}_{table}_{int(time.time() * 1000)}"
-        self.query_times[query_key] = {
-            "type": query_type,
-            "table": table,
-            "start_time": time.time()
-        }
-        return query_key
-    
-    def end_query(self, query_key: str, result_count: int = 0):
-        """Завершить отслеживание запроса"""
-        if query_key in self.query_times:
-            query_info = self.query_times[query_key]
-            duration_ms = (time.time() - query_info["start_time"]) * 1000
-            
-            performance_logger.database_performance(
-                operation=query_info["type"],
-                table=query_info["table"],
-                duration_ms=duration_ms,
-                rows_affected=result_count
-            )
-            
-            del self.query_times[query_key]
-    
-    def get_active_queries(self) -> dict:
-        """Получить активные запросы"""
-        return self.query_times.copy()
-
-# Глобальный экземпляр монитора БД
-db_monitor = DatabasePerformanceMonitor() 
\ No newline at end of file
@@ -13,6 +13,7 @@ import json
 
 from ..config.settings import settings
 from ..utils.logger import get_logger
+from ..monitoring.prometheus import RATE_LIMIT_DECISIONS
 
 logger = get_logger("rate_limit")
 
@@ -175,6 +176,9 @@ async def rate_limit_middleware(request: Request, call_next):
         # Проверяем rate limit
         allowed, limit_info = rate_limiter.check_rate_limit(identifier, endpoint)
         
+        # degraded - Redis недоступен, запрос пропущен без проверки
+        result = "limited" if not allowed else ("degraded" if "error" in limit_info else "allowed")
+        RATE_LIMIT_DECISIONS.labels(endpoint, result).inc()
         if not allowed:
             logger.warning(f"Rate limit превышен для {identifier} на {endpoint}")
             
@@ -205,5 +209,6 @@ async def rate_limit_middleware(request: Request, call_next):
         
     except Exception as e:
         logger.error(f"Ошибка rate limiting middleware: {e}")
+        RATE_LIMIT_DECISIONS.labels("unknown", "error").inc()
         # В случае ошибки пропускаем запрос
         return await call_next(request) 
\ No newline at end of file
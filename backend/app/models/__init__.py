@@ -5,5 +5,6 @@ from .chat import Chat, ChatMessage
 
 from .upload import Upload
 from .notification import NotificationLog, NotificationSettings
-from .moderation import ModerationReport, ModerationAction, ModerationRule, ContentFilter, TrustScore
+from .moderation import ModerationReport, ModerationAction, ModerationRule, ModerationRulesVersion, ContentFilter, TrustScore
 from .rating import Rating, Review
+from .stats import StatRollup
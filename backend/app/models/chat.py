@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Index
 from sqlalchemy.orm import relationship
 from app.database import Base
 import datetime
@@ -12,6 +12,10 @@ class Chat(Base):
     user2_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    # Последний выданный порядковый номер сообщения в чате
+    last_seq = Column(Integer, default=0, nullable=False, server_default="0")
+    # Наибольший id сообщения, перенесенного в архив (0 - архива нет)
+    archived_max_id = Column(Integer, default=0, nullable=False, server_default="0")
     
     # Отношения
     ride = relationship("Ride", back_populates="chats")
@@ -30,8 +34,17 @@ class ChatMessage(Base):
     is_read = Column(Boolean, default=False)
     read_at = Column(DateTime, nullable=True)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    # Монотонно растущий номер сообщения внутри чата (для докачки после переподключения)
+    seq = Column(Integer, nullable=True)
     
     # Отношения
     chat = relationship("Chat", back_populates="messages")
     user_from = relationship("User", foreign_keys=[user_from_id])
-    user_to = relationship("User", foreign_keys=[user_to_id]) 
\ No newline at end of file
+    user_to = relationship("User", foreign_keys=[user_to_id]) 
+    
+    __table_args__ = (
+        # Диапазонный запрос "сообщения чата после seq N"
+        Index('idx_chat_messages_chat_seq', 'chat_id', 'seq', unique=True),
+        # Постраничная история чата по курсору before_id/after_id
+        Index('idx_chat_messages_chat_id_id', 'chat_id', 'id'),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, JSON, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, JSON, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from ..database import Base
@@ -8,7 +8,7 @@ class ModerationReport(Base):
     __tablename__ = 'moderation_reports'
     
     id = Column(Integer, primary_key=True, index=True)
-    reporter_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    reporter_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # NULL - автоматическая модерация
     target_type = Column(String, nullable=False)  # 'user', 'ride', 'message'
     target_id = Column(Integer, nullable=False)
     reason = Column(String, nullable=False)  # 'spam', 'inappropriate', 'fraud', 'other'
@@ -17,8 +17,15 @@ class ModerationReport(Base):
     created_at = Column(DateTime, default=func.now())
     resolved_at = Column(DateTime)
     
+    # Очередь модерации: приоритет и аренда жалобы модератором
+    score = Column(Integer, default=0)  # Скор автомодерации
+    target_reports = Column(Integer, default=1)  # Жалоб на ту же цель в очереди
+    claimed_by = Column(Integer, ForeignKey('users.id'), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)  # После истечения жалоба возвращается в очередь
+    
     # Связи
     reporter = relationship("User", foreign_keys=[reporter_id])
+    moderator = relationship("User", foreign_keys=[claimed_by])
     actions = relationship("ModerationAction", back_populates="report")
     
     def to_dict(self):
@@ -31,9 +38,27 @@ class ModerationReport(Base):
             "description": self.description,
             "status": self.status,
             "created_at": self.created_at.isoformat() if self.created_at else None,
-            "resolved_at": self.resolved_at.isoformat() if self.resolved_at else None
+            "resolved_at": self.resolved_at.isoformat() if self.resolved_at else None,
+            "score": self.score,
+            "target_reports": self.target_reports,
+            "claimed_by": self.claimed_by,
+            "lease_expires_at": self.lease_expires_at.isoformat() if self.lease_expires_at else None
         }
 
+# Очередь модерации: частичный индекс только по ожидающим жалобам в порядке выдачи
+Index(
+    'idx_moderation_reports_queue',
+    ModerationReport.score.desc(), ModerationReport.target_reports.desc(), ModerationReport.created_at,
+    postgresql_where=ModerationReport.status == 'pending',
+    sqlite_where=ModerationReport.status == 'pending'
+)
+Index(
+    'idx_moderation_reports_target_pending',
+    ModerationReport.target_type, ModerationReport.target_id,
+    postgresql_where=ModerationReport.status == 'pending',
+    sqlite_where=ModerationReport.status == 'pending'
+)
+
 class ModerationAction(Base):
     __tablename__ = 'moderation_actions'
     
@@ -84,6 +109,14 @@ class ModerationRule(Base):
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
 
+class ModerationRulesVersion(Base):
+    """Счетчик изменений moderation_rules (одна строка, id = 1)"""
+    __tablename__ = 'moderation_rules_version'
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now())
+
 class ContentFilter(Base):
     __tablename__ = 'content_filters'
     
@@ -113,6 +146,7 @@ class TrustScore(Base):
     level = Column(String, default='medium')  # 'low', 'medium', 'high', 'suspicious'
     warnings_count = Column(Integer, default=0)
     reports_count = Column(Integer, default=0)
+    age_bonus = Column(Integer, default=0)  # Бонус за возраст аккаунта, обновляется ежедневно
     last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
     
     # Связи
@@ -126,5 +160,6 @@ class TrustScore(Base):
             "level": self.level,
             "warnings_count": self.warnings_count,
             "reports_count": self.reports_count,
+            "age_bonus": self.age_bonus,
             "last_updated": self.last_updated.isoformat() if self.last_updated else None
         } 
\ No newline at end of file
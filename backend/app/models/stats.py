@@ -0,0 +1,29 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, Index
+from ..database import Base
+
+class StatRollup(Base):
+    """Счетчик метрики за час или сутки (агрегаты для статистики и дашбордов)"""
+    __tablename__ = 'stat_rollups'
+    
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String, nullable=False)  # 'hour', 'day'
+    bucket_start = Column(DateTime, nullable=False)  # Начало часа или суток
+    metric = Column(String, nullable=False)  # 'moderation.reports', 'ratings', ...
+    dimension = Column(String, nullable=False, default='')  # Разрез: действие модератора, число звезд
+    count = Column(BigInteger, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0.0)  # Сумма значений (например, звезд) для средних
+    
+    __table_args__ = (
+        Index('idx_stat_rollups_bucket', 'granularity', 'metric', 'dimension', 'bucket_start', unique=True),
+        Index('idx_stat_rollups_metric_time', 'granularity', 'metric', 'bucket_start'),
+    )
+    
+    def to_dict(self):
+        return {
+            "granularity": self.granularity,
+            "bucket_start": self.bucket_start.isoformat() if self.bucket_start else None,
+            "metric": self.metric,
+            "dimension": self.dimension,
+            "count": self.count,
+            "total": self.total
+        }
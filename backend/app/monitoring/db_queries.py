@@ -0,0 +1,224 @@
+"""
+Учет SQL-запросов по событиям движка SQLAlchemy
+before/after_cursor_execute замеряют каждый запрос без ручной разметки в
+сервисах. В рамках HTTP запроса (ContextVar) копятся число запросов, время
+в БД и отпечатки запросов: SQL без литералов и значений параметров. Один
+отпечаток SELECT, повторенный много раз, - признак N+1. Итоги уходят в
+заголовок Server-Timing, метрики Prometheus и сводку по отпечаткам.
+"""
+
+import re
+import time
+from contextvars import ContextVar, Token
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from ..config.settings import settings
+from ..utils.logger import get_logger
+from .prometheus import (
+    DB_N_PLUS_ONE_SUSPECTED, DB_QUERIES, DB_QUERIES_PER_REQUEST, DB_QUERY_DURATION
+)
+
+logger = get_logger("db_queries")
+
+OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+|\?")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_LIST = re.compile(r"\)(?:\s*,\s*\([?,\s]*\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    """SQL без литералов и параметров: одинаковый для запросов, отличающихся значениями
+
+    Списки IN (?, ?, ...) и многострочные VALUES сворачиваются, чтобы
+    размер пачки не порождал новые отпечатки.
+    """
+    sql = _STRING_LITERAL.sub("?", statement)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    sql = _VALUES_LIST.sub(")", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+def operation(statement: str) -> str:
+    word = statement.lstrip()[:6].upper()
+    return word if word in OPERATIONS else "OTHER"
+
+class RequestQueries:
+    """Запросы одного HTTP запроса"""
+
+    __slots__ = ("count", "total_ms", "fingerprints")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        # отпечаток -> [число, суммарное время, мс]
+        self.fingerprints: Dict[str, List[float]] = {}
+
+    def record(self, sql: str, duration_ms: float):
+        self.count += 1
+        self.total_ms += duration_ms
+        entry = self.fingerprints.get(sql)
+        if entry is None:
+            self.fingerprints[sql] = [1, duration_ms]
+        else:
+            entry[0] += 1
+            entry[1] += duration_ms
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int, float]]:
+        """Отпечатки SELECT, выполненные не меньше threshold раз (подозрение на N+1)"""
+        return sorted(
+            ((sql, int(count), total) for sql, (count, total) in self.fingerprints.items()
+             if count >= threshold and sql[:6].upper() == "SELECT"),
+            key=lambda item: -item[1]
+        )
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.total_ms:.2f};desc="{self.count} queries"'
+
+# Учет текущего HTTP запроса; в потоки пула контекст копируется вместе со ссылкой
+current_queries: ContextVar[Optional[RequestQueries]] = ContextVar("current_queries", default=None)
+
+# (statement, parameters, executemany, отпечаток, время в мс)
+SlowQueryHandler = Callable[[str, Any, bool, str, float], None]
+
+class QueryTracker:
+    """Замер запросов движка и сводка по отпечаткам"""
+
+    def __init__(self):
+        self.query_budget = settings.db_query_budget
+        self.n_plus_one_threshold = settings.db_n_plus_one_threshold
+        self.max_fingerprints = settings.db_fingerprint_stats_size
+        self.slow_query_threshold_ms = settings.slow_query_threshold_ms
+        self.slow_query_handlers: List[SlowQueryHandler] = []
+        # отпечаток -> [число, суммарное время, мс, максимум, мс]
+        self.fingerprints: Dict[str, List[float]] = {}
+        self.stats = {
+            'queries': 0,
+            'requests': 0,
+            'budget_exceeded': 0,
+            'n_plus_one_suspected': 0,
+            'fingerprints_dropped': 0
+        }
+
+    def install(self, engine):
+        """Подписывается на события выполнения запросов движка"""
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def add_slow_query_handler(self, handler: SlowQueryHandler):
+        """Обработчик запросов дольше slow_query_threshold_ms (вызывается в потоке запроса)"""
+        self.slow_query_handlers.append(handler)
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Контекст выполнения свой у каждого запроса: при ошибке метка просто пропадает
+        context._query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        self.record(statement, duration * 1000, parameters, executemany)
+
+    def record(self, statement: str, duration_ms: float, parameters: Any = None, executemany: bool = False):
+        sql = fingerprint(statement)
+        DB_QUERIES.labels(operation(statement)).inc()
+        DB_QUERY_DURATION.observe(duration_ms / 1000)
+        self.stats['queries'] += 1
+
+        entry = self.fingerprints.get(sql)
+        if entry is None:
+            if len(self.fingerprints) >= self.max_fingerprints:
+                self.stats['fingerprints_dropped'] += 1
+            else:
+                self.fingerprints[sql] = [1, duration_ms, duration_ms]
+        else:
+            entry[0] += 1
+            entry[1] += duration_ms
+            entry[2] = max(entry[2], duration_ms)
+
+        queries = current_queries.get()
+        if queries is not None:
+            queries.record(sql, duration_ms)
+
+        if duration_ms >= self.slow_query_threshold_ms:
+            for handler in self.slow_query_handlers:
+                try:
+                    handler(statement, parameters, executemany, sql, duration_ms)
+                except Exception as e:
+                    logger.warning(f"Ошибка обработчика медленного запроса: {e}")
+
+    def begin(self) -> Token:
+        """Начинает учет запросов HTTP запроса"""
+        return current_queries.set(RequestQueries())
+
+    def finish(self, token: Token, method: str, route: str) -> Optional[RequestQueries]:
+        """Завершает учет: бюджет запросов и поиск N+1"""
+        queries = current_queries.get()
+        current_queries.reset(token)
+        if queries is None:
+            return None
+
+        self.stats['requests'] += 1
+        DB_QUERIES_PER_REQUEST.observe(queries.count)
+        if queries.count > self.query_budget:
+            self.stats['budget_exceeded'] += 1
+            logger.warning("Превышен бюджет запросов к БД", {
+                "method": method,
+                "route": route,
+                "queries": queries.count,
+                "budget": self.query_budget,
+                "db_time_ms": round(queries.total_ms, 2)
+            })
+
+        repeated = queries.repeated(self.n_plus_one_threshold)
+        if repeated:
+            self.stats['n_plus_one_suspected'] += 1
+            DB_N_PLUS_ONE_SUSPECTED.labels(route).inc()
+            sql, count, total = repeated[0]
+            logger.warning("Подозрение на N+1 запросы", {
+                "method": method,
+                "route": route,
+                "fingerprint": sql,
+                "repeats": count,
+                "repeated_time_ms": round(total, 2),
+                "queries": queries.count
+            })
+        return queries
+
+    def top(self, limit: int = 20, order_by: str = "total_ms") -> List[Dict[str, Any]]:
+        """Отпечатки с наибольшим суммарным временем (или числом выполнений)"""
+        rows = [
+            {
+                "fingerprint": sql,
+                "count": int(count),
+                "total_ms": round(total, 2),
+                "avg_ms": round(total / count, 3),
+                "max_ms": round(maximum, 2)
+            }
+            for sql, (count, total, maximum) in list(self.fingerprints.items())
+        ]
+        rows.sort(key=lambda row: row.get(order_by, 0), reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        self.fingerprints.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'fingerprints': len(self.fingerprints),
+            'query_budget': self.query_budget,
+            'n_plus_one_threshold': self.n_plus_one_threshold
+        }
+
+# Глобальный учет запросов к БД
+query_tracker = QueryTracker()
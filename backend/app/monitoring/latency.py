@@ -0,0 +1,332 @@
+"""
+Потоковые гистограммы времени ответа
+Логарифмические корзины с ограниченной относительной ошибкой (как в HDR
+Histogram / DDSketch): память не зависит от числа запросов, квантили
+p50/p90/p99/p999 читаются из счетчиков корзин, две гистограммы складываются
+покорзинно. Каждый воркер копит приращения и периодически сбрасывает их
+в Redis (HINCRBY), поэтому сводная гистограмма маршрута общая для всех воркеров.
+"""
+
+import asyncio
+import json
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import redis
+
+from ..config.settings import settings
+from ..utils.logger import get_logger
+
+logger = get_logger("latency")
+
+# Диапазон значений, мс: меньшие попадают в нулевую корзину, большие - в последнюю
+MIN_VALUE_MS = 0.01
+MAX_VALUE_MS = 10 * 60 * 1000
+
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99), ("p999", 0.999))
+
+# Метка маршрута для запросов, не сопоставленных ни одному маршруту (404):
+# сырой URL как метка дал бы неограниченное число гистограмм
+UNMATCHED_ROUTE = "unmatched"
+
+LatencyKey = Tuple[str, str, str]  # (метод, шаблон маршрута, класс статуса)
+
+def status_class(status_code: int) -> str:
+    return f"{status_code // 100}xx"
+
+class LatencyHistogram:
+    """Гистограмма с логарифмическими корзинами
+
+    Корзина i покрывает (MIN_VALUE_MS * gamma^(i-1), MIN_VALUE_MS * gamma^i],
+    gamma = (1 + e) / (1 - e): любое значение восстанавливается с относительной
+    ошибкой не больше e. При e = 1% диапазон до 10 минут занимает не больше
+    ~900 корзин, хранятся только непустые.
+    """
+
+    __slots__ = ("relative_error", "gamma", "_log_gamma", "_max_index",
+                 "buckets", "count", "sum", "min", "max")
+
+    def __init__(self, relative_error: float = 0.01):
+        self.relative_error = relative_error
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self._log_gamma = math.log(self.gamma)
+        self._max_index = self.index(MAX_VALUE_MS)
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def index(self, value: float) -> int:
+        if value <= MIN_VALUE_MS:
+            return 0
+        return math.ceil(math.log(value / MIN_VALUE_MS) / self._log_gamma)
+
+    def value(self, index: int) -> float:
+        """Представитель корзины (середина в смысле относительной ошибки)"""
+        if index <= 0:
+            return MIN_VALUE_MS
+        return MIN_VALUE_MS * self.gamma ** index * 2 / (1 + self.gamma)
+
+    def record(self, value: float):
+        value = max(value, 0.0)
+        index = min(self.index(value), self._max_index)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def add_buckets(self, buckets: Dict[int, int], total: float):
+        """Добавляет счетчики корзин (приращения из Redis или другой гистограммы)"""
+        for index, count in buckets.items():
+            if count:
+                self.buckets[index] = self.buckets.get(index, 0) + count
+                self.count += count
+        self.sum += total
+        # Границы - по представителям крайних корзин (точность та же, что у квантилей)
+        occupied = [index for index, count in buckets.items() if count]
+        if occupied:
+            self.min = min(self.min, self.value(min(occupied)))
+            self.max = max(self.max, self.value(max(occupied)))
+
+    def merge(self, other: "LatencyHistogram"):
+        if other.relative_error != self.relative_error:
+            raise ValueError("Гистограммы с разной точностью нельзя объединить")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantiles(self, fractions: Iterable[float]) -> List[Optional[float]]:
+        """Квантили за один проход по корзинам"""
+        fractions = list(fractions)
+        if not self.count:
+            return [None] * len(fractions)
+        ranks = sorted((max(0, math.ceil(fraction * self.count) - 1), position)
+                       for position, fraction in enumerate(fractions))
+        result: List[Optional[float]] = [None] * len(fractions)
+        seen = 0
+        pending = iter(ranks)
+        rank, position = next(pending)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            while seen > rank:
+                # Точные min и max не хуже представителя корзины
+                result[position] = min(max(self.value(index), self.min), self.max)
+                following = next(pending, None)
+                if following is None:
+                    return result
+                rank, position = following
+        return result
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        return self.quantiles([fraction])[0]
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.count:
+            return {"count": 0, "avg": 0.0, "min": 0.0, "max": 0.0,
+                    **{name: 0.0 for name, _ in QUANTILES}}
+        values = self.quantiles(fraction for _, fraction in QUANTILES)
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 3),
+            "min": round(self.min, 3),
+            "max": round(self.max, 3),
+            **{name: round(value, 3) for (name, _), value in zip(QUANTILES, values)}
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "relative_error": self.relative_error,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max,
+            "buckets": {str(index): count for index, count in self.buckets.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencyHistogram":
+        histogram = cls(data["relative_error"])
+        histogram.buckets = {int(index): int(count) for index, count in data["buckets"].items()}
+        histogram.count = int(data["count"])
+        histogram.sum = float(data["sum"])
+        histogram.min = math.inf if data.get("min") is None else float(data["min"])
+        histogram.max = float(data["max"])
+        return histogram
+
+class RedisLatencyBackend:
+    """Сводные гистограммы в Redis: хэш на ключ, поле на корзину"""
+
+    key_prefix = "latency:"
+
+    def __init__(self, client: "redis.Redis"):
+        self.client = client
+
+    @property
+    def keys_key(self) -> str:
+        return f"{self.key_prefix}keys"
+
+    def _histogram_key(self, label: str) -> str:
+        return f"{self.key_prefix}hist:{label}"
+
+    def push(self, deltas: Dict[LatencyKey, LatencyHistogram]):
+        pipe = self.client.pipeline(transaction=False)
+        for key, histogram in deltas.items():
+            label = json.dumps(key, ensure_ascii=False)
+            redis_key = self._histogram_key(label)
+            pipe.sadd(self.keys_key, label)
+            for index, count in histogram.buckets.items():
+                pipe.hincrby(redis_key, f"b:{index}", count)
+            pipe.hincrbyfloat(redis_key, "sum", histogram.sum)
+        pipe.execute()
+
+    def read(self) -> Dict[LatencyKey, Tuple[Dict[int, int], float]]:
+        labels = [label.decode() if isinstance(label, bytes) else label
+                  for label in self.client.smembers(self.keys_key)]
+        pipe = self.client.pipeline(transaction=False)
+        for label in labels:
+            pipe.hgetall(self._histogram_key(label))
+
+        result: Dict[LatencyKey, Tuple[Dict[int, int], float]] = {}
+        for label, fields in zip(labels, pipe.execute()):
+            buckets: Dict[int, int] = {}
+            total = 0.0
+            for field, value in fields.items():
+                field = field.decode() if isinstance(field, bytes) else field
+                if field == "sum":
+                    total = float(value)
+                elif field.startswith("b:"):
+                    buckets[int(field[2:])] = int(value)
+            result[tuple(json.loads(label))] = (buckets, total)
+        return result
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{self.key_prefix}*", count=1000))
+        if keys:
+            self.client.delete(*keys)
+
+class LatencyHistograms:
+    """Гистограммы по (метод, шаблон маршрута, класс статуса)
+
+    local - накопленные этим воркером, pending - еще не сброшенные в Redis.
+    Без Redis сводная статистика совпадает с локальной.
+    """
+
+    def __init__(self):
+        self.relative_error = settings.latency_relative_error
+        self.flush_interval = settings.latency_flush_interval
+        self.local: Dict[LatencyKey, LatencyHistogram] = {}
+        self.pending: Dict[LatencyKey, LatencyHistogram] = {}
+        self.backend: Optional[RedisLatencyBackend] = None
+        self.flush_task: Optional[asyncio.Task] = None
+        self.stats = {
+            'recorded': 0,
+            'flushes': 0,
+            'flush_errors': 0
+        }
+
+        if settings.redis_url and settings.monitoring_use_redis:
+            try:
+                client = redis.from_url(settings.redis_url)
+                client.ping()
+                self.backend = RedisLatencyBackend(client)
+                logger.info("Гистограммы времени ответа объединяются через Redis")
+            except Exception as e:
+                logger.warning(f"Гистограммы времени ответа только локальные, Redis недоступен: {e}")
+
+    def _histogram(self, histograms: Dict[LatencyKey, LatencyHistogram], key: LatencyKey) -> LatencyHistogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = LatencyHistogram(self.relative_error)
+        return histogram
+
+    def record(self, method: str, route: str, status_code: int, duration_ms: float):
+        key = (method, route or UNMATCHED_ROUTE, status_class(status_code))
+        self._histogram(self.local, key).record(duration_ms)
+        if self.backend is not None:
+            self._histogram(self.pending, key).record(duration_ms)
+        self.stats['recorded'] += 1
+
+    def take_pending(self) -> Dict[LatencyKey, LatencyHistogram]:
+        """Забирает несброшенные приращения (вызывается в потоке цикла событий)"""
+        deltas, self.pending = self.pending, {}
+        return deltas
+
+    def flush(self, deltas: Optional[Dict[LatencyKey, LatencyHistogram]] = None):
+        """Сбрасывает приращения в Redis; при ошибке они вернутся к следующему сбросу"""
+        if self.backend is None:
+            return
+        if deltas is None:
+            deltas = self.take_pending()
+        if not deltas:
+            return
+        try:
+            self.backend.push(deltas)
+            self.stats['flushes'] += 1
+        except Exception as e:
+            self.stats['flush_errors'] += 1
+            logger.warning(f"Не удалось сбросить гистограммы в Redis: {e}")
+            for key, histogram in deltas.items():
+                self._histogram(self.pending, key).merge(histogram)
+
+    def snapshot(self, merged: bool = True) -> Dict[LatencyKey, LatencyHistogram]:
+        """Копии гистограмм: сводные по всем воркерам (merged) или только этого воркера"""
+        if not merged or self.backend is None:
+            return {key: self._copy(histogram) for key, histogram in self.local.items()}
+
+        result: Dict[LatencyKey, LatencyHistogram] = {}
+        try:
+            for key, (buckets, total) in self.backend.read().items():
+                self._histogram(result, key).add_buckets(buckets, total)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать гистограммы из Redis: {e}")
+            return {key: self._copy(histogram) for key, histogram in self.local.items()}
+        # Еще не сброшенные запросы этого воркера
+        for key, histogram in self.pending.items():
+            self._histogram(result, key).merge(histogram)
+        return result
+
+    def _copy(self, histogram: LatencyHistogram) -> LatencyHistogram:
+        copy = LatencyHistogram(self.relative_error)
+        copy.merge(histogram)
+        return copy
+
+    def clear(self):
+        self.local.clear()
+        self.pending.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def start(self):
+        """Запускает периодический сброс приращений в Redis"""
+        if self.backend is not None and (self.flush_task is None or self.flush_task.done()):
+            self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await asyncio.to_thread(self.flush, self.take_pending())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Забираем приращения до ухода в поток, чтобы record не писал в сбрасываемые
+            await asyncio.to_thread(self.flush, self.take_pending())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'histograms': len(self.local),
+            'pending': len(self.pending),
+            'backend': 'redis' if self.backend is not None else 'memory',
+            'relative_error': self.relative_error
+        }
@@ -11,6 +11,7 @@ except ImportError:
 
 from typing import Dict, Any, Optional
 from ..utils.logger import get_logger
+from .latency import LatencyHistogram, LatencyHistograms
 
 logger = get_logger("metrics")
 
@@ -68,63 +69,38 @@ class MetricsCollector:
         return time.time() - self.metrics["start_time"]
 
 class APIMetrics:
-    """Метрики API"""
+    """Метрики API: гистограммы времени ответа по шаблону маршрута и классу статуса"""
     
     def __init__(self):
-        self.endpoint_metrics = {}
-        self.response_times = []
+        self.latency = LatencyHistograms()
     
     def record_request(self, endpoint: str, method: str, status_code: int, duration_ms: float):
-        """Записать метрику запроса"""
-        key = f"{method}_{endpoint}"
-        
-        if key not in self.endpoint_metrics:
-            self.endpoint_metrics[key] = {
+        """Записать метрику запроса (endpoint - шаблон маршрута, например /api/rides/{ride_id})"""
+        self.latency.record(method, endpoint, status_code, duration_ms)
+    
+    def get_endpoint_metrics(self, merged: bool = True) -> Dict[str, Any]:
+        """Получить метрики по эндпоинтам: счетчики и квантили по классам статусов"""
+        endpoints: Dict[str, Any] = {}
+        for (method, route, status_class), histogram in sorted(self.latency.snapshot(merged).items()):
+            endpoint = endpoints.setdefault(f"{method} {route}", {
+                "method": method,
+                "route": route,
                 "count": 0,
-                "success_count": 0,
                 "error_count": 0,
-                "total_time": 0.0,
-                "min_time": float('inf'),
-                "max_time": 0.0,
-                "avg_time": 0.0
-            }
-        
-        metric = self.endpoint_metrics[key]
-        metric["count"] += 1
-        metric["total_time"] += duration_ms
-        
-        if 200 <= status_code < 400:
-            metric["success_count"] += 1
-        else:
-            metric["error_count"] += 1
-        
-        metric["min_time"] = min(metric["min_time"], duration_ms)
-        metric["max_time"] = max(metric["max_time"], duration_ms)
-        metric["avg_time"] = metric["total_time"] / metric["count"]
-        
-        # Сохраняем время ответа для статистики
-        self.response_times.append(duration_ms)
-        if len(self.response_times) > 1000:  # Ограничиваем историю
-            self.response_times.pop(0)
+                "statuses": {}
+            })
+            endpoint["count"] += histogram.count
+            if status_class in ("4xx", "5xx"):
+                endpoint["error_count"] += histogram.count
+            endpoint["statuses"][status_class] = histogram.summary()
+        return endpoints
     
-    def get_endpoint_metrics(self) -> Dict[str, Any]:
-        """Получить метрики по эндпоинтам"""
-        return self.endpoint_metrics.copy()
-    
-    def get_response_time_stats(self) -> Dict[str, float]:
-        """Получить статистику времени ответа"""
-        if not self.response_times:
-            return {"avg": 0.0, "min": 0.0, "max": 0.0, "p95": 0.0}
-        
-        sorted_times = sorted(self.response_times)
-        n = len(sorted_times)
-        
-        return {
-            "avg": sum(sorted_times) / n,
-            "min": sorted_times[0],
-            "max": sorted_times[-1],
-            "p95": sorted_times[int(n * 0.95)] if n > 0 else 0.0
-        }
+    def get_response_time_stats(self, merged: bool = True) -> Dict[str, float]:
+        """Получить статистику времени ответа по всем эндпоинтам"""
+        total = LatencyHistogram(self.latency.relative_error)
+        for histogram in self.latency.snapshot(merged).values():
+            total.merge(histogram)
+        return total.summary()
 
 # Глобальные экземпляры
 metrics_collector = MetricsCollector()
@@ -0,0 +1,225 @@
+"""
+Метрики Prometheus
+При заданном PROMETHEUS_MULTIPROC_DIR prometheus-client работает в режиме
+нескольких процессов: каждый воркер gunicorn пишет значения в свои mmap-файлы,
+а /metrics в любом воркере собирает их все через MultiProcessCollector.
+Метки ограничены: шаблон маршрута вместо URL, класс статуса, фиксированные
+наборы методов, результатов и ключей словарей stats.
+"""
+
+import asyncio
+import hmac
+import os
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from ..config.settings import settings
+from ..utils.logger import get_logger
+
+# Каталог нужно выставить до первого импорта prometheus_client:
+# класс хранения значений выбирается при импорте
+if settings.prometheus_multiproc_dir and not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(settings.prometheus_multiproc_dir, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = settings.prometheus_multiproc_dir
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+
+logger = get_logger("prometheus")
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+HTTP_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"}
+
+# HTTP
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP запросы",
+    ["method", "route", "status_class"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP запроса",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP запросы в обработке",
+    ["method"], multiprocess_mode="livesum"
+)
+
+# Пул соединений БД
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections", "Соединения, выданные из пула",
+    multiprocess_mode="livesum"
+)
+DB_POOL_OPEN = Gauge(
+    "db_pool_open_connections", "Открытые соединения пула",
+    multiprocess_mode="livesum"
+)
+DB_POOL_EVENTS = Counter(
+    "db_pool_events_total", "События пула соединений",
+    ["event"]
+)
+
+# Запросы к БД (события движка, app.monitoring.db_queries)
+DB_QUERIES = Counter(
+    "db_queries_total", "SQL-запросы",
+    ["operation"]
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Время выполнения SQL-запроса",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "Число SQL-запросов на HTTP запрос",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200)
+)
+DB_N_PLUS_ONE_SUSPECTED = Counter(
+    "db_n_plus_one_suspected_total", "HTTP запросы с повторяющимся SELECT (подозрение на N+1)",
+    ["route"]
+)
+
+# Rate limiting
+RATE_LIMIT_DECISIONS = Counter(
+    "rate_limit_decisions_total", "Решения rate limiter",
+    ["scope", "result"]
+)
+
+# Доставка в Telegram
+TELEGRAM_MESSAGES = Counter(
+    "telegram_messages_total", "Отправка сообщений через Telegram Bot API",
+    ["result"]
+)
+TELEGRAM_SEND_DURATION = Histogram(
+    "telegram_send_duration_seconds", "Время запроса sendMessage",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+# Счетчики из словарей stats сервисов (кэш, WebSocket)
+CACHE_OPERATIONS = Counter(
+    "cache_operations_total", "Операции кэша",
+    ["operation"]
+)
+WEBSOCKET_EVENTS = Counter(
+    "websocket_events_total", "События WebSocket",
+    ["manager", "event"]
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    "websocket_active_connections", "Активные WebSocket соединения",
+    ["manager"], multiprocess_mode="livesum"
+)
+
+def method_label(method: str) -> str:
+    return method if method in HTTP_METHODS else "OTHER"
+
+def observe_http_request(method: str, route: str, status_code: int, duration_seconds: float):
+    method = method_label(method)
+    HTTP_REQUESTS.labels(method, route, f"{status_code // 100}xx").inc()
+    HTTP_REQUEST_DURATION.labels(method, route).observe(duration_seconds)
+
+def instrument_db_pool(engine):
+    """Подписывается на события пула соединений движка"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        DB_POOL_OPEN.inc()
+        DB_POOL_EVENTS.labels("connect").inc()
+
+    @event.listens_for(engine, "close")
+    def on_close(dbapi_connection, connection_record):
+        DB_POOL_OPEN.dec()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKED_OUT.inc()
+        DB_POOL_EVENTS.labels("checkout").inc()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        # checkin приходит и для соединений, инвалидированных до возврата
+        DB_POOL_CHECKED_OUT.dec()
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        DB_POOL_EVENTS.labels("invalidate").inc()
+
+StatsSource = Tuple[Callable[[], Dict[str, Any]], Counter, Tuple[str, ...], Dict[str, Gauge]]
+
+class StatsExporter:
+    """Переносит словари stats сервисов в метрики Prometheus
+
+    Каждый воркер раз в interval секунд увеличивает счетчики на прирост с
+    прошлого прохода, а значения-уровни (активные соединения) выставляет в
+    gauge. Набор ключей словарей фиксирован, так что метки ограничены.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.sources: Dict[str, StatsSource] = {}
+        self.previous: Dict[Tuple[str, str], float] = {}
+        self.sync_task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, get_stats: Callable[[], Dict[str, Any]], counter: Counter,
+                 labels: Tuple[str, ...] = (), gauges: Optional[Dict[str, Gauge]] = None):
+        self.sources[name] = (get_stats, counter, labels, gauges or {})
+
+    def sync(self):
+        for name, (get_stats, counter, labels, gauges) in self.sources.items():
+            try:
+                stats = get_stats()
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать статистику {name}: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if key in gauges:
+                    gauges[key].labels(*labels).set(value)
+                    continue
+                previous = self.previous.get((name, key), 0)
+                self.previous[(name, key)] = value
+                # Уменьшение - сброс статистики, прирост считаем с нового значения
+                if value > previous:
+                    counter.labels(*labels, key).inc(value - previous)
+
+    def start(self):
+        if self.sync_task is None or self.sync_task.done():
+            self.sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self.sync_task is not None:
+            self.sync_task.cancel()
+            try:
+                await self.sync_task
+            except asyncio.CancelledError:
+                pass
+            self.sync_task = None
+        self.sync()
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.sync()
+
+def scrape_allowed(authorization: Optional[str]) -> bool:
+    """Проверка заголовка Authorization сборщика: Bearer METRICS_TOKEN
+
+    Без заданного токена доступа нет: в метках перечислены все шаблоны маршрутов.
+    """
+    if not settings.metrics_token or not authorization:
+        return False
+    scheme, _, token = authorization.partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.strip(), settings.metrics_token)
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Текст экспозиции: метрики всех воркеров в режиме нескольких процессов"""
+    stats_exporter.sync()
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+# Глобальный экспортер словарей stats
+stats_exporter = StatsExporter(settings.prometheus_sync_interval)
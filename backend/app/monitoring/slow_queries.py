@@ -0,0 +1,234 @@
+"""
+Журнал медленных SQL-запросов
+Запросы дольше порога (из учета app.monitoring.db_queries) попадают в
+ограниченный журнал: отпечаток SQL, форма параметров (имена и типы, без
+значений) и время. Для выборки SELECT в фоновом потоке на отдельном
+соединении снимается EXPLAIN (ANALYZE, BUFFERS) - не чаще раза в интервал
+на отпечаток. Сводка по отпечаткам с последним планом отдается в /api/monitoring.
+"""
+
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+from ..config.settings import settings
+from ..utils.logger import get_logger
+
+logger = get_logger("slow_queries")
+
+# Одновременно ожидающих EXPLAIN: остальные пропускаются, а не копятся
+MAX_PENDING_EXPLAINS = 4
+
+_LOCKING_READ = re.compile(r"\bFOR\s+(?:NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b", re.IGNORECASE)
+
+def bind_shape(parameters: Any, executemany: bool = False) -> Any:
+    """Имена и типы параметров без значений"""
+    if executemany and isinstance(parameters, (list, tuple)):
+        return {"rows": len(parameters), "row": bind_shape(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return None
+
+def explainable(statement: str, executemany: bool) -> bool:
+    """EXPLAIN ANALYZE выполняет запрос: только одиночный SELECT без блокировок строк"""
+    return (not executemany
+            and statement.lstrip()[:6].upper() == "SELECT"
+            and not _LOCKING_READ.search(statement))
+
+def plan_summary(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Главное из плана для выбора индексов: время, буферы, последовательные сканы"""
+    seq_scans: List[Dict[str, Any]] = []
+    nodes = [plan.get("Plan", {})]
+    while nodes:
+        node = nodes.pop()
+        if node.get("Node Type") == "Seq Scan":
+            seq_scans.append({
+                "relation": node.get("Relation Name"),
+                "filter": node.get("Filter"),
+                "rows": node.get("Actual Rows"),
+                "rows_removed": node.get("Rows Removed by Filter")
+            })
+        nodes.extend(node.get("Plans", ()))
+    root = plan.get("Plan", {})
+    return {
+        "execution_ms": plan.get("Execution Time"),
+        "planning_ms": plan.get("Planning Time"),
+        "root_node": root.get("Node Type"),
+        "shared_hit_blocks": root.get("Shared Hit Blocks"),
+        "shared_read_blocks": root.get("Shared Read Blocks"),
+        "seq_scans": seq_scans
+    }
+
+class SlowQueryLog:
+    """Последние медленные запросы и сводка по отпечаткам (в памяти воркера)"""
+
+    def __init__(self):
+        self.max_entries = settings.slow_query_log_size
+        self.sample_rate = settings.slow_query_explain_sample_rate
+        self.explain_interval = settings.slow_query_explain_interval
+        self.explain_timeout_ms = settings.slow_query_explain_timeout_ms
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=self.max_entries)
+        self.fingerprints: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.explain_engine = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.pending_explains = 0
+        self.stats = {
+            'recorded': 0,
+            'explains': 0,
+            'explain_errors': 0,
+            'explains_skipped': 0
+        }
+
+    def install(self, engine):
+        """EXPLAIN доступен только для PostgreSQL; соединения - мимо пула приложения"""
+        if engine.dialect.name != "postgresql" or self.sample_rate <= 0:
+            return
+        self.explain_engine = create_engine(
+            engine.url, poolclass=NullPool,
+            connect_args={"connect_timeout": 10, "application_name": "pax_backend_explain"}
+        )
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        if self.explain_engine is not None:
+            self.explain_engine.dispose()
+            self.explain_engine = None
+
+    def record(self, statement: str, parameters: Any, executemany: bool, sql: str, duration_ms: float):
+        """Обработчик медленного запроса для query_tracker (поток выполнения запроса)"""
+        now = time.monotonic()
+        shape = bind_shape(parameters, executemany)
+        entry = {
+            "fingerprint": sql,
+            "duration_ms": round(duration_ms, 2),
+            "bind_shape": shape,
+            "at": datetime.now().isoformat()
+        }
+        with self.lock:
+            self.stats['recorded'] += 1
+            self.recent.append(entry)
+            summary = self.fingerprints.get(sql)
+            if summary is None:
+                summary = self.fingerprints[sql] = {
+                    "fingerprint": sql,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "explained_at": None,
+                    "plan": None,
+                    "plan_summary": None
+                }
+                if len(self.fingerprints) > self.max_entries:
+                    self.fingerprints.popitem(last=False)
+            self.fingerprints.move_to_end(sql)
+            summary["count"] += 1
+            summary["total_ms"] += duration_ms
+            summary["max_ms"] = max(summary["max_ms"], duration_ms)
+            summary["bind_shape"] = shape
+            summary["last_seen"] = entry["at"]
+
+            executor = self.executor if self._should_explain(statement, executemany, summary, now) else None
+            if executor is not None:
+                summary["explained_at"] = now
+                self.pending_explains += 1
+
+        if executor is not None:
+            try:
+                executor.submit(self._explain, sql, statement, parameters)
+            except RuntimeError:
+                # Исполнитель уже остановлен
+                with self.lock:
+                    self.pending_explains -= 1
+
+    def _should_explain(self, statement: str, executemany: bool,
+                        summary: Dict[str, Any], now: float) -> bool:
+        if self.executor is None or not explainable(statement, executemany):
+            return False
+        if summary["explained_at"] is not None and now - summary["explained_at"] < self.explain_interval:
+            return False
+        if random.random() >= self.sample_rate:
+            return False
+        if self.pending_explains >= MAX_PENDING_EXPLAINS:
+            self.stats['explains_skipped'] += 1
+            return False
+        return True
+
+    def _explain(self, sql: str, statement: str, parameters: Any):
+        """EXPLAIN на отдельном соединении в транзакции, которая откатывается"""
+        try:
+            connection = self.explain_engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.execute(f"SET LOCAL statement_timeout = {int(self.explain_timeout_ms)}")
+                # Те же параметры, что получил драйвер в исходном запросе
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters)
+                plan = cursor.fetchone()[0][0]
+            finally:
+                connection.rollback()
+                connection.close()
+            with self.lock:
+                self.stats['explains'] += 1
+                summary = self.fingerprints.get(sql)
+                if summary is not None:
+                    summary["plan"] = plan
+                    summary["plan_summary"] = plan_summary(plan)
+                    summary["plan_at"] = datetime.now().isoformat()
+        except Exception as e:
+            with self.lock:
+                self.stats['explain_errors'] += 1
+            logger.warning(f"Не удалось получить план медленного запроса: {e}")
+        finally:
+            with self.lock:
+                self.pending_explains -= 1
+
+    def top(self, limit: int = 20, order_by: str = "total_ms", with_plans: bool = False) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = [
+                {
+                    **{key: value for key, value in summary.items()
+                       if key not in ("explained_at", "plan")},
+                    "total_ms": round(summary["total_ms"], 2),
+                    "max_ms": round(summary["max_ms"], 2),
+                    "avg_ms": round(summary["total_ms"] / summary["count"], 2),
+                    **({"plan": summary["plan"]} if with_plans else {})
+                }
+                for summary in self.fingerprints.values()
+            ]
+        rows.sort(key=lambda row: row.get(order_by) or 0, reverse=True)
+        return rows[:limit]
+
+    def latest(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self.lock:
+            return list(self.recent)[-limit:][::-1]
+
+    def clear(self):
+        with self.lock:
+            self.recent.clear()
+            self.fingerprints.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'fingerprints': len(self.fingerprints),
+            'pending_explains': self.pending_explains,
+            'explain_enabled': self.executor is not None,
+            'threshold_ms': settings.slow_query_threshold_ms,
+            'sample_rate': self.sample_rate
+        }
+
+# Глобальный журнал медленных запросов
+slow_query_log = SlowQueryLog()
@@ -19,6 +19,7 @@ class ChatMessageRead(ChatMessageBase):
     is_read: bool
     read_at: Optional[datetime]
     timestamp: datetime
+    seq: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -24,7 +24,7 @@ class ReportCreate(BaseModel):
 
 class ReportResponse(BaseModel):
     id: int
-    reporter_id: int
+    reporter_id: Optional[int] = None
     target_type: str
     target_id: int
     reason: str
@@ -32,6 +32,10 @@ class ReportResponse(BaseModel):
     status: str
     created_at: datetime
     resolved_at: Optional[datetime] = None
+    score: Optional[int] = 0
+    target_reports: Optional[int] = 1
+    claimed_by: Optional[int] = None
+    lease_expires_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -14,6 +14,7 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm import selectinload
 from ..utils.error_handler import error_handler
+from ..config.settings import settings
 
 logger = get_logger("auth_service")
 security = HTTPBearer()
@@ -628,9 +629,17 @@ def get_current_user(
     db: Session = Depends(get_db)
 ) -> User:
     """Получение текущего пользователя по JWT токену"""
+    # Извлекаем токен из заголовка
+    return get_user_from_token(credentials.credentials, db)
+
+def get_user_from_token(token: Optional[str], db: Session) -> User:
+    """Пользователь по access-токену (заголовок HTTP или параметр WebSocket)"""
     try:
-        # Извлекаем токен из заголовка
-        token = credentials.credentials
+        if not token:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Требуется токен авторизации"
+            )
         
         # Верифицируем токен и получаем payload
         payload = jwt_auth.verify_token(token, "access")
@@ -681,3 +690,18 @@ def get_current_user(
         )
 
 
+
+
+def admin_telegram_ids() -> set:
+    """Telegram ID модераторов и администраторов из ADMIN_TELEGRAM_IDS"""
+    return {value.strip() for value in settings.admin_telegram_ids.split(",") if value.strip()}
+
+def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    """Текущий пользователь, если он в списке модераторов/администраторов"""
+    if str(current_user.telegram_id) not in admin_telegram_ids():
+        logger.warning(f"Пользователь {current_user.id} без прав администратора")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Недостаточно прав"
+        )
+    return current_user
@@ -0,0 +1,325 @@
+"""
+Холодный архив сообщений чата
+Сообщения старше N дней упаковываются в сжатые сегменты "чат + месяц"
+(локальный диск или подключаемое объектное хранилище) и удаляются из
+chat_messages пакетами; чтение истории прозрачно проваливается в архив
+"""
+
+import gzip
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import case
+from sqlalchemy.orm import Session
+
+from ..config.settings import settings
+from ..database import SessionLocal
+from ..models.chat import Chat, ChatMessage
+from ..utils.logger import get_logger
+
+logger = get_logger("chat_archive")
+
+ARCHIVE_FIELDS = ("id", "chat_id", "user_from_id", "user_to_id", "message", "is_read", "read_at", "timestamp", "seq")
+
+class ArchiveStore(ABC):
+    """Хранилище архивных блоков: ключ -> байты
+
+    Для объектного хранилища (S3 и т.п.) достаточно реализовать get/put.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Содержимое блока или None, если блока нет"""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes):
+        """Атомарная запись блока (читатели не видят недописанных данных)"""
+
+class LocalArchiveStore(ArchiveStore):
+    """Архив в каталоге на локальном диске"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.root / key
+        if not path.exists():
+            return None
+        return path.read_bytes()
+
+    def put(self, key: str, data: bytes):
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Запись через временный файл: читатели не увидят недописанный блок
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+def serialize_message(message: ChatMessage) -> Dict[str, Any]:
+    record = {field: getattr(message, field) for field in ARCHIVE_FIELDS}
+    for field in ("timestamp", "read_at"):
+        if record[field] is not None:
+            record[field] = record[field].isoformat()
+    return record
+
+def deserialize_message(record: Dict[str, Any]) -> ChatMessage:
+    """Восстанавливает сообщение (не привязано к сессии, только для чтения)"""
+    values = dict(record)
+    for field in ("timestamp", "read_at"):
+        if values.get(field):
+            values[field] = datetime.fromisoformat(values[field])
+    return ChatMessage(**values)
+
+class ChatArchive:
+    """Архив сообщений чата
+
+    Раскладка ключей:
+        chats/{chat_id}/index.json                  - оглавление сегментов
+        chats/{chat_id}/{YYYY-MM}/{first_id}.json.gz - сегмент: до segment_size сообщений
+
+    Пакет архивации дописывается в последний незаполненный сегмент месяца
+    или открывает новый, поэтому запись не переписывает накопленный месяц.
+    Оглавление хранит наибольший архивный id: если граница в базе
+    (chats.archived_max_id) новее закэшированного оглавления, оно перечитывается.
+    """
+
+    def __init__(self, store: ArchiveStore, cache_size: int = 64, index_ttl: float = 60.0,
+                 segment_size: int = 500):
+        self.store = store
+        self.cache_size = cache_size
+        self.index_ttl = index_ttl
+        self.segment_size = segment_size
+        self._indexes: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._blocks: "OrderedDict[Tuple[str, int], List[Dict[str, Any]]]" = OrderedDict()
+        self.stats = {
+            'archived': 0,
+            'blocks_written': 0,
+            'blocks_read': 0,
+            'cache_hits': 0,
+            'index_refreshes': 0
+        }
+
+    @staticmethod
+    def _index_key(chat_id: int) -> str:
+        return f"chats/{chat_id}/index.json"
+
+    @staticmethod
+    def _segment_key(chat_id: int, month: str, first_id: int) -> str:
+        return f"chats/{chat_id}/{month}/{first_id}.json.gz"
+
+    def _remember(self, cache: OrderedDict, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _load_index(self, chat_id: int) -> Dict[str, Any]:
+        raw = self.store.get(self._index_key(chat_id))
+        index = json.loads(raw) if raw else {"segments": [], "max_id": 0}
+        self._remember(self._indexes, chat_id, (time.monotonic(), index))
+        return index
+
+    def get_index(self, chat_id: int, archived_max_id: Optional[int] = None) -> Dict[str, Any]:
+        """Оглавление архива чата
+
+        Кэшируется на index_ttl секунд; archived_max_id - граница архива из
+        базы: оглавление, которое ее не покрывает, перечитывается сразу.
+        """
+        cached = self._indexes.get(chat_id)
+        if cached is not None:
+            loaded_at, index = cached
+            stale = archived_max_id is not None and index["max_id"] < archived_max_id
+            if not stale and time.monotonic() - loaded_at < self.index_ttl:
+                self._indexes.move_to_end(chat_id)
+                return index
+            self.stats['index_refreshes'] += 1
+        return self._load_index(chat_id)
+
+    def _read_segment(self, segment: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Число записей в ключе: дописанный сегмент не будет взят из кэша
+        key = (segment["key"], segment["count"])
+        records = self._blocks.get(key)
+        if records is not None:
+            self._blocks.move_to_end(key)
+            self.stats['cache_hits'] += 1
+            return records
+
+        raw = self.store.get(key[0])
+        records = json.loads(gzip.decompress(raw)) if raw else []
+        self.stats['blocks_read'] += 1
+        self._remember(self._blocks, key, records)
+        return records
+
+    def _select(self, chat_id: int, field: str, limit: int, archived_max_id: Optional[int],
+                after: Optional[int] = None, before: Optional[int] = None) -> List[Dict[str, Any]]:
+        """До limit записей с after < field < before, ближайших к курсору
+
+        Диапазоны сегментов могут пересекаться (сообщение старше срока
+        архивации может иметь id внутри уже архивированного диапазона),
+        поэтому сегменты читаются, пока могут дать запись ближе собранных.
+        """
+        low, high = f"min_{field}", f"max_{field}"
+        descending = after is None
+        segments = [
+            segment for segment in self.get_index(chat_id, archived_max_id)["segments"]
+            if segment.get(low) is not None
+            and (after is None or segment[high] > after)
+            and (before is None or segment[low] < before)
+        ]
+        segments.sort(key=lambda segment: segment[high] if descending else segment[low], reverse=descending)
+
+        found: Dict[int, Dict[str, Any]] = {}
+        for segment in segments:
+            if len(found) >= limit:
+                edge = sorted(found, reverse=descending)[limit - 1]
+                if (segment[high] < edge) if descending else (segment[low] > edge):
+                    break
+            for record in self._read_segment(segment):
+                value = record.get(field)
+                if value is None or (after is not None and value <= after) or (before is not None and value >= before):
+                    continue
+                found[value] = record
+        return [found[value] for value in sorted(found, reverse=descending)[:limit]]
+
+    def read_before(self, chat_id: int, before_id: Optional[int], limit: int,
+                    archived_max_id: Optional[int] = None) -> List[ChatMessage]:
+        """До limit архивных сообщений с id < before_id, от новых к старым"""
+        records = self._select(chat_id, "id", limit, archived_max_id, before=before_id)
+        return [deserialize_message(record) for record in records]
+
+    def read_after(self, chat_id: int, after_id: int, limit: int,
+                   archived_max_id: Optional[int] = None) -> List[ChatMessage]:
+        """До limit архивных сообщений с id > after_id, от старых к новым"""
+        records = self._select(chat_id, "id", limit, archived_max_id, after=after_id)
+        return [deserialize_message(record) for record in records]
+
+    def read_after_seq(self, chat_id: int, after_seq: int, limit: int,
+                       archived_max_id: Optional[int] = None) -> List[ChatMessage]:
+        """До limit архивных сообщений с seq > after_seq, по возрастанию seq"""
+        records = self._select(chat_id, "seq", limit, archived_max_id, after=after_seq)
+        return [deserialize_message(record) for record in records]
+
+    def write(self, chat_id: int, month: str, records: List[Dict[str, Any]]):
+        """Добавляет пакет сообщений месяца в архив и обновляет оглавление
+
+        Пакет дописывается в сегмент, уже содержащий его сообщения (повтор
+        после сбоя между записью и удалением строк), или в последний
+        незаполненный сегмент месяца; иначе открывается новый сегмент.
+        Записи сливаются по id, поэтому повторная запись не создает дублей.
+        """
+        # Оглавление читается из хранилища: кэш может не видеть прошлых записей
+        index = self._load_index(chat_id)
+        ids = {record["id"] for record in records}
+        month_segments = [segment for segment in index["segments"] if segment["month"] == month]
+
+        target = None
+        for segment in month_segments:
+            # Читаются только сегменты, чей диапазон пересекается с пакетом
+            if segment["max_id"] < min(ids) or segment["min_id"] > max(ids):
+                continue
+            if any(record["id"] in ids for record in self._read_segment(segment)):
+                target = segment
+                break
+        if target is None and month_segments:
+            last = max(month_segments, key=lambda segment: segment["max_id"])
+            if last["count"] + len(records) <= self.segment_size:
+                target = last
+
+        merged = {record["id"]: record for record in self._read_segment(target)} if target else {}
+        merged.update((record["id"], record) for record in records)
+        block = [merged[message_id] for message_id in sorted(merged)]
+        key = target["key"] if target else self._segment_key(chat_id, month, block[0]["id"])
+        self.store.put(key, gzip.compress(json.dumps(block, ensure_ascii=False).encode("utf-8")))
+
+        seqs = [record["seq"] for record in block if record.get("seq") is not None]
+        segment = {
+            "key": key,
+            "month": month,
+            "min_id": block[0]["id"],
+            "max_id": block[-1]["id"],
+            "min_seq": min(seqs) if seqs else None,
+            "max_seq": max(seqs) if seqs else None,
+            "count": len(block)
+        }
+        index["segments"] = [existing for existing in index["segments"] if existing["key"] != key] + [segment]
+        index["max_id"] = max(index["max_id"], segment["max_id"])
+        self.store.put(self._index_key(chat_id), json.dumps(index).encode("utf-8"))
+        self._remember(self._indexes, chat_id, (time.monotonic(), index))
+        self.stats['blocks_written'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'cached_indexes': len(self._indexes),
+            'cached_blocks': len(self._blocks)
+        }
+
+class ChatArchiver:
+    """Перенос старых сообщений из chat_messages в архив пакетами"""
+
+    def __init__(self, archive: ChatArchive, session_factory: Callable[[], Session] = SessionLocal,
+                 batch_size: Optional[int] = None):
+        self.archive = archive
+        self.session_factory = session_factory
+        self.batch_size = batch_size or settings.chat_archive_batch_size
+
+    def archive_older_than(self, days: Optional[int] = None, max_batches: Optional[int] = None) -> int:
+        """Архивирует сообщения старше days дней, возвращает число перенесенных
+
+        Каждый пакет - отдельная короткая транзакция: сначала пишутся сегменты,
+        затем удаляются строки и сдвигается граница архива чата, так что сбой
+        не теряет сообщения, а читатели не видят пропусков между базой и архивом.
+        """
+        days = days or settings.chat_archive_days
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        total = 0
+        batches = 0
+
+        while max_batches is None or batches < max_batches:
+            session = self.session_factory()
+            try:
+                messages = session.query(ChatMessage).filter(
+                    ChatMessage.timestamp < cutoff
+                ).order_by(ChatMessage.id).limit(self.batch_size).all()
+                if not messages:
+                    break
+
+                groups: Dict[Tuple[int, str], List[Dict[str, Any]]] = {}
+                chat_max_ids: Dict[int, int] = {}
+                for message in messages:
+                    month = message.timestamp.strftime("%Y-%m")
+                    groups.setdefault((message.chat_id, month), []).append(serialize_message(message))
+                    chat_max_ids[message.chat_id] = max(chat_max_ids.get(message.chat_id, 0), message.id)
+                for (chat_id, month), records in groups.items():
+                    self.archive.write(chat_id, month, records)
+
+                ids = [message.id for message in messages]
+                session.query(ChatMessage).filter(ChatMessage.id.in_(ids)).delete(synchronize_session=False)
+                for chat_id, max_id in chat_max_ids.items():
+                    session.query(Chat).filter(Chat.id == chat_id).update(
+                        {Chat.archived_max_id: case((Chat.archived_max_id < max_id, max_id), else_=Chat.archived_max_id)},
+                        synchronize_session=False
+                    )
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Ошибка архивации сообщений: {e}")
+                raise
+            finally:
+                session.close()
+
+            total += len(ids)
+            batches += 1
+            self.archive.stats['archived'] += len(ids)
+
+        logger.info(f"Архивировано {total} сообщений старше {days} дней ({batches} пакетов)")
+        return total
+
+# Глобальный архив сообщений чата
+chat_archive = ChatArchive(LocalArchiveStore(settings.chat_archive_dir))
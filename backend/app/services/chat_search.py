@@ -0,0 +1,283 @@
+"""
+Полнотекстовый поиск по сообщениям чата
+PostgreSQL: колонка tsvector (конфигурации russian + english) с GIN индексом,
+SQLite: виртуальная таблица FTS5 с очередью, заполняемой триггером.
+Индексирование идет в фоне пакетами, поэтому отправка сообщения не ждет
+построения индекса.
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..config.settings import settings
+from ..database import SessionLocal
+from ..utils.logger import get_logger
+
+logger = get_logger("chat_search")
+
+MAX_QUERY_LENGTH = 200
+
+POSTGRES_VECTOR = "to_tsvector('russian', message) || to_tsvector('english', message)"
+POSTGRES_QUERY = "websearch_to_tsquery('russian', :query) || websearch_to_tsquery('english', :query)"
+
+POSTGRES_INDEX_SQL = f"""
+    UPDATE chat_messages SET search_vector = {POSTGRES_VECTOR}
+    WHERE id IN (
+        SELECT id FROM chat_messages WHERE search_vector IS NULL ORDER BY id LIMIT :batch_size
+    )
+"""
+
+POSTGRES_SEARCH_SQL = """
+    SELECT * FROM (
+        SELECT m.id, m.chat_id, m.user_from_id, m.user_to_id, m.message, m.timestamp, m.seq,
+               ts_rank(m.search_vector, q.query) AS rank
+        FROM chat_messages m
+        JOIN chats c ON c.id = m.chat_id
+        CROSS JOIN (SELECT {query} AS query) q
+        WHERE (c.user1_id = :user_id OR c.user2_id = :user_id)
+          AND m.search_vector @@ q.query
+    ) found
+    {cursor_filter}
+    ORDER BY rank DESC, id DESC
+    LIMIT :limit
+"""
+
+SQLITE_SCHEMA_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+        message, content='', tokenize='unicode61 remove_diacritics 2'
+    )
+"""
+
+# Очередь индексатора для SQLite: id попадает в нее в транзакции вставки
+# сообщения, поэтому строки, закоммиченные позже строк с большим id, не теряются
+SQLITE_QUEUE_SQL = (
+    "CREATE TABLE IF NOT EXISTS chat_messages_fts_pending (id INTEGER PRIMARY KEY)",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_chat_messages_fts_pending AFTER INSERT ON chat_messages
+    BEGIN
+        INSERT OR IGNORE INTO chat_messages_fts_pending(id) VALUES (NEW.id);
+    END
+    """,
+    # Сообщения, записанные до появления очереди
+    """
+    INSERT OR IGNORE INTO chat_messages_fts_pending(id)
+    SELECT id FROM chat_messages WHERE id NOT IN (SELECT rowid FROM chat_messages_fts)
+    """
+)
+
+SQLITE_PENDING_SQL = "SELECT id FROM chat_messages_fts_pending ORDER BY id LIMIT :batch_size"
+
+SQLITE_INDEX_SQL = """
+    INSERT INTO chat_messages_fts(rowid, message)
+    SELECT id, message FROM chat_messages WHERE id IN ({ids})
+"""
+
+SQLITE_DEQUEUE_SQL = "DELETE FROM chat_messages_fts_pending WHERE id IN ({ids})"
+
+POSTGRES_COLUMN_SQL = """
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'chat_messages' AND column_name = 'search_vector'
+"""
+
+CURSOR_FILTER = "WHERE rank < :cursor_rank OR (rank = :cursor_rank AND id < :cursor_id)"
+
+# bm25() тем меньше, чем лучше совпадение - меняем знак, чтобы порядок совпадал с ts_rank
+SQLITE_SEARCH_SQL = """
+    SELECT * FROM (
+        SELECT m.id, m.chat_id, m.user_from_id, m.user_to_id, m.message, m.timestamp, m.seq,
+               -bm25(chat_messages_fts) AS rank
+        FROM chat_messages_fts
+        JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+        JOIN chats c ON c.id = m.chat_id
+        WHERE chat_messages_fts MATCH :query
+          AND (c.user1_id = :user_id OR c.user2_id = :user_id)
+    ) found
+    {cursor_filter}
+    ORDER BY rank DESC, id DESC
+    LIMIT :limit
+"""
+
+def encode_cursor(rank: float, message_id: int) -> str:
+    return f"{rank!r}:{message_id}"
+
+def decode_cursor(cursor: Optional[str]) -> Tuple[Optional[float], Optional[int]]:
+    """Курсор страницы: "<rank>:<id>" последнего результата"""
+    if not cursor:
+        return None, None
+    try:
+        rank, message_id = cursor.rsplit(":", 1)
+        return float(rank), int(message_id)
+    except ValueError:
+        raise ValueError("Некорректный курсор поиска")
+
+class SearchUnavailableError(RuntimeError):
+    """Поиск не настроен в этой базе (не применена миграция 008)"""
+
+def sqlite_match_query(query: str) -> str:
+    """Каждое слово - отдельная фраза FTS5, спецсимволы запроса не интерпретируются"""
+    terms = [term.replace('"', '""') for term in query.split()]
+    return " ".join(f'"{term}"' for term in terms)
+
+class ChatSearchIndex:
+    """Поисковый индекс сообщений чата с фоновым индексированием
+
+    Сообщения, перенесенные в холодный архив, в поиск не попадают.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal,
+                 batch_size: Optional[int] = None, interval: Optional[float] = None):
+        self.session_factory = session_factory
+        self.batch_size = batch_size or settings.chat_search_batch_size
+        self.interval = interval or settings.chat_search_index_interval
+        self.indexer_task: Optional[asyncio.Task] = None
+        self._schema_ready = False
+        # False - в базе нет схемы поиска, индексатор и поиск отключены
+        self.available = True
+        self.stats = {
+            'indexed': 0,
+            'index_runs': 0,
+            'searches': 0,
+            'errors': 0
+        }
+
+    @staticmethod
+    def _dialect(session: Session) -> str:
+        return session.get_bind().dialect.name
+
+    def _ensure_schema(self, session: Session):
+        """Проверяет схему поиска один раз на процесс"""
+        if self._schema_ready:
+            return
+        if self._dialect(session) == "sqlite":
+            session.execute(text(SQLITE_SCHEMA_SQL))
+            for sql in SQLITE_QUEUE_SQL:
+                session.execute(text(sql))
+            session.commit()
+        elif session.execute(text(POSTGRES_COLUMN_SQL)).first() is None:
+            # Колонка и GIN индекс для PostgreSQL создаются миграцией 008
+            self.available = False
+            logger.warning("Колонка chat_messages.search_vector не найдена (миграция 008 не применена), поиск по сообщениям отключен")
+        self._schema_ready = True
+
+    def _index_sqlite(self, session: Session) -> int:
+        ids = session.execute(text(SQLITE_PENDING_SQL), {"batch_size": self.batch_size}).scalars().all()
+        if ids:
+            id_list = ",".join(str(int(message_id)) for message_id in ids)
+            session.execute(text(SQLITE_INDEX_SQL.format(ids=id_list)))
+            session.execute(text(SQLITE_DEQUEUE_SQL.format(ids=id_list)))
+        return len(ids)
+
+    def index_pending(self) -> int:
+        """Индексирует следующий пакет новых сообщений (выполняется в потоке)"""
+        session = self.session_factory()
+        try:
+            self._ensure_schema(session)
+            if not self.available:
+                return 0
+            if self._dialect(session) == "sqlite":
+                count = self._index_sqlite(session)
+            else:
+                count = session.execute(text(POSTGRES_INDEX_SQL), {"batch_size": self.batch_size}).rowcount or 0
+            session.commit()
+            self.stats['indexed'] += count
+            return count
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def start(self):
+        """Запускает фоновое индексирование"""
+        if self.indexer_task is None or self.indexer_task.done():
+            self.indexer_task = asyncio.create_task(self._indexer_loop())
+
+    async def stop(self):
+        if self.indexer_task is not None:
+            self.indexer_task.cancel()
+            try:
+                await self.indexer_task
+            except asyncio.CancelledError:
+                pass
+            self.indexer_task = None
+
+    async def _indexer_loop(self):
+        while True:
+            try:
+                # Догоняем отставание пакетами, затем ждем новых сообщений
+                while await asyncio.to_thread(self.index_pending) >= self.batch_size:
+                    pass
+                if not self.available:
+                    return
+                self.stats['index_runs'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Ошибка индексирования сообщений: {e}")
+            await asyncio.sleep(self.interval)
+
+    def search(self, user_id: int, query: str, limit: int = 20,
+               cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Поиск по чатам пользователя: по релевантности, постранично по курсору"""
+        query = (query or "").strip()
+        if len(query) < 2:
+            raise ValueError("Поисковый запрос слишком короткий")
+        if len(query) > MAX_QUERY_LENGTH:
+            raise ValueError("Поисковый запрос слишком длинный")
+        cursor_rank, cursor_id = decode_cursor(cursor)
+
+        session = self.session_factory()
+        try:
+            self._ensure_schema(session)
+            if not self.available:
+                raise SearchUnavailableError("Поиск по сообщениям недоступен")
+            cursor_filter = CURSOR_FILTER if cursor_id is not None else ""
+            if self._dialect(session) == "sqlite":
+                sql = SQLITE_SEARCH_SQL.format(cursor_filter=cursor_filter)
+                query = sqlite_match_query(query)
+            else:
+                sql = POSTGRES_SEARCH_SQL.format(query=POSTGRES_QUERY, cursor_filter=cursor_filter)
+            rows = session.execute(text(sql), {
+                "query": query,
+                "user_id": user_id,
+                "cursor_rank": cursor_rank,
+                "cursor_id": cursor_id,
+                "limit": limit + 1
+            }).mappings().all()
+        finally:
+            session.close()
+
+        self.stats['searches'] += 1
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        results = []
+        for row in rows:
+            timestamp = row["timestamp"]
+            results.append({
+                "id": row["id"],
+                "chat_id": row["chat_id"],
+                "user_from_id": row["user_from_id"],
+                "user_to_id": row["user_to_id"],
+                "message": row["message"],
+                "timestamp": timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp,
+                "seq": row["seq"],
+                "rank": row["rank"]
+            })
+
+        return {
+            "results": results,
+            "next_cursor": encode_cursor(rows[-1]["rank"], rows[-1]["id"]) if has_more else None
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'available': self.available,
+            'indexer_running': self.indexer_task is not None and not self.indexer_task.done()
+        }
+
+# Глобальный поисковый индекс сообщений чата
+chat_search_index = ChatSearchIndex()
@@ -1,6 +1,7 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc, asc
-from typing import List, Optional, Dict, Any
+from sqlalchemy import and_, or_, desc, asc, update
+from typing import List, Optional, Dict, Any, Tuple
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import logging
 import json
@@ -11,12 +12,64 @@ from ..models.user import User
 from ..models.ride import Ride
 from ..schemas.chat import ChatMessageCreate, ChatMessageRead, ChatCreate, ChatRead
 from ..database import get_db
+from ..config.settings import settings
+from .chat_archive import chat_archive, ChatArchiver
+from .moderation_pipeline import moderation_pipeline
 
 logger = logging.getLogger(__name__)
 
+class ChatMembershipCache:
+    """LRU-кэш участников чата: chat_id -> (user1_id, user2_id)
+    
+    Участники чата не меняются после create_chat, поэтому запись
+    удаляется только вместе с чатом: чаты удаляет каскад ON DELETE при
+    очистке поездок (RideService.cleanup_expired_rides).
+    """
+    
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._members: "OrderedDict[int, Tuple[int, int]]" = OrderedDict()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0
+        }
+    
+    def get(self, chat_id: int) -> Optional[Tuple[int, int]]:
+        members = self._members.get(chat_id)
+        if members is None:
+            self.stats['misses'] += 1
+            return None
+        self._members.move_to_end(chat_id)
+        self.stats['hits'] += 1
+        return members
+    
+    def put(self, chat_id: int, user1_id: int, user2_id: int):
+        self._members[chat_id] = (user1_id, user2_id)
+        self._members.move_to_end(chat_id)
+        if len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+            self.stats['evictions'] += 1
+    
+    def invalidate(self, chat_id: int):
+        self._members.pop(chat_id, None)
+    
+    def invalidate_many(self, chat_ids: List[int]):
+        for chat_id in chat_ids:
+            self._members.pop(chat_id, None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'size': len(self._members),
+            'max_size': self.max_size
+        }
+
 class ChatService:
     def __init__(self):
         self._db_session = None
+        self.membership_cache = ChatMembershipCache(settings.chat_membership_cache_size)
+        self.archive = chat_archive
     
     @property
     def db(self) -> Session:
@@ -70,6 +123,7 @@ class ChatService:
             ).first()
             
             if existing_chat:
+                self.membership_cache.put(existing_chat.id, existing_chat.user1_id, existing_chat.user2_id)
                 return existing_chat
             
             # Создание нового чата
@@ -83,6 +137,7 @@ class ChatService:
             self.db.add(chat)
             self.db.commit()
             self.db.refresh(chat)
+            self.membership_cache.put(chat.id, chat.user1_id, chat.user2_id)
             
             logger.info(f"Создан чат {chat.id} для поездки {ride_id}")
             return chat
@@ -102,11 +157,51 @@ class ChatService:
                 )
             ).first()
             
+            if chat:
+                self.membership_cache.put(chat.id, chat.user1_id, chat.user2_id)
             return chat
         except Exception as e:
             logger.error(f"Ошибка получения чата {chat_id}: {e}")
             raise
     
+    def get_chat_participants(self, chat_id: int, user_id: int) -> Optional[Tuple[int, int]]:
+        """Участники чата (user1_id, user2_id) из кэша, с проверкой прав доступа"""
+        members = self.membership_cache.get(chat_id)
+        if members is None:
+            row = self.db.query(Chat.user1_id, Chat.user2_id).filter(Chat.id == chat_id).first()
+            if not row:
+                return None
+            members = (row.user1_id, row.user2_id)
+            self.membership_cache.put(chat_id, *members)
+        
+        return members if user_id in members else None
+    
+    def get_other_participant(self, chat_id: int, user_id: int) -> Optional[int]:
+        """Собеседник пользователя в чате или None, если доступа нет"""
+        members = self.get_chat_participants(chat_id, user_id)
+        if members is None:
+            return None
+        return members[1] if members[0] == user_id else members[0]
+    
+    def warm_membership_cache(self, user_id: int) -> int:
+        """Загружает в кэш участников последних чатов пользователя одним запросом
+        
+        Число чатов ограничено chat_membership_warm_limit и десятой частью
+        кэша: подключение одного пользователя не должно вытеснять чаты остальных.
+        """
+        limit = min(settings.chat_membership_warm_limit, max(1, self.membership_cache.max_size // 10))
+        try:
+            rows = self.db.query(Chat.id, Chat.user1_id, Chat.user2_id).filter(
+                or_(Chat.user1_id == user_id, Chat.user2_id == user_id)
+            ).order_by(desc(Chat.updated_at)).limit(limit).all()
+            
+            for row in rows:
+                self.membership_cache.put(row.id, row.user1_id, row.user2_id)
+            return len(rows)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки участников чатов пользователя {user_id}: {e}")
+            return 0
+    
     def get_user_chats(self, user_id: int, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
         """Получение всех чатов пользователя"""
         try:
@@ -177,13 +272,16 @@ class ChatService:
             if len(message_data.message) > 1000:
                 raise ValueError("Сообщение слишком длинное (максимум 1000 символов)")
             
+            moderation_pipeline.ensure_allowed(message_data.message)
+            
             # Создание сообщения
             message = ChatMessage(
                 chat_id=chat_id,
                 user_from_id=user_id,
                 user_to_id=chat.user2_id if chat.user1_id == user_id else chat.user1_id,
                 message=message_data.message.strip(),
-                timestamp=datetime.utcnow()
+                timestamp=datetime.utcnow(),
+                seq=self.allocate_seq(chat_id)
             )
             
             self.db.add(message)
@@ -194,6 +292,8 @@ class ChatService:
             self.db.commit()
             self.db.refresh(message)
             
+            moderation_pipeline.submit("message", message.id, user_id, message.message)
+            
             logger.info(f"Отправлено сообщение {message.id} в чат {chat_id}")
             return message
             
@@ -202,20 +302,102 @@ class ChatService:
             logger.error(f"Ошибка отправки сообщения в чат {chat_id}: {e}")
             raise
     
-    def get_messages(self, chat_id: int, user_id: int, limit: int = 50, offset: int = 0) -> List[ChatMessage]:
-        """Получение сообщений чата"""
+    def allocate_seq(self, chat_id: int, count: int = 1) -> int:
+        """Выдает следующий порядковый номер сообщения в чате
+        
+        Атомарный UPDATE ... RETURNING блокирует строку чата до коммита,
+        поэтому номера в чате растут в порядке коммитов и не повторяются.
+        Возвращает последний из count выданных номеров.
+        """
+        result = self.db.execute(
+            update(Chat)
+            .where(Chat.id == chat_id)
+            .values(last_seq=Chat.last_seq + count)
+            .returning(Chat.last_seq)
+        )
+        return result.scalar_one()
+    
+    def get_messages_since(self, chat_id: int, user_id: int, after_seq: int,
+                           limit: int = 500) -> List[ChatMessage]:
+        """Сообщения чата с seq > after_seq по индексу (chat_id, seq), с дочтением из архива"""
         try:
-            # Проверка доступа к чату
             chat = self.get_chat(chat_id, user_id)
             if not chat:
                 raise ValueError("Чат не найден или нет доступа")
             
             messages = self.db.query(ChatMessage).filter(
-                ChatMessage.chat_id == chat_id
-            ).order_by(desc(ChatMessage.timestamp)).limit(limit).offset(offset).all()
+                and_(
+                    ChatMessage.chat_id == chat_id,
+                    ChatMessage.seq > after_seq
+                )
+            ).order_by(asc(ChatMessage.seq)).limit(limit).all()
+            
+            # Разрыв между курсором и горячими строками - пропущенное ушло в архив
+            if not messages or messages[0].seq > after_seq + 1:
+                archived_max_id = self.get_archived_max_id(chat_id)
+                archived = self.archive.read_after_seq(chat_id, after_seq, limit, archived_max_id) if archived_max_id else []
+                if archived:
+                    hot_ids = {message.id for message in messages}
+                    messages = sorted(
+                        [message for message in archived if message.id not in hot_ids] + messages,
+                        key=lambda message: message.seq
+                    )[:limit]
             
-            # Отметка сообщений как прочитанные
-            self.mark_messages_as_read(chat_id, user_id)
+            return messages
+            
+        except Exception as e:
+            logger.error(f"Ошибка получения сообщений чата {chat_id} после seq {after_seq}: {e}")
+            raise
+    
+    def get_archived_max_id(self, chat_id: int) -> Optional[int]:
+        """Граница архива чата: 0 - архива нет, None - чата нет"""
+        return self.db.query(Chat.archived_max_id).filter(Chat.id == chat_id).scalar()
+    
+    def get_messages(self, chat_id: int, user_id: int, limit: int = 50, offset: int = 0,
+                     before_id: Optional[int] = None, after_id: Optional[int] = None) -> List[ChatMessage]:
+        """Получение сообщений чата (от новых к старым)
+        
+        before_id/after_id - курсоры по индексу (chat_id, id): страница
+        читает limit строк независимо от глубины истории, offset при этом
+        не используется. Когда курсор уходит за горячее окно, недостающие
+        сообщения дочитываются из архива.
+        """
+        try:
+            # Проверка доступа к чату
+            if self.get_chat_participants(chat_id, user_id) is None:
+                raise ValueError("Чат не найден или нет доступа")
+            
+            query = self.db.query(ChatMessage).filter(ChatMessage.chat_id == chat_id)
+            if after_id is not None:
+                # Ближайшие limit сообщений после курсора, затем в общем порядке.
+                # Архив читается, только если курсор ниже границы архива чата
+                messages = []
+                archived_max_id = self.get_archived_max_id(chat_id)
+                if archived_max_id and after_id < archived_max_id:
+                    messages = self.archive.read_after(chat_id, after_id, limit, archived_max_id)
+                if len(messages) < limit:
+                    hot_after = messages[-1].id if messages else after_id
+                    messages += query.filter(ChatMessage.id > hot_after).order_by(
+                        asc(ChatMessage.id)
+                    ).limit(limit - len(messages)).all()
+                messages.reverse()
+            elif before_id is not None:
+                messages = query.filter(ChatMessage.id < before_id).order_by(
+                    desc(ChatMessage.id)
+                ).limit(limit).all()
+            else:
+                messages = query.order_by(desc(ChatMessage.id)).limit(limit).offset(offset).all()
+            
+            # Горячее окно исчерпано - продолжаем из архива
+            if len(messages) < limit and after_id is None and (before_id is not None or offset == 0):
+                archived_max_id = self.get_archived_max_id(chat_id)
+                if archived_max_id:
+                    archive_before = messages[-1].id if messages else before_id
+                    messages += self.archive.read_before(chat_id, archive_before, limit - len(messages), archived_max_id)
+            
+            # Отметка сообщений как прочитанные (старые страницы их уже не содержат)
+            if before_id is None:
+                self.mark_messages_as_read(chat_id, user_id)
             
             return messages
             
@@ -352,6 +534,10 @@ class ChatService:
             logger.error(f"Ошибка получения статистики чатов пользователя {user_id}: {e}")
             raise
     
+    def archive_old_messages(self, days: Optional[int] = None, max_batches: Optional[int] = None) -> int:
+        """Перенос старых сообщений в холодный архив (вместо удаления)"""
+        return ChatArchiver(self.archive).archive_older_than(days, max_batches)
+    
     def cleanup_old_messages(self, days: int = 30) -> int:
         """Очистка старых сообщений"""
         try:
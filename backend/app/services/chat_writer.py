@@ -0,0 +1,261 @@
+"""
+Групповая запись сообщений чата (write-behind)
+Сообщения из WebSocket проверяются и подтверждаются сразу с временным id,
+а в базу пишутся микропакетами одной транзакцией
+"""
+
+import asyncio
+import itertools
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from ..config.settings import settings
+from ..database import SessionLocal
+from ..models.chat import Chat, ChatMessage
+from ..utils.logger import get_logger
+from .moderation_pipeline import moderation_pipeline
+
+logger = get_logger("chat_writer")
+
+MAX_MESSAGE_LENGTH = 1000
+
+# Маркер остановки в очереди: писатель дописывает текущий пакет и выходит
+STOP = object()
+
+class ChatWriterOverloadedError(RuntimeError):
+    """Очередь записи заполнена: база не успевает, сообщение не принято"""
+
+class PendingMessage:
+    """Принятое, но еще не записанное сообщение"""
+
+    __slots__ = (
+        "provisional_id", "chat_id", "user_from_id", "user_to_id",
+        "message", "timestamp", "message_id", "seq", "error"
+    )
+
+    def __init__(self, provisional_id: str, chat_id: int, user_from_id: int,
+                 user_to_id: int, message: str, timestamp: datetime):
+        self.provisional_id = provisional_id
+        self.chat_id = chat_id
+        self.user_from_id = user_from_id
+        self.user_to_id = user_to_id
+        self.message = message
+        self.timestamp = timestamp
+        self.message_id: Optional[int] = None
+        self.seq: Optional[int] = None
+        self.error: Optional[str] = None
+
+class ChatMessageWriter:
+    """Писатель сообщений чата с групповым коммитом
+
+    Пакет сбрасывается, когда набралось batch_size сообщений или прошло
+    batch_interval секунд с первого сообщения пакета. Запись идет в отдельном
+    потоке, поэтому доставка получателю не ждет коммита. Очередь ограничена
+    queue_size: если база не успевает, новые сообщения отклоняются, а не
+    копятся в памяти (и не теряются при падении процесса).
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal,
+                 batch_size: Optional[int] = None, batch_interval_ms: Optional[float] = None,
+                 queue_size: Optional[int] = None):
+        self.session_factory = session_factory
+        self.batch_size = batch_size or settings.chat_write_batch_size
+        self.batch_interval = (batch_interval_ms or settings.chat_write_batch_interval_ms) / 1000
+        self.queue_size = queue_size or settings.chat_write_queue_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.writer_task: Optional[asyncio.Task] = None
+        # Вызывается после коммита пакета (успешного или нет)
+        self.on_persisted: Optional[Callable[[List[PendingMessage]], Awaitable[None]]] = None
+        self._ids = itertools.count(1)
+        self._id_prefix = f"{os.getpid()}-{int(time.time())}"
+        self.stats = {
+            'accepted': 0,
+            'rejected': 0,
+            'persisted': 0,
+            'failed': 0,
+            'batches': 0,
+            'max_batch': 0
+        }
+
+    def validate(self, text: Optional[str]) -> str:
+        """Проверка текста сообщения (те же правила, что и в ChatService.send_message)"""
+        if not text or len(text.strip()) == 0:
+            raise ValueError("Сообщение не может быть пустым")
+        if len(text) > MAX_MESSAGE_LENGTH:
+            raise ValueError("Сообщение слишком длинное (максимум 1000 символов)")
+        moderation_pipeline.ensure_allowed(text)
+        return text.strip()
+
+    def start(self):
+        """Запускает фоновую задачу записи"""
+        if self.writer_task is None or self.writer_task.done():
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self.writer_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает запись, дописав накопленные сообщения
+
+        Задача не отменяется: сообщения уже вынуты из очереди в пакет, и
+        отмена посреди пакета их бы потеряла. Писатель получает маркер
+        STOP, записывает текущий пакет и выходит; остаток очереди
+        дописывается здесь.
+        """
+        if self.writer_task is None:
+            return
+        await self.queue.put(STOP)
+        try:
+            await self.writer_task
+        except Exception as e:
+            logger.error(f"Ошибка писателя сообщений при остановке: {e}")
+        self.writer_task = None
+
+        pending = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not STOP:
+                pending.append(item)
+        for start in range(0, len(pending), self.batch_size):
+            await self._flush(pending[start:start + self.batch_size])
+
+    def submit(self, chat_id: int, user_from_id: int, user_to_id: int, text: str) -> PendingMessage:
+        """Принимает сообщение в очередь записи и сразу возвращает его с временным id
+
+        ChatWriterOverloadedError, если очередь заполнена.
+        """
+        message = self.validate(text)
+        self.start()
+        if self.queue.full():
+            self.stats['rejected'] += 1
+            raise ChatWriterOverloadedError("Сервер перегружен, повторите отправку")
+        pending = PendingMessage(
+            provisional_id=f"{self._id_prefix}-{next(self._ids)}",
+            chat_id=chat_id,
+            user_from_id=user_from_id,
+            user_to_id=user_to_id,
+            message=message,
+            timestamp=datetime.utcnow()
+        )
+        self.queue.put_nowait(pending)
+        self.stats['accepted'] += 1
+        return pending
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is STOP:
+                return
+            batch = [item]
+            deadline = loop.time() + self.batch_interval
+
+            # Добираем пакет до batch_size или до истечения интервала
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[PendingMessage]):
+        try:
+            await asyncio.to_thread(self.persist_batch, batch)
+        except Exception as e:
+            logger.error(f"Ошибка групповой записи {len(batch)} сообщений: {e}")
+            for pending in batch:
+                pending.error = "Ошибка сохранения сообщения"
+        failed = sum(1 for pending in batch if pending.error)
+        self.stats['persisted'] += len(batch) - failed
+        self.stats['failed'] += failed
+
+        self.stats['batches'] += 1
+        self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+
+        if self.on_persisted is not None:
+            try:
+                await self.on_persisted(batch)
+            except Exception as e:
+                logger.error(f"Ошибка уведомления о записи сообщений: {e}")
+
+    def persist_batch(self, batch: List[PendingMessage]):
+        """Записывает пакет одной транзакцией (выполняется в потоке)
+
+        Каждый чат пишется в своей точке сохранения: удаленный чат или
+        ошибка в одном чате помечает error только его сообщения, остальные
+        чаты пакета коммитятся.
+        """
+        session = self.session_factory()
+        try:
+            by_chat: Dict[int, List[PendingMessage]] = {}
+            for pending in batch:
+                by_chat.setdefault(pending.chat_id, []).append(pending)
+
+            for chat_id, messages in by_chat.items():
+                try:
+                    with session.begin_nested():
+                        self._persist_chat(session, chat_id, messages)
+                except Exception as e:
+                    logger.warning(f"Сообщения чата {chat_id} не записаны: {e}")
+                    for pending in messages:
+                        pending.seq = None
+                        pending.message_id = None
+                        pending.error = "Ошибка сохранения сообщения"
+            session.commit()
+        except Exception:
+            session.rollback()
+            for pending in batch:
+                pending.seq = None
+                pending.message_id = None
+            raise
+        finally:
+            session.close()
+
+    def _persist_chat(self, session: Session, chat_id: int, messages: List[PendingMessage]):
+        # Номера выделяются одним UPDATE на чат, а не на сообщение
+        last_seq = session.execute(
+            update(Chat)
+            .where(Chat.id == chat_id)
+            .values(last_seq=Chat.last_seq + len(messages), updated_at=messages[-1].timestamp)
+            .returning(Chat.last_seq)
+        ).scalar_one_or_none()
+        if last_seq is None:
+            raise ValueError("Чат не найден")
+
+        first_seq = last_seq - len(messages) + 1
+        rows: List[Tuple[PendingMessage, ChatMessage]] = []
+        for offset, pending in enumerate(messages):
+            pending.seq = first_seq + offset
+            rows.append((pending, ChatMessage(
+                chat_id=pending.chat_id,
+                user_from_id=pending.user_from_id,
+                user_to_id=pending.user_to_id,
+                message=pending.message,
+                timestamp=pending.timestamp,
+                seq=pending.seq
+            )))
+        session.add_all([row for _, row in rows])
+        session.flush()
+        for pending, row in rows:
+            pending.message_id = row.id
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            **self.stats,
+            'queued': self.queue.qsize() if self.queue is not None else 0
+        }
+
+# Глобальный писатель сообщений чата
+chat_message_writer = ChatMessageWriter()
@@ -0,0 +1,414 @@
+"""
+Асинхронный конвейер модерации
+Контент (сообщения, поездки, профили) ставится в очередь и проверяется
+пакетами в пуле процессов; при превышении порога автоматически создается
+ModerationReport. Синхронно проверяется только короткий стоп-лист.
+"""
+
+import asyncio
+import json
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+
+from ..config.settings import settings
+from ..database import SessionLocal
+from ..models.moderation import ModerationReport
+from ..utils.logger import get_logger
+from ..utils.moderation_matcher import ModerationMatcher
+from ..utils.near_duplicate import NearDuplicateIndex, RedisNearDuplicateIndex, SnapshotSlot, minhash
+from .moderation_service import CompiledRuleSet, ModerationService, moderation_service
+from .stats_rollup import REPORTS, rollup_now, stats_rollup
+
+logger = get_logger("moderation_pipeline")
+
+# Стоп-лист, который блокирует запись сразу, без очереди
+BLOCKLIST_PATTERNS = [
+    r'\b(сука|блять|хуй|пизда|ебать)\b'
+]
+
+# Тип нарушения -> причина жалобы (ModerationReport.reason)
+VIOLATION_REASONS = {
+    "spam": "spam",
+    "toxic": "inappropriate",
+    "rule": "inappropriate",
+    "near_duplicate": "spam",
+    "suspicious": "other"
+}
+
+# Сервис модерации внутри процесса пула
+_worker_service: Optional[ModerationService] = None
+
+def _init_worker(rule_set: CompiledRuleSet):
+    """Процесс пула получает уже скомпилированный в родителе набор правил"""
+    global _worker_service
+    _worker_service = ModerationService()
+    _worker_service.rule_set = rule_set
+
+def _worker_ready() -> int:
+    return _worker_service.rule_set.version if _worker_service else 0
+
+def score_batch(batch: List[Tuple[str, ...]]) -> List[Dict[str, Any]]:
+    """Проверяет пакет (тексты одного объекта на элемент); выполняется в пуле
+
+    Вместе со скором считается MinHash-подпись для поиска массовых рассылок.
+    """
+    service = _worker_service or moderation_service
+    results = []
+    for texts in batch:
+        result = service.check_texts(texts)
+        signature = minhash(" ".join(texts))
+        result["signature"] = signature.tobytes() if signature is not None else None
+        results.append(result)
+    return results
+
+class ContentEvent:
+    """Контент, ожидающий проверки"""
+
+    __slots__ = ("target_type", "target_id", "author_id", "texts")
+
+    def __init__(self, target_type: str, target_id: int, author_id: Optional[int], texts: Tuple[str, ...]):
+        self.target_type = target_type
+        self.target_id = target_id
+        self.author_id = author_id
+        self.texts = texts
+
+class ModerationPipeline:
+    """Очередь модерации с пакетной проверкой в пуле процессов
+
+    Порог settings.moderation_threshold задан долей: жалоба создается,
+    если скор проверки >= moderation_threshold * 100.
+    """
+
+    def __init__(self, workers: Optional[int] = None, batch_size: Optional[int] = None,
+                 batch_interval_ms: Optional[float] = None, queue_size: Optional[int] = None):
+        self.workers = settings.moderation_workers if workers is None else workers
+        self.batch_size = batch_size or settings.moderation_batch_size
+        self.batch_interval = (batch_interval_ms or settings.moderation_batch_interval_ms) / 1000
+        self.queue_size = queue_size or settings.moderation_queue_size
+        self.report_score = settings.moderation_threshold * 100
+        self.blocklist = ModerationMatcher.build({"blocked": BLOCKLIST_PATTERNS})
+        self.near_duplicates = self._create_near_duplicate_index()
+        self.queue: Optional[asyncio.Queue] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.worker_task: Optional[asyncio.Task] = None
+        self.rules_task: Optional[asyncio.Task] = None
+        self.maintenance_task: Optional[asyncio.Task] = None
+        self.snapshot_slot: Optional[SnapshotSlot] = None
+        self.stats = {
+            'submitted': 0,
+            'checked': 0,
+            'reported': 0,
+            'dropped': 0,
+            'blocked': 0,
+            'near_duplicates': 0,
+            'batches': 0,
+            'errors': 0,
+            'rule_reloads': 0
+        }
+
+    def _create_near_duplicate_index(self):
+        """Индекс в Redis общий для воркеров; без Redis - свой в памяти каждого воркера"""
+        if settings.redis_url:
+            try:
+                client = redis.from_url(settings.redis_url)
+                client.ping()
+                logger.info("Индекс дубликатов подключен к Redis")
+                return RedisNearDuplicateIndex(
+                    client,
+                    threshold=settings.near_duplicate_threshold,
+                    window_seconds=settings.near_duplicate_window_seconds
+                )
+            except Exception as e:
+                logger.warning(f"Индекс дубликатов работает в памяти воркера, Redis недоступен: {e}")
+        return NearDuplicateIndex(
+            threshold=settings.near_duplicate_threshold,
+            window_seconds=settings.near_duplicate_window_seconds,
+            max_entries=settings.near_duplicate_max_entries
+        )
+
+    def check_blocklist(self, *texts: Optional[str]) -> Optional[str]:
+        """Синхронная проверка стоп-листа: первое найденное слово или None"""
+        for text in texts:
+            if not text:
+                continue
+            matches = self.blocklist.scan(text).labeled("blocked")
+            if matches:
+                self.stats['blocked'] += 1
+                return matches[0]
+        return None
+
+    def ensure_allowed(self, *texts: Optional[str]):
+        """Отклоняет контент из стоп-листа (ValueError)"""
+        if self.check_blocklist(*texts):
+            raise ValueError("Текст содержит недопустимые выражения")
+
+    def start(self):
+        """Запускает пул процессов и фоновую задачу (в цикле событий)"""
+        if self.worker_task is not None and not self.worker_task.done():
+            return
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        local_index = isinstance(self.near_duplicates, NearDuplicateIndex)
+        if local_index and self.snapshot_slot is None:
+            # Свой снимок у каждого воркера: общий файл перезаписывал бы последний сохранивший
+            self.snapshot_slot = SnapshotSlot(settings.near_duplicate_snapshot_path)
+            try:
+                self.snapshot_slot.acquire()
+            except Exception as e:
+                logger.error(f"Ошибка выбора слота снимка индекса дубликатов: {e}")
+        if local_index and not len(self.near_duplicates):
+            try:
+                loaded = self.near_duplicates.load_snapshots(settings.near_duplicate_snapshot_path)
+                logger.info(f"Загружены снимки индекса дубликатов: {loaded} записей")
+            except Exception as e:
+                logger.error(f"Ошибка загрузки снимка индекса дубликатов: {e}")
+        if self.workers > 0 and self.pool is None:
+            self.pool = self._create_pool(moderation_service.rule_set)
+        self.worker_task = asyncio.create_task(self._run())
+        if self.rules_task is None or self.rules_task.done():
+            self.rules_task = asyncio.create_task(self._watch_rules())
+        if local_index and (self.maintenance_task is None or self.maintenance_task.done()):
+            self.maintenance_task = asyncio.create_task(self._maintain_near_duplicates())
+
+    async def stop(self):
+        for task in (self.worker_task, self.rules_task, self.maintenance_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self.worker_task = None
+        self.rules_task = None
+        self.maintenance_task = None
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        if self.snapshot_slot is not None:
+            await asyncio.to_thread(self._save_on_stop, self.snapshot_slot)
+            self.snapshot_slot = None
+
+    def _save_on_stop(self, slot: SnapshotSlot):
+        """Переносит записи в общий снимок и удаляет снимок воркера"""
+        try:
+            self.near_duplicates.merge_into(slot.base_path)
+            if slot.path is not None and os.path.exists(slot.path):
+                os.remove(slot.path)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения снимка индекса дубликатов: {e}")
+        finally:
+            slot.release()
+
+    def _create_pool(self, rule_set: CompiledRuleSet) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(rule_set,)
+        )
+
+    async def apply_rule_set(self, rule_set: CompiledRuleSet):
+        """Переключает проверку на новый набор правил
+
+        Новый пул запускается и прогревается рядом со старым, затем ссылка
+        на пул заменяется; пакеты в работе дорабатывают на старом пуле.
+        """
+        if self.pool is not None:
+            pool = self._create_pool(rule_set)
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(
+                loop.run_in_executor(pool, _worker_ready) for _ in range(self.workers)
+            ))
+            old_pool, self.pool = self.pool, pool
+            old_pool.shutdown(wait=False)
+        moderation_service.rule_set = rule_set
+        self.stats['rule_reloads'] += 1
+        logger.info(f"Применены правила модерации версии {rule_set.version}: {rule_set.matcher.get_stats()}")
+
+    def _compile_if_changed(self) -> Optional[CompiledRuleSet]:
+        """Проверяет версию правил и при изменении собирает новый набор (в потоке)"""
+        session = SessionLocal()
+        try:
+            if moderation_service.get_rules_version(session) == moderation_service.rule_set.version:
+                return None
+            version, rules = moderation_service.fetch_rules(session)
+        finally:
+            session.close()
+        return moderation_service.compile_rule_set(version, rules)
+
+    async def _watch_rules(self):
+        while True:
+            await asyncio.sleep(settings.moderation_rules_poll_interval)
+            try:
+                rule_set = await asyncio.to_thread(self._compile_if_changed)
+                if rule_set is not None:
+                    await self.apply_rule_set(rule_set)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Ошибка перезагрузки правил модерации: {e}")
+
+    async def _maintain_near_duplicates(self):
+        """Чистка индекса в памяти по возрасту и снимок на диск по таймеру
+
+        Без этого устаревшие корзины жили бы до переполнения max_entries, а
+        снимок писался бы только при штатной остановке.
+        """
+        while True:
+            await asyncio.sleep(settings.near_duplicate_maintenance_interval)
+            try:
+                await asyncio.to_thread(self.near_duplicates.prune)
+                if self.snapshot_slot is not None and self.snapshot_slot.path is not None:
+                    await asyncio.to_thread(self.near_duplicates.save, self.snapshot_slot.path)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Ошибка обслуживания индекса дубликатов: {e}")
+
+    def submit(self, target_type: str, target_id: int, author_id: Optional[int], *texts: Optional[str]):
+        """Ставит контент в очередь проверки, не блокируя вызывающего
+
+        Можно вызывать из потоков: событие передается в цикл событий конвейера.
+        """
+        if not settings.auto_moderation or target_id is None:
+            return
+        texts = tuple(text for text in texts if text)
+        if not texts:
+            return
+        event = ContentEvent(target_type, target_id, author_id, texts)
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and (self.loop is None or self.loop.is_closed()):
+            self.start()
+        if self.loop is None:
+            self.stats['dropped'] += 1
+            return
+        if running is self.loop:
+            self._put(event)
+        else:
+            self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event: ContentEvent):
+        try:
+            self.queue.put_nowait(event)
+            self.stats['submitted'] += 1
+        except asyncio.QueueFull:
+            # Модерация отстает: запись важнее, событие теряется
+            self.stats['dropped'] += 1
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._process(batch)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Ошибка обработки пакета модерации ({len(batch)}): {e}")
+
+    async def _process(self, batch: List[ContentEvent]):
+        texts = [event.texts for event in batch]
+        if self.pool is not None:
+            results = await asyncio.get_running_loop().run_in_executor(self.pool, score_batch, texts)
+        else:
+            results = await asyncio.to_thread(score_batch, texts)
+
+        self.stats['batches'] += 1
+        self.stats['checked'] += len(batch)
+        # Индекс дубликатов может быть в Redis - проверка в потоке, не в цикле событий
+        flagged = await asyncio.to_thread(self._flag_batch, batch, results)
+        if flagged:
+            await asyncio.to_thread(self.save_reports, flagged)
+
+    def _flag_batch(self, batch: List[ContentEvent], results: List[Dict[str, Any]]) -> List[Tuple[ContentEvent, Dict[str, Any]]]:
+        flagged = []
+        for event, result in zip(batch, results):
+            if self.check_near_duplicates(event, result) or result["score"] >= self.report_score:
+                flagged.append((event, result))
+        return flagged
+
+    def check_near_duplicates(self, event: ContentEvent, result: Dict[str, Any]) -> bool:
+        """Массовая рассылка: похожий текст от многих отправителей в окне"""
+        signature = result.pop("signature", None)
+        if signature is None:
+            return False
+        senders = self.near_duplicates.check_and_add(array("H", signature), event.author_id or 0)
+        senders = set(senders) | {event.author_id or 0}
+        if len(senders) < settings.near_duplicate_min_senders:
+            return False
+
+        self.stats['near_duplicates'] += 1
+        result["violations"].append({
+            "type": "near_duplicate",
+            "severity": "high",
+            "senders": len(senders),
+            "description": "Похожий текст от многих отправителей"
+        })
+        result["score"] += 50
+        return True
+
+    def save_reports(self, flagged: List[Tuple[ContentEvent, Dict[str, Any]]]):
+        """Создает жалобы от имени автомодерации (reporter_id = NULL)"""
+        session = SessionLocal()
+        try:
+            now = rollup_now()
+            for event, result in flagged:
+                violation_types = [violation["type"] for violation in result["violations"]]
+                reason = next(
+                    (VIOLATION_REASONS[kind] for kind in violation_types if kind in VIOLATION_REASONS),
+                    "other"
+                )
+                report = ModerationReport(
+                    reporter_id=None,
+                    target_type=event.target_type,
+                    target_id=event.target_id,
+                    reason=reason,
+                    description=json.dumps({
+                        "auto": True,
+                        "author_id": event.author_id,
+                        "score": result["score"],
+                        "violations": violation_types
+                    }, ensure_ascii=False),
+                    status="pending",
+                    score=result["score"],
+                    created_at=now
+                )
+                moderation_service.register_report(session, report)
+                session.add(report)
+                # Следующая жалоба пакета на ту же цель должна увидеть эту
+                session.flush()
+            stats_rollup.record(session, REPORTS, at=now, count=len(flagged))
+            session.commit()
+            self.stats['reported'] += len(flagged)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'queued': self.queue.qsize() if self.queue is not None else 0,
+            'workers': self.workers if self.pool is not None else 0,
+            'rules_version': moderation_service.rule_set.version,
+            'near_duplicate_index': self.near_duplicates.get_stats()
+        }
+
+# Глобальный конвейер модерации
+moderation_pipeline = ModerationPipeline()
@@ -1,16 +1,39 @@
-import re
 import logging
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, Iterable, List, Optional, Tuple, Any
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, func
 from ..models.user import User
 from ..models.ride import Ride
-from ..models.moderation import ModerationReport, ModerationAction, ModerationRule
+from ..models.moderation import ModerationReport, ModerationAction, ModerationRule, ModerationRulesVersion
 from ..config.settings import settings
+from ..utils.moderation_matcher import ModerationMatcher, check_rule_pattern
+from .stats_rollup import ACTIONS, REPORTS, REPORTS_RESOLVED, rollup_now, stats_rollup
+from .trust_service import trust_service
 
 logger = logging.getLogger(__name__)
 
+# Вклад сработавшего правила модерации в итоговый скор
+RULE_SEVERITY_SCORES = {
+    "low": 10,
+    "medium": 30,
+    "high": 50
+}
+
+class CompiledRuleSet:
+    """Скомпилированный набор правил определенной версии
+    
+    Заменяется целиком присваиванием одной ссылки, поэтому проверка текста
+    всегда видит согласованные автомат и правила.
+    """
+    
+    __slots__ = ("version", "rules", "matcher")
+    
+    def __init__(self, version: int, rules: Dict[int, Dict[str, Any]], matcher: ModerationMatcher):
+        self.version = version
+        self.rules = rules
+        self.matcher = matcher
+
 class ModerationService:
     def __init__(self):
         self.spam_patterns = [
@@ -36,10 +59,129 @@ class ModerationService:
             r'\b(секрет|тайна|конфиденциально)\b'
         ]
         
-        # Компилируем регулярные выражения для производительности
-        self.spam_regex = re.compile('|'.join(self.spam_patterns), re.IGNORECASE)
-        self.toxic_regex = re.compile('|'.join(self.toxic_patterns), re.IGNORECASE)
-        self.suspicious_regex = re.compile('|'.join(self.suspicious_patterns), re.IGNORECASE)
+        # Встроенные списки и активные правила из moderation_rules проверяются
+        # одним автоматом за один проход
+        self.rule_set = self.compile_rule_set(0, {})
+    
+    @property
+    def rules(self) -> Dict[int, Dict[str, Any]]:
+        """Активные правила текущего набора (id -> to_dict() правила)"""
+        return self.rule_set.rules
+    
+    @property
+    def matcher(self) -> ModerationMatcher:
+        return self.rule_set.matcher
+    
+    def compile_rule_set(self, version: int, rules: Dict[int, Dict[str, Any]]) -> CompiledRuleSet:
+        """Собирает автомат встроенных списков и правил (CPU, без обращений к базе)"""
+        matcher = ModerationMatcher.build(
+            {
+                "spam": self.spam_patterns,
+                "toxic": self.toxic_patterns,
+                "suspicious": self.suspicious_patterns
+            },
+            [(rule_id, rule["pattern"]) for rule_id, rule in rules.items()]
+        )
+        return CompiledRuleSet(version, rules, matcher)
+    
+    def get_rules_version(self, db: Session) -> int:
+        """Версия правил: один запрос к однострочной таблице"""
+        version = db.query(ModerationRulesVersion.version).filter(ModerationRulesVersion.id == 1).scalar()
+        return version or 0
+    
+    def bump_rules_version(self, db: Session):
+        """Увеличивает версию правил (в транзакции изменения правила)
+
+        Один upsert: строка id = 1 создается миграцией 013, но и без нее
+        параллельные вызовы не столкнутся на вставке.
+        """
+        if db.get_bind().dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        table = ModerationRulesVersion.__table__
+        db.execute(
+            insert(table)
+            .values(id=1, version=1)
+            .on_conflict_do_update(
+                index_elements=[table.c.id],
+                set_={"version": table.c.version + 1, "updated_at": func.now()}
+            )
+        )
+    
+    def validate_rule_pattern(self, pattern: str):
+        """UnsafePatternError, если шаблон нельзя применять ко всем сообщениям"""
+        check_rule_pattern(
+            pattern,
+            max_length=settings.moderation_rule_max_pattern_length,
+            timeout=settings.moderation_rule_trial_timeout
+        )
+    
+    def fetch_rules(self, db: Session) -> Tuple[int, Dict[int, Dict[str, Any]]]:
+        """Версия и активные правила, прочитанные в одной транзакции"""
+        version = self.get_rules_version(db)
+        rules = db.query(ModerationRule).filter(ModerationRule.is_active == True).all()
+        return version, {rule.id: rule.to_dict() for rule in rules}
+    
+    def load_rules(self, db: Session) -> int:
+        """Загружает активные правила модерации и пересобирает автомат"""
+        version, rules = self.fetch_rules(db)
+        self.rule_set = self.compile_rule_set(version, rules)
+        logger.info(f"Загружено правил модерации: {len(rules)} (версия {version}), {self.matcher.get_stats()}")
+        return len(rules)
+    
+    def create_rule(self, db: Session, name: str, pattern: str, action: str,
+                    severity: str = "medium", description: str = None) -> ModerationRule:
+        """Создание правила; процессы подхватят его по версии правил"""
+        self.validate_rule_pattern(pattern)
+        try:
+            rule = ModerationRule(
+                name=name,
+                description=description,
+                pattern=pattern,
+                action=action,
+                severity=severity,
+                is_active=True
+            )
+            db.add(rule)
+            self.bump_rules_version(db)
+            db.commit()
+            db.refresh(rule)
+            
+            logger.info(f"Создано правило модерации {rule.id}")
+            return rule
+            
+        except Exception as e:
+            logger.error(f"Ошибка создания правила: {str(e)}")
+            db.rollback()
+            raise
+    
+    def update_rule(self, db: Session, rule_id: int, **fields) -> ModerationRule:
+        """Изменение правила (pattern, action, severity, is_active, ...)"""
+        if fields.get("pattern") is not None:
+            self.validate_rule_pattern(fields["pattern"])
+        try:
+            rule = db.query(ModerationRule).filter(ModerationRule.id == rule_id).first()
+            if not rule:
+                raise ValueError("Правило не найдено")
+            
+            for field, value in fields.items():
+                if value is not None:
+                    setattr(rule, field, value)
+            self.bump_rules_version(db)
+            db.commit()
+            db.refresh(rule)
+            
+            logger.info(f"Изменено правило модерации {rule_id}")
+            return rule
+            
+        except Exception as e:
+            logger.error(f"Ошибка изменения правила: {str(e)}")
+            db.rollback()
+            raise
+    
+    def get_rules(self, db: Session) -> List[ModerationRule]:
+        return db.query(ModerationRule).order_by(ModerationRule.id).all()
     
     def check_text_content(self, text: str) -> Dict[str, Any]:
         """Проверка текстового контента на нарушения"""
@@ -48,9 +190,11 @@ class ModerationService:
         
         violations = []
         score = 0
+        rule_set = self.rule_set
+        scan = rule_set.matcher.scan(text)
         
         # Проверка на спам
-        spam_matches = self.spam_regex.findall(text)
+        spam_matches = scan.labeled("spam")
         if spam_matches:
             violations.append({
                 "type": "spam",
@@ -61,7 +205,7 @@ class ModerationService:
             score += 50
         
         # Проверка на токсичность
-        toxic_matches = self.toxic_regex.findall(text)
+        toxic_matches = scan.labeled("toxic")
         if toxic_matches:
             violations.append({
                 "type": "toxic",
@@ -72,7 +216,7 @@ class ModerationService:
             score += 30
         
         # Проверка на подозрительный контент
-        suspicious_matches = self.suspicious_regex.findall(text)
+        suspicious_matches = scan.labeled("suspicious")
         if suspicious_matches:
             violations.append({
                 "type": "suspicious",
@@ -82,8 +226,23 @@ class ModerationService:
             })
             score += 10
         
+        # Правила модерации из базы
+        for label, matches in list(scan.matches.items()) + list(scan.regex_matches.items()):
+            rule = rule_set.rules.get(int(label[5:])) if label.startswith("rule:") else None
+            if rule is None:
+                continue
+            violations.append({
+                "type": "rule",
+                "severity": rule["severity"],
+                "matches": matches,
+                "rule_id": rule["id"],
+                "action": rule["action"],
+                "description": rule["description"] or rule["name"]
+            })
+            score += RULE_SEVERITY_SCORES.get(rule["severity"], 30)
+        
         # Проверка на капс
-        caps_ratio = sum(1 for c in text if c.isupper()) / len(text) if text else 0
+        caps_ratio = scan.caps_ratio
         if caps_ratio > 0.7:
             violations.append({
                 "type": "caps",
@@ -94,7 +253,7 @@ class ModerationService:
             score += 5
         
         # Проверка на повторяющиеся символы
-        repeated_chars = re.findall(r'(.)\1{4,}', text)
+        repeated_chars = scan.repeated
         if repeated_chars:
             violations.append({
                 "type": "repeated_chars",
@@ -111,6 +270,23 @@ class ModerationService:
             "requires_review": score >= 30
         }
     
+    def check_texts(self, texts: Iterable[str]) -> Dict[str, Any]:
+        """Суммарная проверка нескольких текстов одного объекта"""
+        violations = []
+        score = 0
+        for text in texts:
+            check = self.check_text_content(text)
+            if not check["clean"]:
+                violations.extend(check["violations"])
+                score += check["score"]
+        
+        return {
+            "clean": score < 20,
+            "score": score,
+            "violations": violations,
+            "requires_review": score >= 30
+        }
+    
     def check_user_profile(self, user: User) -> Dict[str, Any]:
         """Проверка профиля пользователя"""
         violations = []
@@ -211,16 +387,20 @@ class ModerationService:
                      target_id: int, reason: str, description: str = None) -> ModerationReport:
         """Создание жалобы"""
         try:
+            now = rollup_now()
             report = ModerationReport(
                 reporter_id=reporter_id,
                 target_type=target_type,
                 target_id=target_id,
                 reason=reason,
                 description=description,
-                status="pending"
+                status="pending",
+                created_at=now
             )
             
+            self.register_report(db, report)
             db.add(report)
+            stats_rollup.record(db, REPORTS, at=now)
             db.commit()
             db.refresh(report)
             
@@ -245,6 +425,100 @@ class ModerationService:
         
         return query.order_by(ModerationReport.created_at.desc()).limit(limit).all()
     
+    def register_report(self, db: Session, report: ModerationReport):
+        """Учитывает новую жалобу в приоритете жалоб на ту же цель (до db.add)"""
+        existing = db.query(ModerationReport).filter(
+            ModerationReport.target_type == report.target_type,
+            ModerationReport.target_id == report.target_id,
+            ModerationReport.status == "pending"
+        ).update(
+            {ModerationReport.target_reports: ModerationReport.target_reports + 1},
+            synchronize_session=False
+        )
+        report.target_reports = existing + 1
+    
+    def claim_reports(self, db: Session, moderator_id: int, limit: int = 10,
+                      lease_seconds: Optional[int] = None) -> List[ModerationReport]:
+        """Выдает модератору следующие жалобы из очереди в аренду
+        
+        Порядок: скор автомодерации, число жалоб на цель, время создания.
+        Строки, заблокированные другими модераторами, пропускаются
+        (FOR UPDATE SKIP LOCKED), жалобы с истекшей арендой выдаются снова.
+        """
+        limit = max(1, min(limit, settings.moderation_claim_limit))
+        now = datetime.now()
+        lease_until = now + timedelta(seconds=lease_seconds or settings.moderation_lease_seconds)
+        available = or_(
+            ModerationReport.lease_expires_at.is_(None),
+            ModerationReport.lease_expires_at < now
+        )
+        try:
+            ids = [row.id for row in db.query(ModerationReport.id).filter(
+                ModerationReport.status == "pending",
+                available
+            ).order_by(
+                ModerationReport.score.desc(),
+                ModerationReport.target_reports.desc(),
+                ModerationReport.created_at
+            ).limit(limit).with_for_update(skip_locked=True)]
+            if not ids:
+                db.rollback()
+                return []
+            
+            # Условие аренды повторяется: без блокировок строк (SQLite) жалобу
+            # получит только один из конкурирующих модераторов
+            db.query(ModerationReport).filter(
+                ModerationReport.id.in_(ids),
+                available
+            ).update({
+                ModerationReport.claimed_by: moderator_id,
+                ModerationReport.lease_expires_at: lease_until
+            }, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            logger.error(f"Ошибка выдачи жалоб модератору {moderator_id}: {str(e)}")
+            db.rollback()
+            raise
+        
+        return db.query(ModerationReport).filter(
+            ModerationReport.id.in_(ids),
+            ModerationReport.claimed_by == moderator_id,
+            ModerationReport.lease_expires_at == lease_until
+        ).order_by(
+            ModerationReport.score.desc(),
+            ModerationReport.target_reports.desc(),
+            ModerationReport.created_at
+        ).all()
+    
+    def _leased_report(self, db: Session, report_id: int, moderator_id: int) -> ModerationReport:
+        report = db.query(ModerationReport).filter(
+            ModerationReport.id == report_id,
+            ModerationReport.claimed_by == moderator_id,
+            ModerationReport.status == "pending",
+            ModerationReport.lease_expires_at >= datetime.now()
+        ).first()
+        if not report:
+            raise ValueError("Жалоба не найдена или аренда истекла")
+        return report
+    
+    def extend_lease(self, db: Session, report_id: int, moderator_id: int,
+                     lease_seconds: Optional[int] = None) -> ModerationReport:
+        """Продлевает аренду жалобы текущим модератором"""
+        report = self._leased_report(db, report_id, moderator_id)
+        report.lease_expires_at = datetime.now() + timedelta(
+            seconds=lease_seconds or settings.moderation_lease_seconds
+        )
+        db.commit()
+        db.refresh(report)
+        return report
+    
+    def release_report(self, db: Session, report_id: int, moderator_id: int):
+        """Возвращает жалобу в очередь до истечения аренды"""
+        report = self._leased_report(db, report_id, moderator_id)
+        report.claimed_by = None
+        report.lease_expires_at = None
+        db.commit()
+    
     def review_report(self, db: Session, report_id: int, moderator_id: int,
                      action: str, reason: str = None) -> ModerationAction:
         """Рассмотрение жалобы модератором"""
@@ -254,23 +528,40 @@ class ModerationService:
                 raise ValueError("Жалоба не найдена")
             
             # Создаем действие модератора
+            now = rollup_now()
             moderation_action = ModerationAction(
                 report_id=report_id,
                 moderator_id=moderator_id,
                 action=action,
-                reason=reason
+                reason=reason,
+                created_at=now
             )
             
             # Обновляем статус жалобы
+            already_resolved = report.status == "resolved"
             report.status = "resolved"
             report.resolved_at = datetime.now()
+            report.lease_expires_at = None
+            db.add(moderation_action)
+            stats_rollup.record(db, ACTIONS, at=now, dimension=action)
+            if not already_resolved:
+                stats_rollup.record(db, REPORTS_RESOLVED, at=report.created_at)
+            
+            # Скор доверия обновляется в той же транзакции
+            if report.target_type == "user":
+                trust_service.record_event(
+                    db, report.target_id,
+                    warnings=1 if action == "warn" else 0,
+                    reports=0 if already_resolved else 1
+                )
             
             # Применяем действие к цели
             self.apply_action(db, report.target_type, report.target_id, action)
             
-            db.add(moderation_action)
             db.commit()
             db.refresh(moderation_action)
+            if report.target_type == "user":
+                trust_service.invalidate(report.target_id)
             
             logger.info(f"Жалоба {report_id} рассмотрена: {action}")
             return moderation_action
@@ -329,85 +620,25 @@ class ModerationService:
         }
     
     def check_user_trust_score(self, db: Session, user_id: int) -> Dict[str, Any]:
-        """Проверка доверия к пользователю"""
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return {"trust_score": 0, "level": "unknown"}
-        
-        # Базовый скор
-        trust_score = 100
-        
-        # Штрафы за предупреждения
-        if user.warnings:
-            trust_score -= user.warnings * 20
-        
-        # Штрафы за жалобы
-        reports = db.query(ModerationReport).filter(
-            and_(
-                ModerationReport.target_type == "user",
-                ModerationReport.target_id == user_id,
-                ModerationReport.status == "resolved"
-            )
-        ).count()
-        trust_score -= reports * 15
-        
-        # Бонусы за возраст аккаунта
-        if user.created_at:
-            days_registered = (datetime.now() - user.created_at).days
-            if days_registered > 30:
-                trust_score += 10
-            if days_registered > 90:
-                trust_score += 20
-        
-        # Определение уровня доверия
-        if trust_score >= 80:
-            level = "high"
-        elif trust_score >= 50:
-            level = "medium"
-        elif trust_score >= 20:
-            level = "low"
-        else:
-            level = "suspicious"
-        
-        return {
-            "trust_score": max(0, trust_score),
-            "level": level,
-            "warnings": user.warnings or 0,
-            "reports": reports
-        }
+        """Проверка доверия к пользователю (таблица trust_scores + кэш процесса)"""
+        return trust_service.get_trust_score(db, user_id)
     
     def get_moderation_stats(self, db: Session, days: int = 30) -> Dict[str, Any]:
-        """Получение статистики модерации"""
-        start_date = datetime.now() - timedelta(days=days)
-        
-        # Общее количество жалоб
-        total_reports = db.query(ModerationReport).filter(
-            ModerationReport.created_at >= start_date
-        ).count()
+        """Получение статистики модерации (из почасовых и суточных агрегатов)"""
+        now = rollup_now()
+        totals = stats_rollup.totals(db, [REPORTS, REPORTS_RESOLVED, ACTIONS], now - timedelta(days=days), now)
         
-        # Жалобы по статусам
-        pending_reports = db.query(ModerationReport).filter(
-            and_(
-                ModerationReport.status == "pending",
-                ModerationReport.created_at >= start_date
-            )
-        ).count()
-        
-        resolved_reports = db.query(ModerationReport).filter(
-            and_(
-                ModerationReport.status == "resolved",
-                ModerationReport.created_at >= start_date
-            )
-        ).count()
+        total_reports = totals.get((REPORTS, ""), (0, 0))[0]
+        resolved_reports = totals.get((REPORTS_RESOLVED, ""), (0, 0))[0]
+        # Жалоба либо ожидает рассмотрения, либо рассмотрена
+        pending_reports = max(0, total_reports - resolved_reports)
         
         # Действия модераторов
-        actions = db.query(ModerationAction).filter(
-            ModerationAction.created_at >= start_date
-        ).all()
-        
-        action_stats = {}
-        for action in actions:
-            action_stats[action.action] = action_stats.get(action.action, 0) + 1
+        action_stats = {
+            dimension: count
+            for (metric, dimension), (count, _) in totals.items()
+            if metric == ACTIONS and count
+        }
         
         return {
             "period_days": days,
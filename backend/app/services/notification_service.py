@@ -1,12 +1,15 @@
 import asyncio
 import aiohttp
 import logging
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from sqlalchemy.orm import Session
 from ..models.user import User
 from ..models.notification import NotificationLog, NotificationSettings
 from ..config.settings import settings
+from ..utils.notification_templates import notification_templates
+from ..monitoring.prometheus import TELEGRAM_MESSAGES, TELEGRAM_SEND_DURATION
 
 logger = logging.getLogger(__name__)
 
@@ -108,6 +111,7 @@ class NotificationService:
                                   parse_mode: str = "HTML", 
                                   reply_markup: Optional[Dict] = None) -> Dict[str, Any]:
         """Отправка сообщения в Telegram"""
+        started = time.monotonic()
         try:
             session = await self.get_session()
             
@@ -122,14 +126,17 @@ class NotificationService:
             
             async with session.post(f"{self.base_url}/sendMessage", json=payload) as response:
                 result = await response.json()
+                TELEGRAM_SEND_DURATION.observe(time.monotonic() - started)
                 
                 if response.status == 200 and result.get("ok"):
+                    TELEGRAM_MESSAGES.labels("sent").inc()
                     logger.info(f"Уведомление отправлено пользователю {chat_id}")
                     return {
                         "success": True,
                         "response": result
                     }
                 else:
+                    TELEGRAM_MESSAGES.labels("throttled" if response.status == 429 else "api_error").inc()
                     logger.error(f"Ошибка Telegram API: {result}")
                     return {
                         "success": False,
@@ -138,12 +145,30 @@ class NotificationService:
                     }
                     
         except Exception as e:
+            TELEGRAM_MESSAGES.labels("error").inc()
             logger.error(f"Ошибка отправки уведомления: {str(e)}")
             return {
                 "success": False,
                 "error": str(e)
             }
     
+    def get_user_language(self, user: User) -> str:
+        """Язык уведомлений пользователя
+        
+        Язык пользователя в профиле не хранится - уведомления отправляются
+        на языке по умолчанию реестра шаблонов.
+        """
+        return notification_templates.default_language
+    
+    def render_system_text(self, title: str, message: str, 
+                           notification_type: str, language: str) -> str:
+        """Текст системного уведомления из скомпилированного шаблона"""
+        return notification_templates.render("system", {
+            "icon": notification_templates.get_icon(notification_type, language),
+            "title": title,
+            "message": message
+        }, language=language)["text"]
+    
     async def send_ride_notification(self, user: User, ride_data: Dict, 
                                    notification_type: str, db: Session) -> bool:
         """Уведомления о поездках"""
@@ -164,95 +189,21 @@ class NotificationService:
                 logger.info(f"Тихие часы для пользователя {user.id}")
                 return True  # Не считаем ошибкой
             
-            # Шаблоны уведомлений
-            templates = {
-                "new_ride": {
-                    "title": "🚗 Новая поездка",
-                    "text": f"""
-<b>Новая поездка по вашему маршруту!</b>
-
-📍 <b>Маршрут:</b> {ride_data.get('from', '')} → {ride_data.get('to', '')}
-📅 <b>Дата:</b> {ride_data.get('date', '')}
-🕐 <b>Время:</b> {ride_data.get('time', '')}
-💰 <b>Цена:</b> {ride_data.get('price', '')} ₽
-👤 <b>Водитель:</b> {ride_data.get('driver_name', '')}
-⭐ <b>Рейтинг:</b> {ride_data.get('driver_rating', '0')}
-                    """.strip(),
-                    "button": {"text": "Посмотреть поездку", "callback_data": f"view_ride_{ride_data.get('id')}"}
-                },
-                "ride_reminder": {
-                    "title": "⏰ Напоминание о поездке",
-                    "text": f"""
-<b>Напоминание о поездке</b>
-
-📍 <b>Маршрут:</b> {ride_data.get('from', '')} → {ride_data.get('to', '')}
-📅 <b>Дата:</b> {ride_data.get('date', '')}
-🕐 <b>Время:</b> {ride_data.get('time', '')}
-🚗 <b>Автомобиль:</b> {ride_data.get('car_info', '')}
-👤 <b>Водитель:</b> {ride_data.get('driver_name', '')}
-📱 <b>Телефон:</b> {ride_data.get('driver_phone', '')}
-                    """.strip(),
-                    "button": {"text": "Открыть чат", "callback_data": f"open_chat_{ride_data.get('id')}"}
-                },
-                "ride_cancelled": {
-                    "title": "❌ Поездка отменена",
-                    "text": f"""
-<b>Поездка отменена</b>
-
-📍 <b>Маршрут:</b> {ride_data.get('from', '')} → {ride_data.get('to', '')}
-📅 <b>Дата:</b> {ride_data.get('date', '')}
-🕐 <b>Время:</b> {ride_data.get('time', '')}
-📝 <b>Причина:</b> {ride_data.get('reason', 'Не указана')}
-                    """.strip(),
-                    "button": {"text": "Найти другую поездку", "callback_data": "find_ride"}
-                },
-                "booking_confirmed": {
-                    "title": "✅ Бронирование подтверждено",
-                    "text": f"""
-<b>Ваше место забронировано!</b>
-
-📍 <b>Маршрут:</b> {ride_data.get('from', '')} → {ride_data.get('to', '')}
-📅 <b>Дата:</b> {ride_data.get('date', '')}
-🕐 <b>Время:</b> {ride_data.get('time', '')}
-💰 <b>Цена:</b> {ride_data.get('price', '')} ₽
-👤 <b>Водитель:</b> {ride_data.get('driver_name', '')}
-                    """.strip(),
-                    "button": {"text": "Открыть чат", "callback_data": f"open_chat_{ride_data.get('id')}"}
-                },
-                "new_passenger": {
-                    "title": "👤 Новый пассажир",
-                    "text": f"""
-<b>Новый пассажир забронировал место</b>
-
-📍 <b>Маршрут:</b> {ride_data.get('from', '')} → {ride_data.get('to', '')}
-📅 <b>Дата:</b> {ride_data.get('date', '')}
-🕐 <b>Время:</b> {ride_data.get('time', '')}
-👤 <b>Пассажир:</b> {ride_data.get('passenger_name', '')}
-📱 <b>Телефон:</b> {ride_data.get('passenger_phone', '')}
-                    """.strip(),
-                    "button": {"text": "Открыть чат", "callback_data": f"open_chat_{ride_data.get('id')}"}
-                }
-            }
-            
-            template = templates.get(notification_type)
+            # Шаблон скомпилирован заранее, результат рендеринга кэшируется
+            template = notification_templates.render(
+                notification_type, ride_data, language=self.get_user_language(user)
+            )
             if not template:
                 logger.error(f"Неизвестный тип уведомления: {notification_type}")
                 self.log_notification(db, user.id, notification_type, 
                                    success=False, error_message=f"Unknown type: {notification_type}")
                 return False
             
-            # Формируем клавиатуру
-            reply_markup = None
-            if template.get("button"):
-                reply_markup = {
-                    "inline_keyboard": [[template["button"]]]
-                }
-            
             # Отправляем уведомление
             result = await self.send_telegram_message(
                 chat_id=user.telegram_id,
                 text=template["text"],
-                reply_markup=reply_markup
+                reply_markup=template["reply_markup"]
             )
             
             # Логируем результат
@@ -277,8 +228,8 @@ class NotificationService:
     
     async def send_system_notification(self, user: User, title: str, 
                                      message: str, notification_type: str = "info",
-                                     db: Session = None) -> bool:
-        """Системные уведомления"""
+                                     db: Session = None, text: Optional[str] = None) -> bool:
+        """Системные уведомления (text - уже отрендеренный текст при массовой рассылке)"""
         try:
             if not user.telegram_id:
                 if db:
@@ -296,22 +247,10 @@ class NotificationService:
                 logger.info(f"Тихие часы для пользователя {user.id}")
                 return True
             
-            # Иконки для разных типов уведомлений
-            icons = {
-                "info": "ℹ️",
-                "success": "✅",
-                "warning": "⚠️",
-                "error": "❌",
-                "security": "🔒"
-            }
-            
-            icon = icons.get(notification_type, "ℹ️")
-            
-            text = f"""
-<b>{icon} {title}</b>
-
-{message}
-            """.strip()
+            if text is None:
+                text = self.render_system_text(
+                    title, message, notification_type, self.get_user_language(user)
+                )
             
             result = await self.send_telegram_message(
                 chat_id=user.telegram_id,
@@ -359,20 +298,24 @@ class NotificationService:
             ).all()
             
             for ride in rides:
+                # Данные поездки общие для водителя и всех пассажиров:
+                # шаблон рендерится один раз, остальные отправки берут его из кэша
+                ride_data = {
+                    "id": ride.id,
+                    "from": ride.from_location,
+                    "to": ride.to_location,
+                    "date": ride.date.strftime("%d.%m.%Y"),
+                    "time": ride.time,
+                    "car_info": f"{ride.driver.car_brand} {ride.driver.car_model}" if ride.driver else "",
+                    "driver_name": ride.driver.full_name if ride.driver else "",
+                    "driver_phone": ride.driver.phone if ride.driver else ""
+                }
+                
                 # Уведомляем водителя
                 if ride.driver:
                     await self.send_ride_notification(
                         user=ride.driver,
-                        ride_data={
-                            "id": ride.id,
-                            "from": ride.from_location,
-                            "to": ride.to_location,
-                            "date": ride.date.strftime("%d.%m.%Y"),
-                            "time": ride.time,
-                            "car_info": f"{ride.driver.car_brand} {ride.driver.car_model}",
-                            "driver_name": ride.driver.full_name,
-                            "driver_phone": ride.driver.phone
-                        },
+                        ride_data=ride_data,
                         notification_type="ride_reminder",
                         db=db
                     )
@@ -388,16 +331,7 @@ class NotificationService:
                 for booking in bookings:
                     await self.send_ride_notification(
                         user=booking.passenger,
-                        ride_data={
-                            "id": ride.id,
-                            "from": ride.from_location,
-                            "to": ride.to_location,
-                            "date": ride.date.strftime("%d.%m.%Y"),
-                            "time": ride.time,
-                            "car_info": f"{ride.driver.car_brand} {ride.driver.car_model}",
-                            "driver_name": ride.driver.full_name,
-                            "driver_phone": ride.driver.phone
-                        },
+                        ride_data=ride_data,
                         notification_type="ride_reminder",
                         db=db
                     )
@@ -413,14 +347,24 @@ class NotificationService:
         """Массовая рассылка уведомлений"""
         results = {"success": 0, "failed": 0}
         
+        # Рендерим шаблон один раз на каждый язык получателей
+        rendered: Dict[str, str] = {}
+        
         for user in users:
             try:
+                language = self.get_user_language(user)
+                if language not in rendered:
+                    rendered[language] = self.render_system_text(
+                        title, message, notification_type, language
+                    )
+                
                 success = await self.send_system_notification(
                     user=user,
                     title=title,
                     message=message,
                     notification_type=notification_type,
-                    db=db
+                    db=db,
+                    text=rendered[language]
                 )
                 
                 if success:
@@ -10,9 +10,13 @@ from ..schemas.user import UserRead, UserUpdate
 from ..utils.error_handler import error_handler
 from ..utils.logger import get_logger
 from ..validators.data_validator import DataValidator
+from .moderation_pipeline import moderation_pipeline
 
 logger = get_logger("profile_service")
 
+# Текстовые поля профиля, которые проходят модерацию
+MODERATED_PROFILE_FIELDS = ("full_name", "about", "city")
+
 class ProfileService:
     """Сервис для работы с профилями пользователей"""
     
@@ -98,6 +102,17 @@ class ProfileService:
             # Валидируем данные
             self._validate_profile_data(profile_data)
             
+            # Стоп-лист проверяется сразу, остальная модерация - в фоне
+            moderated = {
+                field: value for field, value in profile_data.dict(exclude_unset=True).items()
+                if field in MODERATED_PROFILE_FIELDS and value
+            }
+            if moderation_pipeline.check_blocklist(*moderated.values()):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Профиль содержит недопустимые выражения"
+                )
+            
             # Сохраняем старые значения для логирования
             old_values = {}
             new_values = {}
@@ -128,6 +143,9 @@ class ProfileService:
             # Логируем изменения
             self._log_profile_changes(user_id, old_values, new_values)
             
+            if moderated:
+                moderation_pipeline.submit("user", user_id, user_id, *moderated.values())
+            
             logger.info(f"Профиль пользователя {user_id} успешно обновлен")
             
             # Возвращаем обновленный профиль
@@ -1,5 +1,5 @@
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import List, Optional, Dict, Any
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
@@ -7,6 +7,7 @@ from app.models.rating import Rating, Review
 from app.models.user import User
 from app.models.ride import Ride
 from app.schemas.rating import RatingCreate, ReviewCreate, RatingUpdate
+from app.services.stats_rollup import RATINGS, REVIEWS, rollup_now, stats_rollup
 from app.utils.security import get_current_user_id
 
 logger = logging.getLogger(__name__)
@@ -47,16 +48,22 @@ class RatingService:
             if existing_rating:
                 raise ValueError("Вы уже оценили этого пользователя за эту поездку")
 
-            # Создаем рейтинг
+            # Создаем рейтинг (время то же, что в агрегате; колонка с часовым поясом)
+            now = rollup_now()
             rating = Rating(
                 from_user_id=user_id,
                 target_user_id=rating_data.target_user_id,
                 ride_id=rating_data.ride_id,
                 rating=rating_data.rating,
-                comment=rating_data.comment
+                comment=rating_data.comment,
+                created_at=now.replace(tzinfo=timezone.utc)
             )
 
             self.db.add(rating)
+            stats_rollup.record(
+                self.db, RATINGS, at=now,
+                dimension=rating_data.rating, total=rating_data.rating
+            )
             self.db.commit()
             self.db.refresh(rating)
 
@@ -91,15 +98,18 @@ class RatingService:
                 raise ValueError("Вы уже оставили отзыв об этом пользователе за эту поездку")
 
             # Создаем отзыв
+            now = rollup_now()
             review = Review(
                 from_user_id=user_id,
                 target_user_id=review_data.target_user_id,
                 ride_id=review_data.ride_id,
                 text=review_data.text,
-                is_positive=review_data.is_positive
+                is_positive=review_data.is_positive,
+                created_at=now.replace(tzinfo=timezone.utc)
             )
 
             self.db.add(review)
+            stats_rollup.record(self.db, REVIEWS, at=now)
             self.db.commit()
             self.db.refresh(review)
 
@@ -129,7 +139,16 @@ class RatingService:
                 raise ValueError("Рейтинг можно редактировать только в течение 24 часов")
 
             # Обновляем данные
-            if rating_data.rating is not None:
+            if rating_data.rating is not None and rating_data.rating != rating.rating:
+                # Оценка переносится в другой разрез агрегата того же часа
+                stats_rollup.record(
+                    self.db, RATINGS, at=rating.created_at, count=-1,
+                    dimension=rating.rating, total=-rating.rating
+                )
+                stats_rollup.record(
+                    self.db, RATINGS, at=rating.created_at,
+                    dimension=rating_data.rating, total=rating_data.rating
+                )
                 rating.rating = rating_data.rating
             if rating_data.comment is not None:
                 rating.comment = rating_data.comment
@@ -167,6 +186,10 @@ class RatingService:
                 raise ValueError("Рейтинг можно удалить только в течение 24 часов")
 
             target_user_id = rating.target_user_id
+            stats_rollup.record(
+                self.db, RATINGS, at=rating.created_at, count=-1,
+                dimension=rating.rating, total=-rating.rating
+            )
             self.db.delete(rating)
             self.db.commit()
 
@@ -373,35 +396,27 @@ class RatingService:
             self.db.rollback()
 
     def get_rating_statistics(self) -> Dict[str, Any]:
-        """Получение общей статистики рейтингов"""
+        """Получение общей статистики рейтингов (из суточных агрегатов)"""
         try:
-            # Общая статистика
-            total_ratings = self.db.query(func.count(Rating.id)).scalar()
-            total_reviews = self.db.query(func.count(Review.id)).scalar()
-            avg_rating = self.db.query(func.avg(Rating.rating)).scalar() or 0.0
+            totals = stats_rollup.totals(self.db, [RATINGS, REVIEWS])
 
             # Распределение по звездам
-            rating_distribution = self.db.query(
-                Rating.rating,
-                func.count(Rating.id).label('count')
-            ).group_by(Rating.rating).all()
-
             distribution = {i: 0 for i in range(1, 6)}
-            for rating, count in rating_distribution:
-                distribution[rating] = count
+            total_ratings = 0
+            stars_sum = 0.0
+            for (metric, dimension), (count, total) in totals.items():
+                if metric != RATINGS:
+                    continue
+                total_ratings += count
+                stars_sum += total
+                if dimension.isdigit() and int(dimension) in distribution:
+                    distribution[int(dimension)] = count
+            total_reviews = totals.get((REVIEWS, ""), (0, 0))[0]
+            avg_rating = stars_sum / total_ratings if total_ratings else 0.0
 
             # Статистика по дням (последние 30 дней)
-            thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-            daily_ratings = self.db.query(
-                func.date(Rating.created_at).label('date'),
-                func.count(Rating.id).label('count')
-            ).filter(
-                Rating.created_at >= thirty_days_ago
-            ).group_by(
-                func.date(Rating.created_at)
-            ).order_by(
-                func.date(Rating.created_at)
-            ).all()
+            thirty_days_ago = rollup_now() - timedelta(days=30)
+            daily_ratings = stats_rollup.series(self.db, RATINGS, thirty_days_ago)
 
             return {
                 "total_ratings": total_ratings,
@@ -409,7 +424,7 @@ class RatingService:
                 "average_rating": round(float(avg_rating), 2),
                 "rating_distribution": distribution,
                 "daily_ratings": [
-                    {"date": str(day.date), "count": day.count}
+                    {"date": day["bucket_start"].date().isoformat(), "count": day["count"]}
                     for day in daily_ratings
                 ]
             }
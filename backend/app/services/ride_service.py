@@ -6,10 +6,13 @@ import logging
 from fastapi import HTTPException, status
 from contextlib import contextmanager
 
+from ..models.chat import Chat
 from ..models.ride import Ride
 from ..models.user import User
 from ..schemas.ride import RideCreate, RideUpdate, RideRead
 from ..database import get_db
+from .chat_service import chat_service
+from .moderation_pipeline import moderation_pipeline
 
 logger = logging.getLogger(__name__)
 
@@ -70,6 +73,8 @@ class RideService:
             if ride_data.date <= min_ride_time:
                 raise ValueError("Дата поездки должна быть минимум через 1 час")
             
+            moderation_pipeline.ensure_allowed(ride_data.from_location, ride_data.to_location)
+            
             # Создание поездки
             ride = Ride(
                 driver_id=driver_id,
@@ -85,6 +90,8 @@ class RideService:
             self.db.commit()
             self.db.refresh(ride)
             
+            moderation_pipeline.submit("ride", ride.id, driver_id, ride.from_location, ride.to_location)
+            
             logger.info(f"Создана поездка {ride.id} водителем {driver_id}")
             return ride
             
@@ -331,6 +338,8 @@ class RideService:
             if ride.status not in ["active", "booked"]:
                 raise ValueError("Поездка не может быть изменена")
             
+            moderation_pipeline.ensure_allowed(ride_data.from_location, ride_data.to_location)
+            
             # Обновление полей
             if ride_data.from_location is not None:
                 ride.from_location = ride_data.from_location
@@ -358,6 +367,9 @@ class RideService:
             self.db.commit()
             self.db.refresh(ride)
             
+            if ride_data.from_location is not None or ride_data.to_location is not None:
+                moderation_pipeline.submit("ride", ride.id, driver_id, ride.from_location, ride.to_location)
+            
             logger.info(f"Поездка {ride_id} обновлена водителем {driver_id}")
             return ride
             
@@ -427,12 +439,15 @@ class RideService:
                 and_(Ride.date < cutoff_date, Ride.status.in_(["cancelled", "completed"]))
             ).scalar()
             
+            # Чаты поездок удалит каскад ON DELETE - запоминаем их для кэша участников
+            expired = and_(Ride.date < cutoff_date, Ride.status.in_(["cancelled", "completed"]))
+            chat_ids = [row.id for row in self.db.query(Chat.id).join(Ride, Chat.ride_id == Ride.id).filter(expired)]
+            
             # Удаляем устаревшие поездки
-            deleted = self.db.query(Ride).filter(
-                and_(Ride.date < cutoff_date, Ride.status.in_(["cancelled", "completed"]))
-            ).delete()
+            deleted = self.db.query(Ride).filter(expired).delete(synchronize_session=False)
             
             self.db.commit()
+            chat_service.membership_cache.invalidate_many(chat_ids)
             
             logger.info(f"Удалено {deleted} устаревших поездок")
             return deleted
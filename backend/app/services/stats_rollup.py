@@ -0,0 +1,198 @@
+"""
+Почасовые и посуточные агрегаты статистики
+Счетчики увеличиваются в тех же транзакциях, что и исходные записи (жалобы,
+действия модераторов, оценки, отзывы). Статистика за любой период читает
+не больше 24 почасовых и по одной суточной строке на день, а не исходные таблицы.
+Периодическое задание пересчитывает агрегаты из исходных таблиц и удаляет
+старые почасовые строки.
+
+Все времена - наивное UTC (rollup_now): событие записывается в агрегат с
+тем же временем, что и в created_at исходной строки, иначе на сервере не в
+UTC пересчет разложил бы события по другим часам, чем запись.
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import DateTime, bindparam, literal, text
+from sqlalchemy.orm import Session
+
+from ..config.settings import settings
+from ..models.moderation import ModerationAction, ModerationReport
+from ..models.rating import Rating, Review
+from ..models.stats import StatRollup
+
+logger = logging.getLogger(__name__)
+
+HOUR = "hour"
+DAY = "day"
+
+# Метрики
+REPORTS = "moderation.reports"
+REPORTS_RESOLVED = "moderation.reports_resolved"  # по времени создания жалобы
+ACTIONS = "moderation.actions"  # разрез - действие модератора
+RATINGS = "ratings"  # разрез - число звезд, total - сумма звезд
+REVIEWS = "reviews"
+
+# INSERT ... ON CONFLICT поддерживают и PostgreSQL, и SQLite. Тип bucket_start
+# задан явно: в SQLite время хранится строкой того же формата, что пишет ORM
+# (пересчет) и сравнивают фильтры, иначе upsert не находит строку пересчета
+UPSERT_SQL = text("""
+    INSERT INTO stat_rollups (granularity, bucket_start, metric, dimension, count, total)
+    VALUES (:granularity, :bucket_start, :metric, :dimension, :count, :total)
+    ON CONFLICT (granularity, metric, dimension, bucket_start) DO UPDATE
+    SET count = stat_rollups.count + excluded.count,
+        total = stat_rollups.total + excluded.total
+""").bindparams(bindparam("bucket_start", type_=DateTime()))
+
+def rollup_now() -> datetime:
+    """Часы агрегатов: наивное UTC"""
+    return datetime.utcnow()
+
+def bucket_start(at: datetime, granularity: str) -> datetime:
+    """Начало часа или суток; время с часовым поясом приводится к наивному UTC"""
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    if granularity == DAY:
+        return at.replace(hour=0, minute=0, second=0, microsecond=0)
+    return at.replace(minute=0, second=0, microsecond=0)
+
+# Исходные данные для пересчета: метрика -> запрос строк (время, разрез, значение)
+ROLLUP_SOURCES: Dict[str, Callable[[Session, datetime, datetime], Any]] = {
+    REPORTS: lambda db, start, end: db.query(
+        ModerationReport.created_at, literal(""), literal(0)
+    ).filter(ModerationReport.created_at >= start, ModerationReport.created_at < end),
+    REPORTS_RESOLVED: lambda db, start, end: db.query(
+        ModerationReport.created_at, literal(""), literal(0)
+    ).filter(
+        ModerationReport.status == "resolved",
+        ModerationReport.created_at >= start, ModerationReport.created_at < end
+    ),
+    ACTIONS: lambda db, start, end: db.query(
+        ModerationAction.created_at, ModerationAction.action, literal(0)
+    ).filter(ModerationAction.created_at >= start, ModerationAction.created_at < end),
+    RATINGS: lambda db, start, end: db.query(
+        Rating.created_at, Rating.rating, Rating.rating
+    ).filter(Rating.created_at >= start, Rating.created_at < end),
+    REVIEWS: lambda db, start, end: db.query(
+        Review.created_at, literal(""), literal(0)
+    ).filter(Review.created_at >= start, Review.created_at < end),
+}
+
+class StatsRollupService:
+    def record(self, db: Session, metric: str, at: datetime,
+               count: int = 1, total: float = 0.0, dimension: Any = ""):
+        """Добавляет событие в почасовой и суточный агрегат
+
+        at - created_at исходной строки (rollup_now() при ее создании). Не
+        коммитит: счетчик фиксируется вместе с транзакцией исходной записи.
+        """
+        for granularity in (HOUR, DAY):
+            db.execute(UPSERT_SQL, {
+                "granularity": granularity,
+                "bucket_start": bucket_start(at, granularity),
+                "metric": metric,
+                "dimension": str(dimension),
+                "count": count,
+                "total": total
+            })
+
+    def totals(self, db: Session, metrics: Iterable[str], start: Optional[datetime] = None,
+               now: Optional[datetime] = None) -> Dict[Tuple[str, str], Tuple[int, float]]:
+        """Суммы (count, total) по (метрика, разрез) с момента start (None - за все время)
+
+        Неполные первые сутки берутся из почасовых строк, остальное - из суточных.
+        Если почасовые строки уже удалены, начало округляется до суток.
+        """
+        metrics = list(metrics)
+        result: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        for granularity, range_start, range_end in self._ranges(start, now or rollup_now()):
+            query = db.query(
+                StatRollup.metric, StatRollup.dimension, StatRollup.count, StatRollup.total
+            ).filter(StatRollup.granularity == granularity, StatRollup.metric.in_(metrics))
+            if range_start is not None:
+                query = query.filter(StatRollup.bucket_start >= range_start)
+            if range_end is not None:
+                query = query.filter(StatRollup.bucket_start < range_end)
+            for metric, dimension, count, total in query:
+                key = (metric, dimension)
+                previous_count, previous_total = result.get(key, (0, 0.0))
+                result[key] = (previous_count + (count or 0), previous_total + (total or 0.0))
+        return result
+
+    @staticmethod
+    def _ranges(start: Optional[datetime], now: datetime) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+        if start is None:
+            return [(DAY, None, None)]
+        first_day = bucket_start(start, DAY)
+        start_hour = bucket_start(start, HOUR)
+        hourly_since = bucket_start(now - timedelta(days=settings.stats_hourly_retention_days), DAY)
+        if start_hour == first_day or first_day < hourly_since:
+            return [(DAY, first_day, None)]
+        next_day = first_day + timedelta(days=1)
+        return [(HOUR, start_hour, next_day), (DAY, next_day, None)]
+
+    def series(self, db: Session, metric: str, start: datetime,
+               granularity: str = DAY) -> List[Dict[str, Any]]:
+        """Ряд по часам или суткам (сумма по всем разрезам)"""
+        rows = db.query(StatRollup.bucket_start, StatRollup.count).filter(
+            StatRollup.granularity == granularity,
+            StatRollup.metric == metric,
+            StatRollup.bucket_start >= bucket_start(start, granularity)
+        ).order_by(StatRollup.bucket_start).all()
+
+        series: Dict[datetime, int] = {}
+        for bucket, count in rows:
+            series[bucket] = series.get(bucket, 0) + (count or 0)
+        return [{"bucket_start": bucket, "count": count} for bucket, count in series.items() if count]
+
+    def rebuild(self, db: Session, start: datetime, end: datetime,
+                metrics: Optional[Iterable[str]] = None) -> int:
+        """Пересчитывает агрегаты за [start, end) из исходных таблиц
+
+        Границы округляются до суток. Возвращает число записанных строк.
+        """
+        start, end = bucket_start(start, DAY), bucket_start(end, DAY)
+        metrics = list(metrics or ROLLUP_SOURCES)
+        written = 0
+        for metric in metrics:
+            buckets: Dict[Tuple[str, datetime, str], List[float]] = {}
+            for at, dimension, value in ROLLUP_SOURCES[metric](db, start, end).yield_per(1000):
+                if at is None:
+                    continue
+                for granularity in (HOUR, DAY):
+                    key = (granularity, bucket_start(at, granularity), str(dimension or ""))
+                    bucket = buckets.setdefault(key, [0, 0.0])
+                    bucket[0] += 1
+                    bucket[1] += float(value or 0)
+
+            db.query(StatRollup).filter(
+                StatRollup.metric == metric,
+                StatRollup.bucket_start >= start,
+                StatRollup.bucket_start < end
+            ).delete(synchronize_session=False)
+            db.add_all([
+                StatRollup(granularity=granularity, bucket_start=bucket, metric=metric,
+                           dimension=dimension, count=count, total=total)
+                for (granularity, bucket, dimension), (count, total) in buckets.items()
+            ])
+            db.commit()
+            written += len(buckets)
+            logger.info(f"Пересчитана метрика {metric}: {len(buckets)} строк")
+        return written
+
+    def compact(self, db: Session, retention_days: Optional[int] = None,
+                now: Optional[datetime] = None) -> int:
+        """Удаляет почасовые строки старше срока хранения (суточные остаются)"""
+        retention_days = retention_days or settings.stats_hourly_retention_days
+        cutoff = bucket_start((now or rollup_now()) - timedelta(days=retention_days), DAY)
+        deleted = db.query(StatRollup).filter(
+            StatRollup.granularity == HOUR,
+            StatRollup.bucket_start < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+
+# Глобальный сервис агрегатов статистики
+stats_rollup = StatsRollupService()
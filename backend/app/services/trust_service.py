@@ -0,0 +1,270 @@
+"""
+Доверие к пользователям
+Скор хранится в таблице trust_scores и обновляется по событиям: жалоба
+рассмотрена, выдано предупреждение, аккаунт перешел порог возраста
+(ежедневный проход). Чтение - из кэша процесса или одной строки по user_id,
+без подсчета жалоб в moderation_reports.
+"""
+
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..config.settings import settings
+from ..models.moderation import ModerationAction, ModerationReport, TrustScore
+from ..models.user import User
+
+BASE_SCORE = 100
+WARNING_PENALTY = 20
+REPORT_PENALTY = 15
+# Бонус за возраст аккаунта: (дней с регистрации, бонус), от большего порога к меньшему
+AGE_BONUSES = ((90, 30), (30, 10))
+
+def account_age_bonus(created_at: Optional[datetime], now: Optional[datetime] = None) -> int:
+    if not created_at:
+        return 0
+    days_registered = ((now or datetime.now()) - created_at).days
+    for days, bonus in AGE_BONUSES:
+        if days_registered > days:
+            return bonus
+    return 0
+
+def trust_level(score: int) -> str:
+    if score >= 80:
+        return "high"
+    elif score >= 50:
+        return "medium"
+    elif score >= 20:
+        return "low"
+    return "suspicious"
+
+def calculate_score(warnings: int, reports: int, age_bonus: int) -> int:
+    return max(0, BASE_SCORE - warnings * WARNING_PENALTY - reports * REPORT_PENALTY + age_bonus)
+
+class TrustScoreCache:
+    """LRU-кэш скоров: user_id -> ответ check_user_trust_score
+
+    Свой процесс сбрасывает запись при изменении скора, изменения из
+    других процессов видны не позже чем через ttl секунд.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._scores: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0
+        }
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._scores.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self.stats['misses'] += 1
+            return None
+        self._scores.move_to_end(user_id)
+        self.stats['hits'] += 1
+        return entry[1]
+
+    def put(self, user_id: int, score: Dict[str, Any]):
+        self._scores[user_id] = (time.monotonic() + self.ttl, score)
+        self._scores.move_to_end(user_id)
+        if len(self._scores) > self.max_size:
+            self._scores.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def invalidate(self, user_id: int):
+        self._scores.pop(user_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'size': len(self._scores),
+            'max_size': self.max_size
+        }
+
+class TrustScoreService:
+    def __init__(self):
+        self.cache = TrustScoreCache(settings.trust_score_cache_size, settings.trust_score_cache_ttl)
+
+    @staticmethod
+    def _to_response(row: TrustScore) -> Dict[str, Any]:
+        return {
+            "trust_score": row.score,
+            "level": row.level,
+            "warnings": row.warnings_count,
+            "reports": row.reports_count
+        }
+
+    @staticmethod
+    def _recalculate(row: TrustScore):
+        row.score = calculate_score(row.warnings_count or 0, row.reports_count or 0, row.age_bonus or 0)
+        row.level = trust_level(row.score)
+
+    def _build(self, db: Session, user: User) -> TrustScore:
+        """Начальная строка по истории модерации (один раз на пользователя)"""
+        row = TrustScore(**self._initial_values(db, user))
+        db.add(row)
+        return row
+
+    def _initial_values(self, db: Session, user: User) -> Dict[str, Any]:
+        """Значения начальной строки скора по истории модерации"""
+        reports = db.query(ModerationReport).filter(
+            ModerationReport.target_type == "user",
+            ModerationReport.target_id == user.id,
+            ModerationReport.status == "resolved"
+        ).count()
+        warnings = db.query(ModerationAction).join(ModerationReport).filter(
+            ModerationReport.target_type == "user",
+            ModerationReport.target_id == user.id,
+            ModerationAction.action == "warn"
+        ).count()
+
+        age_bonus = account_age_bonus(user.created_at)
+        score = calculate_score(warnings, reports, age_bonus)
+        return {
+            "user_id": user.id,
+            "warnings_count": warnings,
+            "reports_count": reports,
+            "age_bonus": age_bonus,
+            "score": score,
+            "level": trust_level(score)
+        }
+
+    def _insert_missing(self, db: Session, user: User) -> bool:
+        """Вставляет начальную строку, если ее нет; True - строку вставила эта транзакция
+
+        INSERT ... ON CONFLICT DO NOTHING: параллельное первое событие того же
+        пользователя не падает на уникальном user_id и не откатывает
+        транзакцию вызывающего, а ждет строку другой транзакции.
+        """
+        if db.get_bind().dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        table = TrustScore.__table__
+        result = db.execute(
+            insert(table)
+            .values(**self._initial_values(db, user))
+            .on_conflict_do_nothing(index_elements=[table.c.user_id])
+        )
+        return result.rowcount == 1
+
+    def get_trust_score(self, db: Session, user_id: int) -> Dict[str, Any]:
+        """Скор пользователя: кэш, затем строка trust_scores по user_id"""
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            return cached
+
+        row = db.query(TrustScore).filter(TrustScore.user_id == user_id).first()
+        if row is not None:
+            score = self._to_response(row)
+        else:
+            score = self._create_missing(db, user_id)
+            if score is None:
+                return {"trust_score": 0, "level": "unknown"}
+
+        self.cache.put(user_id, score)
+        return score
+
+    def _create_missing(self, db: Session, user_id: int) -> Optional[Dict[str, Any]]:
+        """Создает строку скора в отдельной сессии
+
+        Чтение не должно коммитить или откатывать несвязанные изменения в
+        сессии вызывающего, поэтому строка пишется через свое соединение.
+        """
+        session = Session(bind=db.get_bind())
+        try:
+            user = session.query(User).filter(User.id == user_id).first()
+            if not user:
+                return None
+            row = self._build(session, user)
+            try:
+                session.commit()
+            except IntegrityError:
+                # Строку параллельно создал другой запрос
+                session.rollback()
+                row = session.query(TrustScore).filter(TrustScore.user_id == user_id).first()
+            return self._to_response(row)
+        finally:
+            session.close()
+
+    def record_event(self, db: Session, user_id: int, warnings: int = 0, reports: int = 0):
+        """Учитывает предупреждения и рассмотренные жалобы в скоре
+
+        Не коммитит: изменение фиксируется вместе с транзакцией вызывающего,
+        кэш нужно сбросить через invalidate после коммита.
+        """
+        if not warnings and not reports:
+            return
+        row = db.query(TrustScore).filter(TrustScore.user_id == user_id).with_for_update().first()
+        if row is None:
+            user = db.query(User).filter(User.id == user_id).first()
+            if not user:
+                return
+            db.flush()
+            if self._insert_missing(db, user):
+                # Начальная строка построена по истории, уже включающей это событие
+                return
+            # Строку создала другая транзакция по истории без этого события
+            row = db.query(TrustScore).filter(
+                TrustScore.user_id == user_id
+            ).with_for_update().populate_existing().one()
+
+        row.warnings_count = (row.warnings_count or 0) + warnings
+        row.reports_count = (row.reports_count or 0) + reports
+        self._recalculate(row)
+
+    def invalidate(self, user_id: int):
+        self.cache.invalidate(user_id)
+
+    def sweep_account_age(self, db: Session, batch_size: int = 1000,
+                          now: Optional[datetime] = None) -> int:
+        """Начисляет бонус за возраст аккаунтам, перешедшим порог (раз в сутки)"""
+        now = now or datetime.now()
+        updated = 0
+        for days, bonus in AGE_BONUSES:
+            # account_age_bonus: полных дней с регистрации больше порога
+            threshold = now - timedelta(days=days + 1)
+            while True:
+                rows = db.query(TrustScore).join(User, User.id == TrustScore.user_id).filter(
+                    User.created_at <= threshold,
+                    TrustScore.age_bonus < bonus
+                ).limit(batch_size).all()
+                if not rows:
+                    break
+                for row in rows:
+                    row.age_bonus = bonus
+                    self._recalculate(row)
+                    self.invalidate(row.user_id)
+                db.commit()
+                updated += len(rows)
+        return updated
+
+    def backfill(self, db: Session, batch_size: int = 1000) -> int:
+        """Создает строки trust_scores для пользователей без них"""
+        created = 0
+        while True:
+            users = db.query(User).outerjoin(TrustScore, TrustScore.user_id == User.id).filter(
+                TrustScore.id.is_(None)
+            ).order_by(User.id).limit(batch_size).all()
+            if not users:
+                break
+            for user in users:
+                self._build(db, user)
+            db.commit()
+            created += len(users)
+        return created
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'cache': self.cache.get_stats()
+        }
+
+# Глобальный сервис доверия
+trust_service = TrustScoreService()
@@ -0,0 +1,258 @@
+"""
+Движок проверки текста для модерации
+Один автомат Ахо-Корасик по словам для всех списков стоп-слов и правил,
+нормализация (регистр, ё/е, латинские двойники, leetspeak) выполняется
+один раз, капс считается в том же проходе, повторы символов - по исходному тексту
+"""
+
+import multiprocessing
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Латинские буквы, похожие на кириллические, и leetspeak-замены.
+# Нормализуются и текст, и шаблоны, поэтому совпадение не зависит от написания.
+LOOKALIKES = {
+    "a": "а", "b": "в", "c": "с", "e": "е", "h": "н", "k": "к", "m": "м",
+    "o": "о", "p": "р", "t": "т", "x": "х", "y": "у", "u": "и", "r": "г",
+    "0": "о", "3": "з", "4": "ч", "6": "б", "@": "а", "ё": "е"
+}
+NORMALIZE_TABLE = str.maketrans(LOOKALIKES)
+
+# Слово или последовательность знаков; "@" заменяется до разбиения
+TOKEN_RE = re.compile(r"\w+|[^\w\s]+")
+# Повторы ищутся в исходном тексте: между токенами бывают серии пробелов
+REPEAT_RE = re.compile(r"(.)\1{4,}")
+# Шаблон-список слов: \b(слово|слово)\b или слово|слово без метасимволов
+WORD_LIST_RE = re.compile(r"^(?:\\b)?\(?([^\\\[\](){}.*+?^$]+)\)?(?:\\b)?$")
+
+def normalize(text: str) -> str:
+    """Каноническая форма текста для сопоставления"""
+    return text.lower().translate(NORMALIZE_TABLE)
+
+def tokenize(text: str) -> Tuple[str, ...]:
+    return tuple(TOKEN_RE.findall(normalize(text)))
+
+# Обычные сообщения: шаблон, совпадающий со всеми, помечал бы любой текст
+NEUTRAL_TEXTS = (
+    "Привет! Во сколько выезжаем завтра?",
+    "ok",
+    "12:30",
+    "Спасибо, до встречи у вокзала"
+)
+# Длина строк пробного прогона регулярного выражения
+TRIAL_TEXT_LENGTH = 2000
+
+class UnsafePatternError(ValueError):
+    """Шаблон правила нельзя применять: некорректный, слишком общий или медленный"""
+
+def literal_alternatives(pattern: str) -> Optional[List[str]]:
+    """Слова из шаблона-перечисления или None, если это настоящее регулярное выражение"""
+    match = WORD_LIST_RE.match(pattern.strip())
+    if not match:
+        return None
+    words = [word.strip() for word in match.group(1).split("|")]
+    return [word for word in words if word] or None
+
+def trial_texts(pattern: str) -> List[str]:
+    """Строки для пробного прогона: длинные повторы символов с неподходящим хвостом
+
+    Вложенные и пересекающиеся квантификаторы ((a+)+, (\\w|\\d)*) уходят в
+    экспоненциальный перебор именно на таких строках.
+    """
+    chars = {"a", "а", "1", " ", ".", "-", "_"}
+    chars.update(char for char in pattern if char.isalnum())
+    texts = []
+    for char in sorted(chars)[:32]:
+        run = char * TRIAL_TEXT_LENGTH
+        texts.extend((run + "!", run + "\n"))
+    texts.append(("ab1 " * TRIAL_TEXT_LENGTH)[:TRIAL_TEXT_LENGTH] + "!")
+    return texts
+
+def _trial_match(pattern: str, texts: List[str]):
+    regex = re.compile(pattern, re.IGNORECASE)
+    for text in texts:
+        regex.search(text)
+        regex.findall(text)
+
+def check_rule_pattern(pattern: str, max_length: int, timeout: float):
+    """Проверка шаблона правила перед сохранением; UnsafePatternError, если применять нельзя
+
+    Регулярное выражение прогоняется на неудобных строках в отдельном
+    процессе: зависший перебор нельзя прервать в потоке, а процесс - можно.
+    """
+    if not pattern or not pattern.strip():
+        raise UnsafePatternError("Пустой шаблон")
+    if len(pattern) > max_length:
+        raise UnsafePatternError(f"Шаблон длиннее {max_length} символов")
+
+    words = literal_alternatives(pattern)
+    if words is not None:
+        if not any(tokenize(word) for word in words):
+            raise UnsafePatternError("Шаблон не содержит слов")
+        return
+
+    try:
+        regex = re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        raise UnsafePatternError(f"Некорректное регулярное выражение: {e}")
+    if regex.search("") is not None:
+        raise UnsafePatternError("Шаблон совпадает с пустой строкой")
+    if all(regex.search(text) for text in NEUTRAL_TEXTS):
+        raise UnsafePatternError("Шаблон совпадает с любым текстом")
+
+    # spawn: fork из процесса с потоками может унаследовать захваченные блокировки
+    process = multiprocessing.get_context("spawn").Process(
+        target=_trial_match, args=(pattern, trial_texts(pattern)), daemon=True
+    )
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        raise UnsafePatternError(f"Проверка шаблона не уложилась в {timeout} с (риск ReDoS)")
+    if process.exitcode != 0:
+        raise UnsafePatternError("Пробный прогон шаблона завершился ошибкой")
+
+class PatternAutomaton:
+    """Автомат Ахо-Корасик над словами (а не символами)
+
+    Шаблоны - последовательности нормализованных слов, поэтому совпадение
+    всегда по целому слову, как \\b...\\b в прежних регулярных выражениях.
+    """
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[List[Tuple[str, int]]] = [[]]
+        self.patterns = 0
+
+    def add(self, phrase: Tuple[str, ...], label: str):
+        state = 0
+        for token in phrase:
+            next_state = self.goto[state].get(token)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][token] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+            state = next_state
+        self.outputs[state].append((label, len(phrase)))
+        self.patterns += 1
+
+    def build(self):
+        """Строит ссылки неудач (обход в ширину)"""
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for token, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(token, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+class ScanResult:
+    """Результат одного прохода по тексту"""
+
+    __slots__ = ("matches", "regex_matches", "caps", "length", "repeated")
+
+    def __init__(self, length: int):
+        self.matches: Dict[str, List[str]] = {}
+        self.regex_matches: Dict[str, List[str]] = {}
+        self.caps = 0
+        self.length = length
+        self.repeated: List[str] = []
+
+    @property
+    def caps_ratio(self) -> float:
+        return self.caps / self.length if self.length else 0
+
+    def labeled(self, label: str) -> List[str]:
+        """Совпадения метки: из автомата и из шаблонов, проверенных регуляркой"""
+        return self.matches.get(label, []) + self.regex_matches.get(label, [])
+
+class ModerationMatcher:
+    """Сканер текста: стоп-слова и правила модерации за один проход"""
+
+    def __init__(self):
+        self.automaton = PatternAutomaton()
+        # Правила, которые нельзя свести к списку слов, проверяются регуляркой
+        self.regex_rules: List[Tuple[str, "re.Pattern"]] = []
+
+    @classmethod
+    def build(cls, word_lists: Dict[str, Iterable[str]],
+              rules: Iterable[Tuple[int, str]] = ()) -> "ModerationMatcher":
+        """Собирает автомат из списков шаблонов по категориям и правил (id, pattern)
+
+        Метка совпадения - категория ("spam", "toxic", ...) или "rule:<id>".
+        """
+        matcher = cls()
+        for label, patterns in word_lists.items():
+            for pattern in patterns:
+                matcher.add_pattern(label, pattern)
+        for rule_id, pattern in rules:
+            matcher.add_pattern(f"rule:{rule_id}", pattern)
+        matcher.automaton.build()
+        return matcher
+
+    def add_pattern(self, label: str, pattern: str):
+        words = literal_alternatives(pattern)
+        if words is None:
+            try:
+                self.regex_rules.append((label, re.compile(pattern, re.IGNORECASE)))
+            except re.error:
+                pass
+            return
+        for word in words:
+            phrase = tokenize(word)
+            if phrase:
+                self.automaton.add(phrase, label)
+
+    def scan(self, text: str) -> ScanResult:
+        """Один проход: совпадения шаблонов, число заглавных букв, повторы"""
+        result = ScanResult(len(text))
+        normalized = normalize(text)
+        lowered = text.lower()
+        # lower() почти всегда сохраняет длину; иначе позиции токенов не совпадут
+        aligned = len(lowered) == len(text)
+
+        automaton = self.automaton
+        goto, fail, outputs = automaton.goto, automaton.fail, automaton.outputs
+        matches = result.matches
+        source = text if aligned else normalized
+        starts: List[int] = []
+        state = 0
+
+        caps = 0
+        for match in TOKEN_RE.finditer(normalized):
+            token = match.group()
+            start, end = match.span()
+            starts.append(start)
+
+            if aligned and text[start:end] != lowered[start:end]:
+                caps += sum(1 for char in text[start:end] if char.isupper())
+
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            if outputs[state]:
+                for label, length in outputs[state]:
+                    matches.setdefault(label, []).append(source[starts[-length]:end])
+
+        result.caps = caps if aligned else sum(1 for char in text if char.isupper())
+        result.repeated = REPEAT_RE.findall(text)
+
+        for label, regex in self.regex_rules:
+            found = regex.findall(text)
+            if found:
+                result.regex_matches.setdefault(label, []).extend(found)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'patterns': self.automaton.patterns,
+            'states': len(self.automaton.goto),
+            'regex_rules': len(self.regex_rules)
+        }
@@ -0,0 +1,324 @@
+"""
+Хранилище метрик и ошибок фронтенда
+Кольцевые буферы последних записей и поминутные агрегаты (суммы, счетчики,
+гистограмма времени ответа, уникальные сессии), которые обновляются при
+приеме данных. Статистика и алерты читают только агрегаты за нужные минуты.
+Режим Redis делает данные общими для всех воркеров.
+"""
+
+import json
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+import redis
+
+from ..config.settings import settings
+from .logger import get_logger
+
+logger = get_logger("monitoring_store")
+
+# Верхние границы корзин гистограммы времени ответа, мс
+RESPONSE_TIME_BOUNDS = (100, 250, 500, 1000, 2000, 5000, 10000)
+
+# Пороги алертов
+HIGH_ERROR_RATE = 10
+SLOW_RESPONSE_MS = 5000
+LOW_CACHE_HIT_RATE = 50
+
+def _minute(timestamp: float) -> int:
+    return int(timestamp // 60)
+
+def _response_time_field(value: float) -> str:
+    for bound in RESPONSE_TIME_BOUNDS:
+        if value <= bound:
+            return f"rt_le_{bound}"
+    return "rt_le_inf"
+
+def _number(value: Any) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+class InMemoryMonitoringBackend:
+    """Буферы и агрегаты в памяти процесса (один воркер)"""
+
+    def __init__(self, metrics_size: int, errors_size: int, alerts_size: int, retention_minutes: int):
+        self.retention_minutes = retention_minutes
+        self.rings: Dict[str, Deque[Dict[str, Any]]] = {
+            "metrics": deque(maxlen=metrics_size),
+            "errors": deque(maxlen=errors_size),
+            "alerts": deque(maxlen=alerts_size)
+        }
+        self.buckets: Dict[int, Dict[str, float]] = {}
+        self.sessions: Dict[int, Set[str]] = {}
+
+    def add(self, minute: int, counters: Dict[str, float], session_id: Optional[str] = None):
+        bucket = self.buckets.get(minute)
+        if bucket is None:
+            bucket = self.buckets[minute] = {}
+            self._prune(minute)
+        for field, value in counters.items():
+            bucket[field] = bucket.get(field, 0.0) + value
+        if session_id:
+            self.sessions.setdefault(minute, set()).add(session_id)
+
+    def _prune(self, minute: int):
+        oldest = minute - self.retention_minutes
+        for stale in [key for key in self.buckets if key < oldest]:
+            del self.buckets[stale]
+            self.sessions.pop(stale, None)
+
+    def read(self, minutes: List[int]) -> Tuple[Dict[str, float], int]:
+        counters: Dict[str, float] = {}
+        sessions: Set[str] = set()
+        for minute in minutes:
+            for field, value in self.buckets.get(minute, {}).items():
+                counters[field] = counters.get(field, 0.0) + value
+            sessions.update(self.sessions.get(minute, ()))
+        return counters, len(sessions)
+
+    def push(self, ring: str, entries: List[Dict[str, Any]]):
+        self.rings[ring].extend(entries)
+
+    def recent(self, ring: str, limit: int) -> List[Dict[str, Any]]:
+        """Последние записи буфера, новые первыми"""
+        entries = self.rings[ring]
+        return [entries[-i] for i in range(1, min(limit, len(entries)) + 1)]
+
+    def clear(self):
+        for ring in self.rings.values():
+            ring.clear()
+        self.buckets.clear()
+        self.sessions.clear()
+
+class RedisMonitoringBackend:
+    """Буферы (LPUSH + LTRIM) и поминутные хэши в Redis, сессии - HyperLogLog"""
+
+    key_prefix = "monitoring:"
+
+    def __init__(self, client: "redis.Redis", metrics_size: int, errors_size: int,
+                 alerts_size: int, retention_minutes: int):
+        self.client = client
+        self.sizes = {"metrics": metrics_size, "errors": errors_size, "alerts": alerts_size}
+        self.ttl = retention_minutes * 60 + 120
+
+    def _bucket_key(self, minute: int) -> str:
+        return f"{self.key_prefix}bucket:{minute}"
+
+    def _sessions_key(self, minute: int) -> str:
+        return f"{self.key_prefix}sessions:{minute}"
+
+    def _ring_key(self, ring: str) -> str:
+        return f"{self.key_prefix}{ring}"
+
+    def add(self, minute: int, counters: Dict[str, float], session_id: Optional[str] = None):
+        pipe = self.client.pipeline(transaction=False)
+        key = self._bucket_key(minute)
+        for field, value in counters.items():
+            pipe.hincrbyfloat(key, field, value)
+        pipe.expire(key, self.ttl)
+        if session_id:
+            pipe.pfadd(self._sessions_key(minute), session_id)
+            pipe.expire(self._sessions_key(minute), self.ttl)
+        pipe.execute()
+
+    def read(self, minutes: List[int]) -> Tuple[Dict[str, float], int]:
+        pipe = self.client.pipeline(transaction=False)
+        for minute in minutes:
+            pipe.hgetall(self._bucket_key(minute))
+        pipe.pfcount(*[self._sessions_key(minute) for minute in minutes])
+        *buckets, sessions = pipe.execute()
+
+        counters: Dict[str, float] = {}
+        for bucket in buckets:
+            for field, value in bucket.items():
+                field = field.decode() if isinstance(field, bytes) else field
+                counters[field] = counters.get(field, 0.0) + float(value)
+        return counters, int(sessions or 0)
+
+    def push(self, ring: str, entries: List[Dict[str, Any]]):
+        if not entries:
+            return
+        key = self._ring_key(ring)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.lpush(key, *[json.dumps(entry, ensure_ascii=False, default=str) for entry in entries])
+        pipe.ltrim(key, 0, self.sizes[ring] - 1)
+        pipe.execute()
+
+    def recent(self, ring: str, limit: int) -> List[Dict[str, Any]]:
+        return [json.loads(entry) for entry in self.client.lrange(self._ring_key(ring), 0, limit - 1)]
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{self.key_prefix}*", count=1000))
+        if keys:
+            self.client.delete(*keys)
+
+class MonitoringStore:
+    """Прием метрик и ошибок фронтенда и статистика по поминутным агрегатам"""
+
+    def __init__(self):
+        metrics_size = settings.monitoring_metrics_buffer_size
+        errors_size = settings.monitoring_errors_buffer_size
+        alerts_size = settings.monitoring_alerts_buffer_size
+        retention = settings.monitoring_retention_minutes
+        self.backend = InMemoryMonitoringBackend(metrics_size, errors_size, alerts_size, retention)
+        self.use_redis = False
+        self.stats = {
+            'metrics': 0,
+            'errors': 0,
+            'alerts': 0,
+            'backend_errors': 0
+        }
+
+        if settings.redis_url and settings.monitoring_use_redis:
+            try:
+                client = redis.from_url(settings.redis_url)
+                client.ping()
+                self.backend = RedisMonitoringBackend(client, metrics_size, errors_size, alerts_size, retention)
+                self.use_redis = True
+                logger.info("Хранилище мониторинга подключено к Redis")
+            except Exception as e:
+                logger.warning(f"Хранилище мониторинга работает в памяти, Redis недоступен: {e}")
+
+    @staticmethod
+    def _alerts_for(metrics: Dict[str, Any], received_at: str) -> List[Dict[str, Any]]:
+        alerts = []
+        session_id = metrics.get("sessionId")
+        if _number(metrics.get("errorRate")) > HIGH_ERROR_RATE:
+            alerts.append({
+                "type": "high_error_rate",
+                "severity": "warning",
+                "message": f"Высокий процент ошибок: {metrics.get('errorRate')}%",
+                "session_id": session_id,
+                "timestamp": received_at
+            })
+        if _number(metrics.get("avgResponseTime")) > SLOW_RESPONSE_MS:
+            alerts.append({
+                "type": "slow_response",
+                "severity": "warning",
+                "message": f"Медленный ответ API: {metrics.get('avgResponseTime')}ms",
+                "session_id": session_id,
+                "timestamp": received_at
+            })
+        if _number(metrics.get("cacheHitRate", 100)) < LOW_CACHE_HIT_RATE:
+            alerts.append({
+                "type": "low_cache_hit_rate",
+                "severity": "info",
+                "message": f"Низкий hit rate кэша: {metrics.get('cacheHitRate')}%",
+                "session_id": session_id,
+                "timestamp": received_at
+            })
+        return alerts
+
+    def record_metrics(self, metrics: Dict[str, Any], now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Сохраняет метрики сессии и обновляет агрегат минуты; возвращает алерты"""
+        now = time.time() if now is None else now
+        received_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now))
+        metrics["received_at"] = received_at
+        response_time = _number(metrics.get("avgResponseTime"))
+        counters = {
+            "metrics": 1,
+            "api_calls": _number(metrics.get("apiCalls")),
+            "errors": _number(metrics.get("errors")),
+            "response_time_sum": response_time,
+            "cache_hit_rate_sum": _number(metrics.get("cacheHitRate")),
+            _response_time_field(response_time): 1
+        }
+        alerts = self._alerts_for(metrics, received_at)
+        for alert in alerts:
+            alert["ts"] = now
+
+        try:
+            session_id = metrics.get("sessionId")
+            self.backend.add(_minute(now), counters, str(session_id) if session_id else None)
+            self.backend.push("metrics", [metrics])
+            self.backend.push("alerts", alerts)
+        except Exception as e:
+            self.stats['backend_errors'] += 1
+            logger.error(f"Ошибка записи метрик мониторинга: {e}")
+        self.stats['metrics'] += 1
+        self.stats['alerts'] += len(alerts)
+        return alerts
+
+    def record_error(self, error: Dict[str, Any], now: Optional[float] = None):
+        """Сохраняет ошибку фронтенда и считает ее тип в агрегате минуты"""
+        now = time.time() if now is None else now
+        error["received_at"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now))
+        try:
+            self.backend.add(_minute(now), {
+                "frontend_errors": 1,
+                f"error_type:{error.get('type', 'unknown')}": 1
+            })
+            self.backend.push("errors", [error])
+        except Exception as e:
+            self.stats['backend_errors'] += 1
+            logger.error(f"Ошибка записи ошибки фронтенда: {e}")
+        self.stats['errors'] += 1
+
+    def _read(self, minutes: int, now: Optional[float]) -> Tuple[Dict[str, float], int]:
+        current = _minute(time.time() if now is None else now)
+        return self.backend.read(list(range(current - minutes + 1, current + 1)))
+
+    @staticmethod
+    def _percentile(counters: Dict[str, float], total: float, fraction: float) -> Optional[float]:
+        """Оценка перцентиля по гистограмме: верхняя граница корзины
+
+        None - нет данных или значение выше последней границы.
+        """
+        if total <= 0:
+            return None
+        seen = 0.0
+        for bound in RESPONSE_TIME_BOUNDS:
+            seen += counters.get(f"rt_le_{bound}", 0.0)
+            if seen >= total * fraction:
+                return float(bound)
+        return None
+
+    def get_stats(self, minutes: int = 60, now: Optional[float] = None) -> Dict[str, Any]:
+        """Статистика за последние minutes минут: O(minutes) чтений агрегатов"""
+        counters, total_sessions = self._read(minutes, now)
+        count = counters.get("metrics", 0.0)
+        total_api_calls = counters.get("api_calls", 0.0)
+        total_errors = counters.get("errors", 0.0)
+
+        return {
+            "total_sessions": total_sessions,
+            "total_api_calls": int(total_api_calls),
+            "total_errors": int(total_errors),
+            "avg_response_time": round(counters.get("response_time_sum", 0.0) / count, 2) if count else 0,
+            "avg_cache_hit_rate": round(counters.get("cache_hit_rate_sum", 0.0) / count, 2) if count else 0,
+            "error_rate": round((total_errors / total_api_calls * 100) if total_api_calls > 0 else 0, 2),
+            "error_types": {
+                field[len("error_type:"):]: int(value)
+                for field, value in counters.items() if field.startswith("error_type:")
+            },
+            "response_time_p50": self._percentile(counters, count, 0.5),
+            "response_time_p95": self._percentile(counters, count, 0.95)
+        }
+
+    def get_alerts(self, minutes: int = 60, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Алерты за последние minutes минут из кольцевого буфера алертов"""
+        oldest = (time.time() if now is None else now) - minutes * 60
+        alerts = []
+        for alert in self.backend.recent("alerts", settings.monitoring_alerts_buffer_size):
+            if alert.get("ts", 0) <= oldest:
+                break
+            alerts.append({key: value for key, value in alert.items() if key != "ts"})
+        return alerts
+
+    def recent(self, ring: str, limit: int = 100) -> List[Dict[str, Any]]:
+        return self.backend.recent(ring, limit)
+
+    def clear(self):
+        self.backend.clear()
+
+    def get_info(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'backend': 'redis' if self.use_redis else 'memory'
+        }
+
+# Глобальное хранилище мониторинга
+monitoring_store = MonitoringStore()
@@ -0,0 +1,443 @@
+"""
+Поиск почти одинаковых текстов (массовая рассылка спама)
+MinHash-подпись (one permutation hashing) по символьным шинглам нормализованного
+текста и LSH-индекс по полосам подписи: кандидаты проверяются оценкой
+сходства Жаккара по всей подписи. Индекс в Redis общий для всех воркеров;
+без Redis каждый воркер держит свой индекс в памяти и свой снимок на диске.
+"""
+
+import contextlib
+import glob
+import hashlib
+import os
+import struct
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировок, снимок по pid воркера
+    fcntl = None
+
+from .logger import get_logger
+from .moderation_matcher import TOKEN_RE, normalize
+
+logger = get_logger("near_duplicate")
+
+SIGNATURE_SIZE = 64
+SHINGLE_SIZE = 4
+# В LSH участвуют первые BANDS * ROWS позиций подписи:
+# при сходстве 0.8 текст становится кандидатом с вероятностью ~98%
+BANDS = 8
+ROWS = 4
+SNAPSHOT_MAGIC = b"NDUP2"
+
+def minhash(text: str, min_length: int = 40) -> Optional[array]:
+    """MinHash-подпись из SIGNATURE_SIZE 16-битных значений
+
+    Один хэш на шингл: младшие биты выбирают ячейку, старшие - значение
+    (one permutation hashing). Короткие тексты не индексируются: у них
+    слишком много случайных совпадений.
+    """
+    normalized = " ".join(token for token in TOKEN_RE.findall(normalize(text)) if token[0].isalnum())
+    if len(normalized) < min_length:
+        return None
+
+    empty = 1 << 16
+    bins = [empty] * SIGNATURE_SIZE
+    for shingle in {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+        slot = value % SIGNATURE_SIZE
+        value = (value >> 6) & 0xFFFF
+        if value < bins[slot]:
+            bins[slot] = value
+
+    # Уплотнение: пустая ячейка берет значение ближайшей заполненной справа
+    for slot in range(SIGNATURE_SIZE):
+        offset = 1
+        while bins[slot] == empty and offset < SIGNATURE_SIZE:
+            bins[slot] = bins[(slot + offset) % SIGNATURE_SIZE]
+            offset += 1
+    return array("H", bins)
+
+def similarity(a, b) -> float:
+    """Оценка сходства Жаккара по доле совпавших позиций подписи"""
+    return sum(1 for x, y in zip(a, b) if x == y) / SIGNATURE_SIZE
+
+def _band_keys(signature) -> list:
+    keys = []
+    for band in range(BANDS):
+        start = band * ROWS
+        key = band
+        for value in signature[start:start + ROWS]:
+            key = (key << 16) | value
+        keys.append(key)
+    return keys
+
+def _read_snapshot(path: str) -> Tuple[array, array, array]:
+    signatures, senders, timestamps = array("H"), array("q"), array("d")
+    with open(path, "rb") as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError("Неизвестный формат снимка")
+        count = struct.unpack("<Q", f.read(8))[0]
+        signatures.fromfile(f, count * SIGNATURE_SIZE)
+        senders.fromfile(f, count)
+        timestamps.fromfile(f, count)
+    return signatures, senders, timestamps
+
+def _read_snapshots(paths: List[str]) -> List[Tuple[array, array, array]]:
+    parts = []
+    for path in paths:
+        try:
+            parts.append(_read_snapshot(path))
+        except Exception as e:
+            logger.warning(f"Пропущен снимок индекса дубликатов {path}: {e}")
+    return parts
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """Исключительная блокировка файла между процессами (без fcntl - без блокировки)"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class SnapshotSlot:
+    """Номер снимка воркера: {base_path}.<n>, занятый блокировкой {base_path}.<n>.lock
+
+    Перезапущенный воркер занимает освободившийся номер и перезаписывает
+    прежний снимок, поэтому файлов не больше, чем воркеров одновременно.
+    """
+
+    def __init__(self, base_path: str, max_slots: int = 64):
+        self.base_path = base_path
+        self.max_slots = max_slots
+        self.path: Optional[str] = None
+        self._lock_file = None
+
+    def acquire(self) -> str:
+        if self.path is not None:
+            return self.path
+        directory = os.path.dirname(self.base_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if fcntl is not None:
+            for slot in range(self.max_slots):
+                lock_file = open(f"{self.base_path}.{slot}.lock", "a")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    continue
+                self._lock_file = lock_file
+                self.path = f"{self.base_path}.{slot}"
+                return self.path
+            logger.warning(f"Все {self.max_slots} слотов снимка индекса дубликатов заняты, снимок по pid")
+        self.path = f"{self.base_path}.{os.getpid()}"
+        return self.path
+
+    def release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.path = None
+
+class NearDuplicateIndex:
+    """LSH-индекс MinHash-подписей в памяти процесса со скользящим окном по времени
+
+    Подписи, отправители и время хранятся в плоских массивах (144 байта на
+    запись), корзины - один словарь "ключ полосы -> номер записи или список".
+    Всего ~890 байт на запись (замер tracemalloc на 200 тыс. записей), почти
+    все - 8 ключей корзин в словаре. Просматриваются только последние
+    max_bucket_scan записей корзины, поэтому поиск укладывается в доли
+    миллисекунды и для очень популярного текста.
+    """
+
+    def __init__(self, threshold: float = 0.8, window_seconds: float = 3600,
+                 max_entries: int = 100_000, max_bucket_scan: int = 32):
+        self.threshold = threshold
+        self.window = window_seconds
+        self.max_entries = max_entries
+        self.max_bucket_scan = max_bucket_scan
+        # check_and_add идет из потока пакета модерации, prune и save - из фоновой задачи
+        self.lock = threading.Lock()
+        self._reset()
+        self.stats = {
+            'added': 0,
+            'lookups': 0,
+            'candidates_checked': 0,
+            'compactions': 0
+        }
+
+    def _reset(self):
+        self.signatures = array("H")
+        self.senders = array("q")
+        self.timestamps = array("d")
+        self.buckets: Dict[int, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self.senders)
+
+    def _signature(self, entry: int) -> array:
+        start = entry * SIGNATURE_SIZE
+        return self.signatures[start:start + SIGNATURE_SIZE]
+
+    def find(self, signature, now: Optional[float] = None) -> Dict[int, int]:
+        """Отправители похожих текстов в окне: sender_id -> число совпадений"""
+        now = time.time() if now is None else now
+        oldest = now - self.window
+        self.stats['lookups'] += 1
+        seen = set()
+        senders: Dict[int, int] = {}
+
+        for key in _band_keys(signature):
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                continue
+            entries = (bucket,) if isinstance(bucket, int) else bucket[-self.max_bucket_scan:]
+            for entry in entries:
+                if entry in seen:
+                    continue
+                seen.add(entry)
+                if self.timestamps[entry] < oldest:
+                    continue
+                if similarity(signature, self._signature(entry)) >= self.threshold:
+                    sender = self.senders[entry]
+                    senders[sender] = senders.get(sender, 0) + 1
+        self.stats['candidates_checked'] += len(seen)
+        return senders
+
+    def add(self, signature, sender_id: int, timestamp: Optional[float] = None):
+        if len(self.senders) >= self.max_entries:
+            self.compact()
+        entry = len(self.senders)
+        self.signatures.extend(signature)
+        self.senders.append(sender_id)
+        self.timestamps.append(time.time() if timestamp is None else timestamp)
+
+        buckets = self.buckets
+        for key in _band_keys(signature):
+            bucket = buckets.get(key)
+            if bucket is None:
+                # Большинство корзин содержит одну запись - храним число, не список
+                buckets[key] = entry
+            elif isinstance(bucket, int):
+                buckets[key] = [bucket, entry]
+            else:
+                bucket.append(entry)
+        self.stats['added'] += 1
+
+    def check_and_add(self, signature, sender_id: int, now: Optional[float] = None) -> Dict[int, int]:
+        """Похожие тексты в окне (до добавления текущего), затем добавление"""
+        now = time.time() if now is None else now
+        with self.lock:
+            senders = self.find(signature, now)
+            self.add(signature, sender_id, now)
+        return senders
+
+    def prune(self, now: Optional[float] = None) -> bool:
+        """Удаляет записи старше окна, если они есть (по таймеру, не только при переполнении)"""
+        now = time.time() if now is None else now
+        with self.lock:
+            # Записи добавляются по времени: самая старая - первая
+            if not len(self.timestamps) or self.timestamps[0] >= now - self.window:
+                return False
+            self.compact(now)
+        return True
+
+    def compact(self, now: Optional[float] = None):
+        """Удаляет записи старше окна и перестраивает корзины"""
+        now = time.time() if now is None else now
+        oldest = now - self.window
+        signatures, senders, timestamps = self.signatures, self.senders, self.timestamps
+        keep = [entry for entry in range(len(timestamps)) if timestamps[entry] >= oldest]
+        # Окно переполнено целиком - оставляем более свежую половину
+        if len(keep) >= self.max_entries:
+            keep = keep[len(keep) // 2:]
+
+        self._reset()
+        for entry in keep:
+            start = entry * SIGNATURE_SIZE
+            self.add(signatures[start:start + SIGNATURE_SIZE], senders[entry], timestamps[entry])
+        self.stats['added'] -= len(keep)
+        self.stats['compactions'] += 1
+
+    def save(self, path: str):
+        """Сохраняет снимок индекса (корзины перестраиваются при загрузке)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with self.lock:
+            with open(tmp_path, "wb") as f:
+                f.write(SNAPSHOT_MAGIC)
+                f.write(struct.pack("<Q", len(self.senders)))
+                self.signatures.tofile(f)
+                self.senders.tofile(f)
+                self.timestamps.tofile(f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> int:
+        """Загружает снимок, пропуская записи старше окна"""
+        if not os.path.exists(path):
+            return 0
+        return self._load_files([path])
+
+    def merge_into(self, path: str):
+        """Добавляет записи индекса в общий снимок (при остановке воркера)
+
+        Снимок читается и перезаписывается под блокировкой файла, чтобы
+        одновременно остановленные воркеры не потеряли записи друг друга.
+        """
+        with self.lock:
+            own = (array("H", self.signatures), array("q", self.senders), array("d", self.timestamps))
+        merged = NearDuplicateIndex(self.threshold, self.window, self.max_entries, self.max_bucket_scan)
+        with _file_lock(f"{path}.lock"):
+            merged._load_parts(_read_snapshots([path] if os.path.exists(path) else []) + [own])
+            merged.save(path)
+
+    def load_snapshots(self, base_path: str) -> int:
+        """Загружает общий снимок и снимки воркеров ({base_path}.<n>)
+
+        Снимки, не менявшиеся дольше окна, удаляются: их записи все равно устарели.
+        """
+        paths = []
+        oldest = time.time() - self.window
+        for path in [base_path] + glob.glob(f"{glob.escape(base_path)}.*"):
+            if path.endswith((".tmp", ".lock")) or not os.path.isfile(path):
+                continue
+            if os.path.getmtime(path) < oldest:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            paths.append(path)
+        return self._load_files(paths) if paths else 0
+
+    def _load_files(self, paths: List[str]) -> int:
+        return self._load_parts(_read_snapshots(paths))
+
+    def _load_parts(self, parts: List[Tuple[array, array, array]]) -> int:
+        signatures, senders, timestamps = array("H"), array("q"), array("d")
+        # Запись, загруженная воркером из общего снимка, есть и в его снимке
+        seen = set()
+        for file_signatures, file_senders, file_timestamps in parts:
+            for entry in range(len(file_senders)):
+                key = (file_senders[entry], file_timestamps[entry])
+                if key in seen:
+                    continue
+                seen.add(key)
+                start = entry * SIGNATURE_SIZE
+                signatures.extend(file_signatures[start:start + SIGNATURE_SIZE])
+                senders.append(file_senders[entry])
+                timestamps.append(file_timestamps[entry])
+
+        # Записи разных снимков перемежаются по времени: сортируем, чтобы prune видел самую старую
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        with self.lock:
+            self._reset()
+            for entry in order[-self.max_entries:]:
+                start = entry * SIGNATURE_SIZE
+                self.add(signatures[start:start + SIGNATURE_SIZE], senders[entry], timestamps[entry])
+            self.stats['added'] -= len(self.senders)
+            self.compact()
+        return len(self.senders)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'backend': 'memory',
+            'entries': len(self.senders),
+            'buckets': len(self.buckets)
+        }
+
+class RedisNearDuplicateIndex:
+    """LSH-индекс в Redis, общий для всех воркеров
+
+    Запись - ключ ndup:e:<id> (отправитель и подпись, TTL окна), корзина -
+    sorted set ndup:b:<ключ полосы> с id записей по времени. Корзины при
+    каждом добавлении обрезаются по окну и до max_bucket_scan последних
+    записей, а ключи истекают сами, так что устаревшее удаляется без
+    отдельной чистки. Проверка и добавление - один конвейер; второй запрос
+    (MGET подписей) только при найденных кандидатах.
+    """
+
+    key_prefix = "ndup:"
+
+    def __init__(self, client: "redis.Redis", threshold: float = 0.8,
+                 window_seconds: float = 3600, max_bucket_scan: int = 32):
+        self.client = client
+        self.threshold = threshold
+        self.window = window_seconds
+        self.max_bucket_scan = max_bucket_scan
+        self.stats = {
+            'added': 0,
+            'lookups': 0,
+            'candidates_checked': 0,
+            'errors': 0
+        }
+
+    def _bucket_key(self, key: int) -> str:
+        return f"{self.key_prefix}b:{key:x}"
+
+    def _entry_key(self, entry_id: str) -> str:
+        return f"{self.key_prefix}e:{entry_id}"
+
+    def check_and_add(self, signature, sender_id: int, now: Optional[float] = None) -> Dict[int, int]:
+        """Отправители похожих текстов в окне (до добавления текущего)"""
+        now = time.time() if now is None else now
+        oldest = now - self.window
+        ttl = int(self.window) + 1
+        entry_id = os.urandom(8).hex()
+        bucket_keys = [self._bucket_key(key) for key in _band_keys(signature)]
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for bucket_key in bucket_keys:
+                pipe.zrevrangebyscore(bucket_key, "+inf", oldest, start=0, num=self.max_bucket_scan)
+            pipe.set(self._entry_key(entry_id), struct.pack("<q", sender_id) + array("H", signature).tobytes(), ex=ttl)
+            for bucket_key in bucket_keys:
+                pipe.zadd(bucket_key, {entry_id: now})
+                pipe.zremrangebyscore(bucket_key, "-inf", f"({oldest}")
+                pipe.zremrangebyrank(bucket_key, 0, -self.max_bucket_scan - 1)
+                pipe.expire(bucket_key, ttl)
+            results = pipe.execute()
+
+            candidates = set()
+            for members in results[:len(bucket_keys)]:
+                candidates.update(member.decode() if isinstance(member, bytes) else member for member in members)
+            self.stats['lookups'] += 1
+            self.stats['added'] += 1
+            self.stats['candidates_checked'] += len(candidates)
+            if not candidates:
+                return {}
+
+            senders: Dict[int, int] = {}
+            for value in self.client.mget([self._entry_key(candidate) for candidate in candidates]):
+                if value is None:
+                    continue
+                sender = struct.unpack_from("<q", value)[0]
+                candidate_signature = array("H")
+                candidate_signature.frombytes(value[8:])
+                if similarity(signature, candidate_signature) >= self.threshold:
+                    senders[sender] = senders.get(sender, 0) + 1
+            return senders
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.warning(f"Ошибка индекса дубликатов в Redis: {e}")
+            return {}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'backend': 'redis'
+        }
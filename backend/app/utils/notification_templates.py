@@ -0,0 +1,220 @@
+"""
+Реестр шаблонов уведомлений
+Шаблоны компилируются один раз из каталогов locales, пользовательские поля экранируются для HTML
+"""
+
+import copy
+import html
+from collections import OrderedDict
+from string import Formatter
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from .localization import localization_manager
+from .logger import get_logger
+
+logger = get_logger("notification_templates")
+
+# Поля системных уведомлений задает администратор, в них допустима HTML-разметка
+SYSTEM_TRUSTED_FIELDS = ("title", "message")
+
+class CompiledTemplate:
+    """Скомпилированный шаблон: чередование литералов и имен полей"""
+
+    __slots__ = ("literals", "fields", "escape", "trusted")
+
+    def __init__(self, literals: Tuple[str, ...], fields: Tuple[str, ...], escape: bool = True,
+                 trusted: Iterable[str] = ()):
+        # len(literals) == len(fields) + 1
+        self.literals = literals
+        self.fields = fields
+        self.escape = escape
+        # Поля, подставляемые без экранирования
+        self.trusted: FrozenSet[str] = frozenset(trusted)
+
+    @classmethod
+    def compile(cls, source: str, escape: bool = True, trusted: Iterable[str] = ()) -> "CompiledTemplate":
+        """Разбирает строку формата вида "{from} → {to}" один раз"""
+        literals: List[str] = []
+        fields: List[str] = []
+        current = ""
+        for literal, field_name, _, _ in Formatter().parse(source):
+            current += literal
+            if field_name is None:
+                continue
+            literals.append(current)
+            fields.append(field_name)
+            current = ""
+        literals.append(current)
+        return cls(tuple(literals), tuple(fields), escape, trusted)
+
+    def _value(self, values: Dict[str, Any], name: str) -> str:
+        value = values.get(name)
+        text = "" if value is None else str(value)
+        if not self.escape or name in self.trusted:
+            return text
+        return html.escape(text, quote=False)
+
+    def render(self, values: Dict[str, Any]) -> str:
+        """Подставляет значения полей"""
+        if not self.fields:
+            return self.literals[0]
+        parts = [self.literals[0]]
+        for index, name in enumerate(self.fields):
+            parts.append(self._value(values, name))
+            parts.append(self.literals[index + 1])
+        return "".join(parts)
+
+class NotificationTemplate:
+    """Локализованный шаблон уведомления (заголовок, текст, кнопка)"""
+
+    def __init__(self, name: str, language: str, title: CompiledTemplate, text: CompiledTemplate,
+                 button_text: Optional[CompiledTemplate] = None,
+                 button_callback: Optional[CompiledTemplate] = None,
+                 defaults: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.language = language
+        self.title = title
+        self.text = text
+        self.button_text = button_text
+        self.button_callback = button_callback
+        self.defaults: Dict[str, Any] = defaults or {}
+
+        parts = [title, text] + ([button_text, button_callback] if button_text else [])
+        self.fields: Tuple[str, ...] = tuple(sorted({field for part in parts for field in part.fields}))
+
+    @classmethod
+    def from_spec(cls, name: str, language: str, spec: Dict[str, Any],
+                  trusted: Iterable[str] = ()) -> "NotificationTemplate":
+        """Компилирует шаблон из записи каталога локализации
+
+        trusted - поля из доверенного источника, подставляемые без экранирования.
+        """
+        button = spec.get("button")
+        return cls(
+            name=name,
+            language=language,
+            title=CompiledTemplate.compile(spec.get("title", ""), trusted=trusted),
+            text=CompiledTemplate.compile(spec.get("text", ""), trusted=trusted),
+            button_text=CompiledTemplate.compile(button["text"]) if button else None,
+            # callback_data не является HTML и не экранируется
+            button_callback=CompiledTemplate.compile(button.get("callback_data", ""), escape=False) if button else None,
+            defaults=dict(spec.get("defaults", {}))
+        )
+
+    def _merge(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        return {**self.defaults, **{k: v for k, v in values.items() if v not in (None, "")}}
+
+    def cache_key(self, values: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+        """Ключ кэша строится только по полям, которые использует шаблон"""
+        return tuple((name, str(values.get(name, ""))) for name in self.fields)
+
+    def render(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Рендерит уведомление"""
+        merged = self._merge(values)
+        rendered = {
+            "title": self.title.render(merged),
+            "text": self.text.render(merged),
+            "reply_markup": None
+        }
+        if self.button_text is not None:
+            rendered["reply_markup"] = {
+                "inline_keyboard": [[{
+                    "text": self.button_text.render(merged),
+                    "callback_data": self.button_callback.render(merged)
+                }]]
+            }
+        return rendered
+
+class NotificationTemplateRegistry:
+    """Реестр шаблонов, компилируемых один раз при старте, с кэшем рендеринга"""
+
+    def __init__(self, cache_size: int = 1024):
+        self.templates: Dict[Tuple[str, str], NotificationTemplate] = {}
+        self.icons: Dict[str, Dict[str, str]] = {}
+        self.languages: set = set()
+        self.cache_size = cache_size
+        self._render_cache: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self.stats = {
+            'renders': 0,
+            'cache_hits': 0,
+            'compiled_templates': 0
+        }
+        self.compile()
+
+    @property
+    def default_language(self) -> str:
+        return localization_manager.default_language
+
+    def compile(self):
+        """Компилирует все шаблоны из каталогов локализации"""
+        templates: Dict[Tuple[str, str], NotificationTemplate] = {}
+        icons: Dict[str, Dict[str, str]] = {}
+
+        for language in localization_manager.get_supported_languages():
+            catalog = localization_manager.translations.get(language, {}).get("notifications", {})
+            for name, spec in catalog.get("ride", {}).items():
+                templates[(name, language)] = NotificationTemplate.from_spec(name, language, spec)
+
+            system = catalog.get("system")
+            if system:
+                templates[("system", language)] = NotificationTemplate.from_spec(
+                    "system", language, system, trusted=SYSTEM_TRUSTED_FIELDS
+                )
+                icons[language] = dict(system.get("icons", {}))
+
+        self.templates = templates
+        self.icons = icons
+        self.languages = {language for _, language in templates}
+        self._render_cache.clear()
+        self.stats['compiled_templates'] = len(templates)
+        logger.info(f"Скомпилировано шаблонов уведомлений: {len(templates)}")
+
+    def resolve_language(self, language: Optional[str]) -> str:
+        """Выбирает поддерживаемый язык с откатом на язык по умолчанию"""
+        if language in self.languages:
+            return language
+        return self.default_language
+
+    def get(self, name: str, language: Optional[str] = None) -> Optional[NotificationTemplate]:
+        """Получает скомпилированный шаблон"""
+        language = self.resolve_language(language)
+        template = self.templates.get((name, language))
+        if template is None and language != self.default_language:
+            template = self.templates.get((name, self.default_language))
+        return template
+
+    def get_icon(self, notification_type: str, language: Optional[str] = None) -> str:
+        """Иконка системного уведомления"""
+        icons = self.icons.get(self.resolve_language(language), {})
+        return icons.get(notification_type, icons.get("info", ""))
+
+    def render(self, name: str, values: Dict[str, Any], language: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Рендерит шаблон с кэшированием результата (вызывающий получает свою копию)"""
+        template = self.get(name, language)
+        if template is None:
+            return None
+
+        self.stats['renders'] += 1
+        key = (name, template.language, template.cache_key(values))
+        cached = self._render_cache.get(key)
+        if cached is not None:
+            self._render_cache.move_to_end(key)
+            self.stats['cache_hits'] += 1
+            return copy.deepcopy(cached)
+
+        rendered = template.render(values)
+        self._render_cache[key] = rendered
+        if len(self._render_cache) > self.cache_size:
+            self._render_cache.popitem(last=False)
+        return copy.deepcopy(rendered)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика реестра"""
+        return {
+            **self.stats,
+            'cached_renders': len(self._render_cache),
+            'languages': sorted(self.languages)
+        }
+
+# Глобальный реестр шаблонов
+notification_templates = NotificationTemplateRegistry()
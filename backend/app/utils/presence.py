@@ -0,0 +1,196 @@
+"""
+Реестр присутствия пользователей (онлайн-статус) для всех воркеров
+Redis-ключи с TTL, которые продлеваются heartbeat'ом WebSocket менеджеров,
+и in-memory замена для запуска без Redis
+"""
+
+import time
+from typing import Dict, Iterable, List, Optional, Any
+
+import redis
+
+from ..config.settings import settings
+from .logger import get_logger
+
+logger = get_logger("presence")
+
+class InMemoryPresenceBackend:
+    """Хранилище присутствия в памяти процесса (один воркер, тесты)"""
+
+    def __init__(self):
+        self._last_seen: Dict[int, float] = {}
+        self._expires: Dict[int, float] = {}
+
+    def set_online(self, user_ids: List[int], ttl: int):
+        now = time.time()
+        for user_id in user_ids:
+            self._last_seen[user_id] = now
+            self._expires[user_id] = now + ttl
+
+    def set_offline(self, user_ids: List[int]):
+        for user_id in user_ids:
+            self._expires.pop(user_id, None)
+
+    def get_many(self, user_ids: List[int]) -> Dict[int, Optional[float]]:
+        now = time.time()
+        result = {}
+        for user_id in user_ids:
+            expires = self._expires.get(user_id)
+            if expires is not None and expires <= now:
+                del self._expires[user_id]
+                expires = None
+            result[user_id] = self._last_seen.get(user_id) if expires is not None else None
+        return result
+
+class RedisPresenceBackend:
+    """Хранилище присутствия в Redis: ключ presence:{user_id} с TTL"""
+
+    key_prefix = "presence:"
+
+    def __init__(self, client: "redis.Redis"):
+        self.client = client
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.key_prefix}{user_id}"
+
+    def set_online(self, user_ids: List[int], ttl: int):
+        now = str(time.time())
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.set(self._key(user_id), now, ex=ttl)
+        pipe.execute()
+
+    def set_offline(self, user_ids: List[int]):
+        if user_ids:
+            self.client.delete(*[self._key(user_id) for user_id in user_ids])
+
+    def get_many(self, user_ids: List[int]) -> Dict[int, Optional[float]]:
+        # Один MGET на весь список - один сетевой round trip
+        values = self.client.mget([self._key(user_id) for user_id in user_ids])
+        return {
+            user_id: float(value) if value is not None else None
+            for user_id, value in zip(user_ids, values)
+        }
+
+class PresenceService:
+    """Сервис присутствия пользователей
+
+    WebSocket менеджеры воркера вызывают acquire/release на каждое соединение,
+    а heartbeat продлевает ключи всех локально подключенных пользователей
+    одним пакетом. Если воркер умер, ключи истекают сами через TTL.
+    """
+
+    def __init__(self, ttl: Optional[int] = None):
+        # TTL должен пережить хотя бы один пропущенный heartbeat
+        self.ttl = ttl or int(settings.websocket_heartbeat_interval * 2 + 5)
+        self.backend = InMemoryPresenceBackend()
+        self.use_redis = False
+        self.local_connections: Dict[int, int] = {}  # user_id -> число соединений на этом воркере
+        self._last_refresh = 0.0
+        self.stats = {
+            'refreshes': 0,
+            'lookups': 0,
+            'errors': 0
+        }
+
+        if settings.redis_url:
+            try:
+                client = redis.from_url(settings.redis_url)
+                client.ping()
+                self.backend = RedisPresenceBackend(client)
+                self.use_redis = True
+                logger.info("Presence подключен к Redis")
+            except Exception as e:
+                logger.warning(f"Presence работает в памяти, Redis недоступен: {e}")
+
+    def acquire(self, user_id: Optional[int]):
+        """Новое соединение пользователя на этом воркере"""
+        if not user_id:
+            return
+        count = self.local_connections.get(user_id, 0)
+        self.local_connections[user_id] = count + 1
+        if count == 0:
+            self.mark_online([user_id])
+
+    def release(self, user_id: Optional[int]):
+        """Соединение пользователя на этом воркере закрыто"""
+        if not user_id or user_id not in self.local_connections:
+            return
+        count = self.local_connections[user_id] - 1
+        if count > 0:
+            self.local_connections[user_id] = count
+            return
+        del self.local_connections[user_id]
+        self.mark_offline([user_id])
+
+    def refresh_local(self, min_interval: Optional[float] = None):
+        """Продлевает TTL всех локально подключенных пользователей (вызывается из heartbeat)"""
+        min_interval = settings.websocket_heartbeat_interval / 2 if min_interval is None else min_interval
+        now = time.monotonic()
+        # Несколько менеджеров на воркере не должны продлевать ключи чаще нужного
+        if now - self._last_refresh < min_interval:
+            return
+        self._last_refresh = now
+        self.mark_online(list(self.local_connections))
+
+    def mark_online(self, user_ids: Iterable[int]):
+        """Отмечает пользователей онлайн и продлевает TTL (пакетно)"""
+        user_ids = [user_id for user_id in user_ids if user_id]
+        if not user_ids:
+            return
+        try:
+            self.backend.set_online(user_ids, self.ttl)
+            self.stats['refreshes'] += len(user_ids)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Ошибка обновления присутствия: {e}")
+
+    def mark_offline(self, user_ids: Iterable[int]):
+        """Отмечает пользователей офлайн (последнее соединение на воркере закрыто)
+
+        Если у пользователя есть соединение на другом воркере, тот вернет
+        ключ на ближайшем heartbeat.
+        """
+        user_ids = [user_id for user_id in user_ids if user_id]
+        if not user_ids:
+            return
+        try:
+            self.backend.set_offline(user_ids)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Ошибка снятия присутствия: {e}")
+
+    def get_presence(self, user_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """Онлайн-статус списка пользователей за один запрос к хранилищу"""
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return {}
+        self.stats['lookups'] += 1
+        try:
+            last_seen = self.backend.get_many(user_ids)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Ошибка получения присутствия: {e}")
+            last_seen = {}
+        return {
+            user_id: {
+                "online": last_seen.get(user_id) is not None,
+                "last_seen": last_seen.get(user_id)
+            }
+            for user_id in user_ids
+        }
+
+    def is_online(self, user_id: int) -> bool:
+        """Онлайн ли пользователь на любом воркере"""
+        return self.get_presence([user_id])[user_id]["online"]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'backend': 'redis' if self.use_redis else 'memory',
+            'local_users': len(self.local_connections),
+            'ttl': self.ttl
+        }
+
+# Глобальный экземпляр сервиса присутствия
+presence_service = PresenceService()
@@ -3,14 +3,24 @@ WebSocket менеджер для уведомлений в реальном в
 """
 
 import asyncio
+import itertools
 import json
-import uuid
-from typing import Dict, Set, List, Optional, Any
-from datetime import datetime
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Any, Iterable, Set, Tuple, Union
+from datetime import datetime, timedelta
 from fastapi import WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 
+from ..config.settings import settings
 from .logger import get_logger
+from .presence import presence_service
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson есть в requirements.txt
+    orjson = None
 
 logger = get_logger("websocket_manager")
 
@@ -23,44 +33,205 @@ class NotificationMessage(BaseModel):
     timestamp: datetime = datetime.now()
     user_id: Optional[int] = None
 
+class EncodedFrame:
+    """Заранее сериализованный WebSocket кадр
+    
+    Сообщение сериализуется один раз на рассылку, а не на каждого получателя.
+    """
+    
+    __slots__ = ("text",)
+    
+    def __init__(self, text: str):
+        self.text = text
+    
+    @classmethod
+    def from_data(cls, data: Any) -> "EncodedFrame":
+        """Сериализует dict/list в JSON кадр (Decimal и прочие типы - строкой, как json с default=str)"""
+        if orjson is not None:
+            return cls(orjson.dumps(data, default=str).decode())
+        return cls(json.dumps(data, default=str))
+    
+    @classmethod
+    def from_message(cls, message: BaseModel) -> "EncodedFrame":
+        """Сериализует Pydantic модель в JSON кадр"""
+        if orjson is not None:
+            return cls(orjson.dumps(message.model_dump(mode="json")).decode())
+        return cls(message.json())
+    
+    def __len__(self) -> int:
+        return len(self.text)
+
+def encode_frame(item: Union[EncodedFrame, BaseModel, Dict[str, Any]]) -> EncodedFrame:
+    """Приводит сообщение к кадру, не сериализуя уже готовые кадры повторно"""
+    if isinstance(item, EncodedFrame):
+        return item
+    if isinstance(item, BaseModel):
+        return EncodedFrame.from_message(item)
+    return EncodedFrame.from_data(item)
+
+# Политики переполнения очереди отправки медленного клиента
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_DISCONNECT = "disconnect"
+
+class IdleTracker:
+    """Упорядоченный по времени активности реестр соединений
+    
+    Активность переносит ключ в конец, поэтому самые старые соединения
+    всегда в начале и поиск просроченных стоит O(просроченных), а не O(всех).
+    """
+    
+    def __init__(self):
+        self._order: "OrderedDict[Any, float]" = OrderedDict()
+    
+    def touch(self, key: Any, now: Optional[float] = None):
+        """Отмечает активность соединения"""
+        self._order[key] = time.monotonic() if now is None else now
+        self._order.move_to_end(key)
+    
+    def remove(self, key: Any):
+        self._order.pop(key, None)
+    
+    def idle_since(self, cutoff: float) -> List[Any]:
+        """Соединения без активности с момента cutoff (без удаления)"""
+        keys = []
+        for key, seen in self._order.items():
+            if seen >= cutoff:
+                break
+            keys.append(key)
+        return keys
+    
+    def pop_expired(self, cutoff: float) -> List[Any]:
+        """Извлекает соединения, неактивные с момента cutoff"""
+        expired = []
+        while self._order:
+            key, seen = next(iter(self._order.items()))
+            if seen >= cutoff:
+                break
+            self._order.popitem(last=False)
+            expired.append(key)
+        return expired
+    
+    def __len__(self) -> int:
+        return len(self._order)
+
+def monotonic_to_datetime(timestamp: float) -> datetime:
+    """Переводит отметку time.monotonic() в локальное время"""
+    return datetime.now() - timedelta(seconds=time.monotonic() - timestamp)
+
 class WebSocketConnection:
-    """Класс для управления WebSocket соединением"""
+    """Класс для управления WebSocket соединением
     
-    def __init__(self, websocket: WebSocket, user_id: Optional[int] = None):
+    Объект компактный: __slots__, целочисленный id, отметки time.monotonic()
+    и кортеж интернированных имен подписок. Очередь отправки и задача-писатель
+    создаются только когда есть что отправлять, поэтому простаивающее
+    соединение не держит ни deque, ни asyncio.Task.
+    """
+    
+    __slots__ = (
+        "manager", "websocket", "user_id", "connection_id",
+        "connected_at", "last_activity", "subscriptions",
+        "queue", "writer_task", "dropped_messages", "closed"
+    )
+    
+    def __init__(self, manager: "WebSocketManager", websocket: WebSocket,
+                 connection_id: int, user_id: Optional[int] = None):
+        self.manager = manager
         self.websocket = websocket
         self.user_id = user_id
-        self.connection_id = str(uuid.uuid4())
-        self.connected_at = datetime.now()
-        self.last_activity = datetime.now()
-        self.subscriptions: Set[str] = set()
+        self.connection_id = connection_id
+        self.connected_at = time.monotonic()
+        self.last_activity = self.connected_at
+        self.subscriptions: Tuple[str, ...] = ()
+        self.queue: Optional[deque] = None
+        self.writer_task: Optional[asyncio.Task] = None
+        self.dropped_messages = 0
+        self.closed = False
     
-    async def send_message(self, message: NotificationMessage):
-        """Отправляет сообщение через WebSocket"""
+    async def _writer(self):
+        """Отправляет накопленные кадры и завершается, когда очередь пуста"""
+        try:
+            while self.queue and not self.closed:
+                frame = self.queue.popleft()
+                await self.send_frame(frame)
+                self.manager.stats['messages_sent'] += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Писатель WebSocket {self.connection_id} остановлен: {e}")
+            self.manager._on_writer_failure(self.connection_id)
+        finally:
+            self.writer_task = None
+            if not self.queue:
+                self.queue = None
+    
+    def enqueue(self, frame: EncodedFrame) -> bool:
+        """Кладет сообщение в очередь отправки без ожидания
+        
+        Returns:
+            bool: False, если сообщение отброшено или клиент отключается
+        """
+        if self.closed:
+            return False
+        
+        queue = self.queue
+        if queue is None:
+            queue = self.queue = deque()
+        
+        if len(queue) >= self.manager.max_queue_size:
+            self.dropped_messages += 1
+            if self.manager.overflow_policy != OVERFLOW_DROP_OLDEST:
+                return False
+            queue.popleft()
+        
+        queue.append(frame)
+        if self.writer_task is None:
+            self.writer_task = asyncio.create_task(self._writer())
+        return True
+    
+    @property
+    def queue_depth(self) -> int:
+        return len(self.queue) if self.queue else 0
+    
+    def close(self):
+        """Останавливает писателя"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue = None
+        if self.writer_task and not self.writer_task.done() and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+    
+    async def send_frame(self, frame: EncodedFrame):
+        """Отправляет готовый кадр через WebSocket"""
         try:
-            await self.websocket.send_text(message.json())
-            self.last_activity = datetime.now()
+            await self.websocket.send_text(frame.text)
             logger.debug(f"Сообщение отправлено пользователю {self.user_id}")
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения: {e}")
             raise
     
+    async def send_message(self, message: NotificationMessage):
+        """Отправляет сообщение через WebSocket"""
+        await self.send_frame(EncodedFrame.from_message(message))
+    
     async def send_json(self, data: Dict[str, Any]):
         """Отправляет JSON данные через WebSocket"""
-        try:
-            await self.websocket.send_text(json.dumps(data))
-            self.last_activity = datetime.now()
-        except Exception as e:
-            logger.error(f"Ошибка отправки JSON: {e}")
-            raise
+        await self.send_frame(EncodedFrame.from_data(data))
+    
+    def touch(self, now: Optional[float] = None):
+        """Отмечает входящую активность клиента (сообщение или pong)"""
+        self.last_activity = time.monotonic() if now is None else now
     
     def add_subscription(self, subscription: str):
         """Добавляет подписку"""
-        self.subscriptions.add(subscription)
+        if subscription not in self.subscriptions:
+            self.subscriptions += (subscription,)
         logger.debug(f"Добавлена подписка {subscription} для пользователя {self.user_id}")
     
     def remove_subscription(self, subscription: str):
         """Удаляет подписку"""
-        self.subscriptions.discard(subscription)
+        self.subscriptions = tuple(s for s in self.subscriptions if s != subscription)
         logger.debug(f"Удалена подписка {subscription} для пользователя {self.user_id}")
     
     def is_subscribed_to(self, subscription: str) -> bool:
@@ -68,163 +239,350 @@ class WebSocketConnection:
         return subscription in self.subscriptions
 
 class WebSocketManager:
-    """Менеджер WebSocket соединений"""
+    """Менеджер WebSocket соединений
     
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocketConnection] = {}
-        self.user_connections: Dict[int, Set[str]] = {}  # user_id -> connection_ids
-        self.subscription_connections: Dict[str, Set[str]] = {}  # subscription -> connection_ids
+    Учет рассчитан на десятки тысяч соединений: id соединений - целые числа,
+    у пользователя обычно одно соединение (хранится как int, кортеж - только
+    при нескольких), а участники подписки - множество целочисленных id
+    соединений под интернированным именем темы. Память подписки
+    пропорциональна числу подписчиков, а не числу соединений процесса.
+    """
+    
+    def __init__(self, max_queue_size: Optional[int] = None, overflow_policy: Optional[str] = None,
+                 heartbeat_interval: Optional[float] = None, idle_timeout: Optional[float] = None):
+        self.active_connections: Dict[int, WebSocketConnection] = {}
+        self.user_connections: Dict[int, Union[int, Tuple[int, ...]]] = {}  # user_id -> connection_id(s)
+        self.subscription_connections: Dict[str, Set[int]] = {}  # subscription -> id соединений
+        self._connection_ids = itertools.count(1)
+        self.max_queue_size = max_queue_size or settings.websocket_send_queue_size
+        self.overflow_policy = overflow_policy or settings.websocket_overflow_policy
+        self.heartbeat_interval = heartbeat_interval or settings.websocket_heartbeat_interval
+        self.idle_timeout = idle_timeout or settings.websocket_idle_timeout
+        self.max_subscription_length = settings.websocket_max_subscription_length
+        self.max_subscriptions = settings.websocket_max_subscriptions
+        self.idle_tracker = IdleTracker()
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        self.lifetime_stats = {
+            'closed_connections': 0,
+            'total_lifetime_seconds': 0.0,
+            'max_lifetime_seconds': 0.0
+        }
         self.stats = {
             'total_connections': 0,
             'active_connections': 0,
+            'messages_queued': 0,
             'messages_sent': 0,
-            'messages_failed': 0
+            'messages_failed': 0,
+            'messages_dropped': 0,
+            'slow_consumers_disconnected': 0,
+            'pings_sent': 0,
+            'connections_reaped': 0,
+            'subscriptions_rejected': 0
         }
     
-    async def connect(self, websocket: WebSocket, user_id: Optional[int] = None) -> str:
-        """Подключает нового пользователя"""
-        await websocket.accept()
-        
-        connection = WebSocketConnection(websocket, user_id)
-        self.active_connections[connection.connection_id] = connection
+    def register(self, websocket: WebSocket, user_id: Optional[int] = None) -> WebSocketConnection:
+        """Регистрирует уже принятое соединение"""
+        connection = WebSocketConnection(self, websocket, next(self._connection_ids), user_id)
+        connection_id = connection.connection_id
+        self.active_connections[connection_id] = connection
+        self.idle_tracker.touch(connection_id, connection.connected_at)
         
+        presence_service.acquire(user_id)
         if user_id:
-            if user_id not in self.user_connections:
-                self.user_connections[user_id] = set()
-            self.user_connections[user_id].add(connection.connection_id)
+            existing = self.user_connections.get(user_id)
+            if existing is None:
+                self.user_connections[user_id] = connection_id
+            elif isinstance(existing, int):
+                self.user_connections[user_id] = (existing, connection_id)
+            else:
+                self.user_connections[user_id] = existing + (connection_id,)
         
         self.stats['total_connections'] += 1
         self.stats['active_connections'] += 1
+        return connection
+    
+    async def connect(self, websocket: WebSocket, user_id: Optional[int] = None) -> int:
+        """Подключает нового пользователя"""
+        await websocket.accept()
+        
+        connection = self.register(websocket, user_id)
+        self.start_heartbeat()
         
         logger.info(f"WebSocket подключен: {connection.connection_id} для пользователя {user_id}")
         return connection.connection_id
     
-    def disconnect(self, connection_id: str):
+    def _on_writer_failure(self, connection_id: int):
+        """Сокет перестал принимать данные - убираем соединение"""
+        self.stats['messages_failed'] += 1
+        self.disconnect(connection_id)
+    
+    def _user_connection_ids(self, user_id: int) -> Tuple[int, ...]:
+        ids = self.user_connections.get(user_id)
+        if ids is None:
+            return ()
+        return (ids,) if isinstance(ids, int) else ids
+    
+    def disconnect(self, connection_id: int):
         """Отключает пользователя"""
-        if connection_id in self.active_connections:
-            connection = self.active_connections[connection_id]
-            
-            # Удаляем из подписок
-            for subscription in connection.subscriptions:
-                if subscription in self.subscription_connections:
-                    self.subscription_connections[subscription].discard(connection_id)
-                    if not self.subscription_connections[subscription]:
-                        del self.subscription_connections[subscription]
-            
-            # Удаляем из пользовательских соединений
-            if connection.user_id and connection.user_id in self.user_connections:
-                self.user_connections[connection.user_id].discard(connection_id)
-                if not self.user_connections[connection.user_id]:
-                    del self.user_connections[connection.user_id]
-            
-            del self.active_connections[connection_id]
-            self.stats['active_connections'] -= 1
-            
-            logger.info(f"WebSocket отключен: {connection_id}")
+        connection = self.active_connections.pop(connection_id, None)
+        if connection is None:
+            return
+        
+        connection.close()
+        self.idle_tracker.remove(connection_id)
+        self._record_lifetime(connection)
+        presence_service.release(connection.user_id)
+        
+        # Удаляем из подписок
+        for subscription in connection.subscriptions:
+            self._remove_subscriber(subscription, connection_id)
+        
+        # Удаляем из пользовательских соединений
+        if connection.user_id and connection.user_id in self.user_connections:
+            remaining = tuple(cid for cid in self._user_connection_ids(connection.user_id) if cid != connection_id)
+            if not remaining:
+                del self.user_connections[connection.user_id]
+            else:
+                self.user_connections[connection.user_id] = remaining[0] if len(remaining) == 1 else remaining
+        
+        self.stats['active_connections'] -= 1
+        
+        logger.info(f"WebSocket отключен: {connection_id}")
+    
+    def _record_lifetime(self, connection: WebSocketConnection):
+        lifetime = time.monotonic() - connection.connected_at
+        self.lifetime_stats['closed_connections'] += 1
+        self.lifetime_stats['total_lifetime_seconds'] += lifetime
+        self.lifetime_stats['max_lifetime_seconds'] = max(self.lifetime_stats['max_lifetime_seconds'], lifetime)
+    
+    def touch(self, connection_id: int):
+        """Отмечает входящую активность соединения"""
+        connection = self.active_connections.get(connection_id)
+        if connection is not None:
+            now = time.monotonic()
+            connection.touch(now)
+            self.idle_tracker.touch(connection_id, now)
+    
+    def start_heartbeat(self):
+        """Запускает фоновый heartbeat, если он еще не запущен"""
+        if self.heartbeat_task is None or self.heartbeat_task.done():
+            self.heartbeat_task = asyncio.create_task(self._heartbeat_loop())
     
-    async def subscribe(self, connection_id: str, subscription: str):
+    async def stop_heartbeat(self):
+        """Останавливает фоновый heartbeat"""
+        if self.heartbeat_task and not self.heartbeat_task.done():
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+        self.heartbeat_task = None
+    
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Ошибка heartbeat WebSocket: {e}")
+    
+    def heartbeat(self, now: Optional[float] = None) -> int:
+        """Один такт heartbeat: вытесняет просроченные соединения и пингует простаивающие
+        
+        Returns:
+            int: количество вытесненных соединений
+        """
+        now = time.monotonic() if now is None else now
+        
+        # Просроченные соединения лежат в начале трекера - O(просроченных)
+        expired = self.idle_tracker.pop_expired(now - self.idle_timeout)
+        for connection_id in expired:
+            connection = self.active_connections.get(connection_id)
+            if connection is None:
+                continue
+            self.disconnect(connection_id)
+            asyncio.create_task(self._close_socket(connection.websocket, code=1001))
+        if expired:
+            self.stats['connections_reaped'] += len(expired)
+            logger.info(f"Вытеснено неактивных WebSocket соединений: {len(expired)}")
+        
+        # Продлеваем присутствие локальных пользователей одним пакетом
+        presence_service.refresh_local()
+        
+        # Пингуем только тех, кто молчал дольше интервала
+        idle = self.idle_tracker.idle_since(now - self.heartbeat_interval)
+        if idle:
+            ping = EncodedFrame.from_data({"type": "ping", "timestamp": datetime.now().isoformat()})
+            for connection_id in idle:
+                connection = self.active_connections.get(connection_id)
+                if connection is not None and self._enqueue(connection, ping):
+                    self.stats['pings_sent'] += 1
+        
+        return len(expired)
+    
+    def _enqueue(self, connection: WebSocketConnection, frame: EncodedFrame) -> bool:
+        """Ставит кадр в очередь соединения с учетом политики переполнения"""
+        dropped_before = connection.dropped_messages
+        queued = connection.enqueue(frame)
+        self.stats['messages_dropped'] += connection.dropped_messages - dropped_before
+        
+        if queued:
+            self.stats['messages_queued'] += 1
+            return True
+        
+        if self.overflow_policy == OVERFLOW_DISCONNECT and not connection.closed:
+            logger.warning(f"Медленный клиент {connection.connection_id} отключен: очередь переполнена")
+            self.stats['slow_consumers_disconnected'] += 1
+            self.disconnect(connection.connection_id)
+            asyncio.create_task(self._close_socket(connection.websocket))
+        return False
+    
+    async def _close_socket(self, websocket: WebSocket, code: int = 1013):
+        try:
+            # 1013 - Try Again Later, 1001 - Going Away
+            await websocket.close(code=code)
+        except Exception:
+            pass
+    
+    def is_valid_subscription(self, subscription: Any) -> bool:
+        """Имя темы от клиента: непустая строка не длиннее max_subscription_length"""
+        return isinstance(subscription, str) and 0 < len(subscription) <= self.max_subscription_length
+    
+    def _remove_subscriber(self, subscription: str, connection_id: int):
+        subscribers = self.subscription_connections.get(subscription)
+        if subscribers is None:
+            return
+        subscribers.discard(connection_id)
+        if not subscribers:
+            del self.subscription_connections[subscription]
+    
+    def _reject_subscription(self, connection: WebSocketConnection, subscription: Any, reason: str):
+        self.stats['subscriptions_rejected'] += 1
+        self._enqueue(connection, EncodedFrame.from_data({
+            "type": "error",
+            "subscription": subscription if isinstance(subscription, str) else None,
+            "message": reason
+        }))
+    
+    async def subscribe(self, connection_id: int, subscription: Any):
         """Подписывает соединение на уведомления"""
         if connection_id in self.active_connections:
             connection = self.active_connections[connection_id]
-            connection.add_subscription(subscription)
+            # Имя приходит от клиента: проверяем до интернирования и записи в индекс
+            if not self.is_valid_subscription(subscription):
+                self._reject_subscription(connection, subscription, "Некорректное имя подписки")
+                return
+            if subscription not in connection.subscriptions and len(connection.subscriptions) >= self.max_subscriptions:
+                self._reject_subscription(connection, subscription, "Слишком много подписок")
+                return
             
-            if subscription not in self.subscription_connections:
-                self.subscription_connections[subscription] = set()
-            self.subscription_connections[subscription].add(connection_id)
+            # Интернируем имя: все соединения делят одну строку на тему
+            subscription = sys.intern(subscription)
+            connection.add_subscription(subscription)
+            self.subscription_connections.setdefault(subscription, set()).add(connection_id)
             
             # Отправляем подтверждение подписки
-            await connection.send_json({
+            self._enqueue(connection, EncodedFrame.from_data({
                 "type": "subscription_confirmed",
                 "subscription": subscription,
                 "timestamp": datetime.now().isoformat()
-            })
+            }))
     
-    async def unsubscribe(self, connection_id: str, subscription: str):
+    async def unsubscribe(self, connection_id: int, subscription: Any):
         """Отписывает соединение от уведомлений"""
         if connection_id in self.active_connections:
             connection = self.active_connections[connection_id]
-            connection.remove_subscription(subscription)
+            if not self.is_valid_subscription(subscription):
+                self._reject_subscription(connection, subscription, "Некорректное имя подписки")
+                return
             
-            if subscription in self.subscription_connections:
-                self.subscription_connections[subscription].discard(connection_id)
-                if not self.subscription_connections[subscription]:
-                    del self.subscription_connections[subscription]
+            connection.remove_subscription(subscription)
+            self._remove_subscriber(subscription, connection_id)
             
             # Отправляем подтверждение отписки
-            await connection.send_json({
+            self._enqueue(connection, EncodedFrame.from_data({
                 "type": "unsubscription_confirmed",
                 "subscription": subscription,
                 "timestamp": datetime.now().isoformat()
-            })
+            }))
+    
+    def _fan_out(self, connections: Iterable[Optional[WebSocketConnection]],
+                 item: Union[EncodedFrame, NotificationMessage, Dict[str, Any]]) -> int:
+        """Ставит сообщение в очереди соединений, возвращает число неудач
+        
+        Сообщение сериализуется один раз на всю рассылку.
+        """
+        frame = encode_frame(item)
+        failed = 0
+        for connection in list(connections):
+            if connection is not None and not self._enqueue(connection, frame):
+                failed += 1
+        return failed
+    
+    def get_subscribers(self, subscription: str) -> List[WebSocketConnection]:
+        """Соединения, подписанные на тему"""
+        connections = self.active_connections
+        return [connections[cid] for cid in self.subscription_connections.get(subscription, ()) if cid in connections]
     
     async def send_to_user(self, user_id: int, message: NotificationMessage):
         """Отправляет уведомление конкретному пользователю"""
         if user_id in self.user_connections:
-            failed_sends = 0
-            for connection_id in self.user_connections[user_id]:
-                if connection_id in self.active_connections:
-                    try:
-                        await self.active_connections[connection_id].send_message(message)
-                        self.stats['messages_sent'] += 1
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки пользователю {user_id}: {e}")
-                        failed_sends += 1
-                        self.stats['messages_failed'] += 1
-            
+            connections = [self.active_connections.get(cid) for cid in self._user_connection_ids(user_id)]
+            failed_sends = self._fan_out(connections, message)
             if failed_sends > 0:
                 logger.warning(f"Не удалось отправить {failed_sends} сообщений пользователю {user_id}")
     
     async def send_to_subscription(self, subscription: str, message: NotificationMessage):
         """Отправляет уведомление всем подписчикам"""
         if subscription in self.subscription_connections:
-            failed_sends = 0
-            for connection_id in self.subscription_connections[subscription]:
-                if connection_id in self.active_connections:
-                    try:
-                        await self.active_connections[connection_id].send_message(message)
-                        self.stats['messages_sent'] += 1
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки подписчику {connection_id}: {e}")
-                        failed_sends += 1
-                        self.stats['messages_failed'] += 1
-            
+            failed_sends = self._fan_out(self.get_subscribers(subscription), message)
             if failed_sends > 0:
                 logger.warning(f"Не удалось отправить {failed_sends} сообщений подписчикам {subscription}")
     
     async def broadcast(self, message: NotificationMessage):
         """Отправляет уведомление всем подключенным пользователям"""
-        failed_sends = 0
-        for connection in self.active_connections.values():
-            try:
-                await connection.send_message(message)
-                self.stats['messages_sent'] += 1
-            except Exception as e:
-                logger.error(f"Ошибка broadcast: {e}")
-                failed_sends += 1
-                self.stats['messages_failed'] += 1
-        
+        failed_sends = self._fan_out(self.active_connections.values(), message)
         if failed_sends > 0:
             logger.warning(f"Не удалось отправить {failed_sends} broadcast сообщений")
     
+    async def send_json_to_connection(self, connection_id: int, data: Dict[str, Any]) -> bool:
+        """Отправляет JSON конкретному соединению через его очередь"""
+        connection = self.active_connections.get(connection_id)
+        if connection is None:
+            return False
+        return self._enqueue(connection, encode_frame(data))
+    
     def get_stats(self) -> Dict[str, Any]:
         """Получает статистику WebSocket менеджера"""
+        depths = [connection.queue_depth for connection in self.active_connections.values()]
+        closed = self.lifetime_stats['closed_connections']
         return {
             **self.stats,
             'subscriptions_count': len(self.subscription_connections),
             'users_connected': len(self.user_connections),
-            'subscription_types': list(self.subscription_connections.keys())
+            'subscription_types': list(self.subscription_connections.keys()),
+            'queue_depth_total': sum(depths),
+            'queue_depth_max': max(depths, default=0),
+            'overflow_policy': self.overflow_policy,
+            'closed_connections': closed,
+            'avg_connection_lifetime_seconds': round(self.lifetime_stats['total_lifetime_seconds'] / closed, 3) if closed else 0.0,
+            'max_connection_lifetime_seconds': round(self.lifetime_stats['max_lifetime_seconds'], 3),
+            'heartbeat_interval': self.heartbeat_interval,
+            'idle_timeout': self.idle_timeout
         }
     
-    def get_connection_info(self, connection_id: str) -> Optional[Dict[str, Any]]:
+    def get_connection_info(self, connection_id: int) -> Optional[Dict[str, Any]]:
         """Получает информацию о соединении"""
         if connection_id in self.active_connections:
             connection = self.active_connections[connection_id]
             return {
                 'connection_id': connection.connection_id,
                 'user_id': connection.user_id,
-                'connected_at': connection.connected_at.isoformat(),
-                'last_activity': connection.last_activity.isoformat(),
-                'subscriptions': list(connection.subscriptions)
+                'connected_at': monotonic_to_datetime(connection.connected_at).isoformat(),
+                'last_activity': monotonic_to_datetime(connection.last_activity).isoformat(),
+                'subscriptions': list(connection.subscriptions),
+                'queue_depth': connection.queue_depth,
+                'dropped_messages': connection.dropped_messages
             }
         return None
 
@@ -239,24 +597,25 @@ async def handle_websocket_connection(websocket: WebSocket, user_id: Optional[in
         while True:
             # Получаем сообщение от клиента
             data = await websocket.receive_text()
+            websocket_manager.touch(connection_id)
             message = json.loads(data)
             
             # Обрабатываем команды
             if message.get('type') == 'subscribe':
-                subscription = message.get('subscription')
-                if subscription:
-                    await websocket_manager.subscribe(connection_id, subscription)
+                await websocket_manager.subscribe(connection_id, message.get('subscription'))
             
             elif message.get('type') == 'unsubscribe':
-                subscription = message.get('subscription')
-                if subscription:
-                    await websocket_manager.unsubscribe(connection_id, subscription)
+                await websocket_manager.unsubscribe(connection_id, message.get('subscription'))
             
             elif message.get('type') == 'ping':
-                await websocket.send_json({
+                # Ответ идет через очередь, чтобы не писать в сокет параллельно писателю
+                await websocket_manager.send_json_to_connection(connection_id, {
                     'type': 'pong',
                     'timestamp': datetime.now().isoformat()
                 })
+            
+            # 'pong' в ответ на серверный ping отдельно не обрабатывается:
+            # любое входящее сообщение уже продлевает жизнь соединения
     
     except WebSocketDisconnect:
         logger.info(f"WebSocket отключен: {connection_id}")
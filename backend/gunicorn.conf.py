@@ -0,0 +1,33 @@
+"""
+Настройки gunicorn для запуска с несколькими воркерами
+gunicorn app.main:app -c gunicorn.conf.py
+
+Метрики Prometheus всех воркеров собираются через каталог
+PROMETHEUS_MULTIPROC_DIR: переменная должна быть задана в окружении до запуска.
+
+Пул автомодерации (MODERATION_WORKERS) создается в каждом веб-воркере и
+пересоздается при каждом изменении правил: WEB_CONCURRENCY=N с
+MODERATION_WORKERS=M - это N * M дополнительных интерпретаторов. По умолчанию
+M = 0, проверка идет в потоке веб-воркера. Пул имеет смысл, только если
+проверка упирается в CPU, и N * (M + 1) не превышает числа ядер.
+"""
+
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+def on_starting(server):
+    """Очищает файлы метрик прошлого запуска"""
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+def child_exit(server, worker):
+    """Убирает live-gauge завершившегося воркера"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,22 @@
+-- Миграция 006: Порядковые номера сообщений внутри чата
+-- Нужны для докачки пропущенных сообщений после переподключения WebSocket
+
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_seq INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS seq INTEGER;
+
+-- Нумерация существующих сообщений в порядке отправки
+UPDATE chat_messages AS m
+SET seq = numbered.seq
+FROM (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY timestamp, id) AS seq
+    FROM chat_messages
+) AS numbered
+WHERE m.id = numbered.id AND m.seq IS NULL;
+
+UPDATE chats AS c
+SET last_seq = COALESCE((SELECT MAX(seq) FROM chat_messages WHERE chat_id = c.id), 0);
+
+-- Диапазонный запрос "сообщения чата после seq N"
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_messages_chat_seq ON chat_messages(chat_id, seq);
+
+COMMENT ON INDEX idx_chat_messages_chat_seq IS 'Докачка сообщений чата по порядковому номеру';
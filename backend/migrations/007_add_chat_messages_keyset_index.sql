@@ -0,0 +1,7 @@
+-- Миграция 007: Составной индекс для постраничной истории чата
+-- Страница по курсору before_id/after_id читает только limit строк индекса,
+-- вместо пропуска offset строк по отдельным индексам chat_id и timestamp
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_chat_id_id ON chat_messages(chat_id, id);
+
+COMMENT ON INDEX idx_chat_messages_chat_id_id IS 'Постраничная история чата по курсору (chat_id, id)';
@@ -0,0 +1,12 @@
+-- Миграция 008: Полнотекстовый поиск по сообщениям чата
+-- search_vector заполняется фоновым индексатором (ChatSearchIndex), а не
+-- триггером, чтобы запись сообщения не ждала построения tsvector
+
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_search_vector ON chat_messages USING GIN (search_vector);
+
+-- Очередь индексатора: только еще не проиндексированные сообщения
+CREATE INDEX IF NOT EXISTS idx_chat_messages_search_pending ON chat_messages(id) WHERE search_vector IS NULL;
+
+COMMENT ON COLUMN chat_messages.search_vector IS 'Поисковый вектор (russian + english), заполняется асинхронно';
\ No newline at end of file
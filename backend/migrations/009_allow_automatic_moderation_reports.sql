@@ -0,0 +1,6 @@
+-- Миграция 009: Жалобы, созданные автоматической модерацией
+-- Конвейер модерации создает жалобы без автора: reporter_id = NULL
+
+ALTER TABLE moderation_reports ALTER COLUMN reporter_id DROP NOT NULL;
+
+COMMENT ON COLUMN moderation_reports.reporter_id IS 'Автор жалобы; NULL - автоматическая модерация';
\ No newline at end of file
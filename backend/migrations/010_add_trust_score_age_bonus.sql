@@ -0,0 +1,9 @@
+-- Миграция 010: Инкрементально обновляемый скор доверия
+-- trust_scores обновляется по событиям модерации; бонус за возраст аккаунта
+-- хранится отдельно и начисляется ежедневным проходом (scripts/update_trust_scores.py)
+
+ALTER TABLE trust_scores ADD COLUMN IF NOT EXISTS age_bonus INTEGER DEFAULT 0;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_trust_scores_user_id ON trust_scores(user_id);
+
+COMMENT ON COLUMN trust_scores.age_bonus IS 'Бонус за возраст аккаунта (0, 10 или 30)';
@@ -0,0 +1,19 @@
+-- Миграция 011: Почасовые и суточные агрегаты статистики
+-- Счетчики увеличиваются в транзакциях исходных записей (INSERT ... ON CONFLICT),
+-- статистика модерации и рейтингов читается только из этой таблицы.
+-- Начальное заполнение: python scripts/rebuild_stat_rollups.py --days 365
+
+CREATE TABLE IF NOT EXISTS stat_rollups (
+    id SERIAL PRIMARY KEY,
+    granularity VARCHAR NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    metric VARCHAR NOT NULL,
+    dimension VARCHAR NOT NULL DEFAULT '',
+    count BIGINT NOT NULL DEFAULT 0,
+    total DOUBLE PRECISION NOT NULL DEFAULT 0
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_stat_rollups_bucket ON stat_rollups(granularity, metric, dimension, bucket_start);
+CREATE INDEX IF NOT EXISTS idx_stat_rollups_metric_time ON stat_rollups(granularity, metric, bucket_start);
+
+COMMENT ON TABLE stat_rollups IS 'Счетчики метрик за час (granularity = hour) и сутки (granularity = day)';
@@ -0,0 +1,28 @@
+-- Миграция 012: Очередь модерации с арендой жалоб
+-- Модераторы забирают жалобы через SELECT ... FOR UPDATE SKIP LOCKED,
+-- жалоба с истекшей арендой (lease_expires_at) снова попадает в выдачу
+
+ALTER TABLE moderation_reports ADD COLUMN IF NOT EXISTS score INTEGER DEFAULT 0;
+ALTER TABLE moderation_reports ADD COLUMN IF NOT EXISTS target_reports INTEGER DEFAULT 1;
+ALTER TABLE moderation_reports ADD COLUMN IF NOT EXISTS claimed_by INTEGER REFERENCES users(id);
+ALTER TABLE moderation_reports ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP;
+
+-- Число жалоб на цель для уже ожидающих жалоб
+UPDATE moderation_reports r SET target_reports = t.reports
+FROM (
+    SELECT target_type, target_id, COUNT(*) AS reports
+    FROM moderation_reports WHERE status = 'pending'
+    GROUP BY target_type, target_id
+) t
+WHERE r.status = 'pending' AND r.target_type = t.target_type AND r.target_id = t.target_id;
+
+-- Порядок выдачи; в индекс попадают только ожидающие жалобы
+CREATE INDEX IF NOT EXISTS idx_moderation_reports_queue
+    ON moderation_reports(score DESC, target_reports DESC, created_at)
+    WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_moderation_reports_target_pending
+    ON moderation_reports(target_type, target_id)
+    WHERE status = 'pending';
+
+COMMENT ON COLUMN moderation_reports.lease_expires_at IS 'Окончание аренды жалобы модератором claimed_by';
@@ -0,0 +1,24 @@
+-- Миграция 013: Версия правил модерации
+-- Процессы приложения раз в MODERATION_RULES_POLL_INTERVAL секунд читают версию
+-- и при изменении пересобирают автомат в фоне. Триггер учитывает и правки
+-- moderation_rules напрямую в базе, в обход API.
+
+CREATE TABLE IF NOT EXISTS moderation_rules_version (
+    id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+INSERT INTO moderation_rules_version (id, version) VALUES (1, 1) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_moderation_rules_version() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE moderation_rules_version SET version = version + 1, updated_at = NOW() WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_moderation_rules_version ON moderation_rules;
+CREATE TRIGGER trg_moderation_rules_version
+    AFTER INSERT OR UPDATE OR DELETE ON moderation_rules
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_moderation_rules_version();
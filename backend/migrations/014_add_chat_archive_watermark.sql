@@ -0,0 +1,13 @@
+-- Миграция 014: Граница архива чата
+-- Архиватор в одной транзакции с удалением строк записывает наибольший id,
+-- перенесенный в архив. Читатели по ней решают, нужно ли идти в архив и не
+-- устарело ли закэшированное оглавление.
+
+-- Архиватор появляется вместе с этой миграцией, поэтому у существующих чатов
+-- архива еще нет: граница 0, и чтение не обращается к оглавлению на диске
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS archived_max_id INTEGER;
+UPDATE chats SET archived_max_id = 0 WHERE archived_max_id IS NULL;
+ALTER TABLE chats ALTER COLUMN archived_max_id SET DEFAULT 0;
+ALTER TABLE chats ALTER COLUMN archived_max_id SET NOT NULL;
+
+COMMENT ON COLUMN chats.archived_max_id IS 'Наибольший id сообщения в холодном архиве (0 - архива нет)';
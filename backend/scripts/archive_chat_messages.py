@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Перенос старых сообщений чата в холодный архив
+
+Запускается по расписанию (cron) из каталога backend:
+    python scripts/archive_chat_messages.py --days 90 --max-batches 100
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.chat_archive import ChatArchiver, chat_archive
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Архивация старых сообщений чата")
+    parser.add_argument("--days", type=int, default=None, help="Возраст сообщений в днях (по умолчанию CHAT_ARCHIVE_DAYS)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Сообщений в одной транзакции")
+    parser.add_argument("--max-batches", type=int, default=None, help="Ограничение числа пакетов за запуск")
+    args = parser.parse_args()
+
+    archiver = ChatArchiver(chat_archive, batch_size=args.batch_size)
+    count = archiver.archive_older_than(args.days, args.max_batches)
+    logger.info(f"Перенесено в архив: {count}")
+    logger.info(f"Статистика архива: {chat_archive.get_stats()}")
+
+if __name__ == "__main__":
+    main()
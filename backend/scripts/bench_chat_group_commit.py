@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк записи сообщений чата: коммит на сообщение против группового коммита
+
+Пишет N сообщений во временную SQLite базу сначала по одному (как
+ChatService.send_message), затем через ChatMessageWriter, и выводит
+пропускную способность в сообщениях в секунду.
+
+Запуск из каталога backend:
+    python scripts/bench_chat_group_commit.py --messages 20000 --chats 50
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import Chat, ChatMessage
+from app.services.chat_writer import ChatMessageWriter
+
+def create_session_factory(path: str, chats: int) -> sessionmaker:
+    """Временная база с таблицами чатов (внешние ключи SQLite не проверяет)"""
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine, tables=[Chat.__table__, ChatMessage.__table__])
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    session = session_factory()
+    session.add_all([Chat(ride_id=1, user1_id=1, user2_id=2) for _ in range(chats)])
+    session.commit()
+    session.close()
+    return session_factory
+
+def write_one_by_one(session_factory: sessionmaker, messages: int, chats: int) -> float:
+    """Старый путь: UPDATE seq + INSERT + COMMIT на каждое сообщение"""
+    session = session_factory()
+    start = time.perf_counter()
+    for index in range(messages):
+        chat_id = index % chats + 1
+        seq = session.execute(
+            update(Chat).where(Chat.id == chat_id).values(last_seq=Chat.last_seq + 1).returning(Chat.last_seq)
+        ).scalar_one()
+        session.add(ChatMessage(
+            chat_id=chat_id, user_from_id=1, user_to_id=2,
+            message=f"Сообщение {index}", timestamp=datetime.utcnow(), seq=seq
+        ))
+        session.commit()
+    elapsed = time.perf_counter() - start
+    session.close()
+    return elapsed
+
+async def write_grouped(session_factory: sessionmaker, messages: int, chats: int,
+                        batch_size: int, interval_ms: float) -> float:
+    """Новый путь: submit без ожидания, запись пакетами"""
+    writer = ChatMessageWriter(session_factory, batch_size=batch_size, batch_interval_ms=interval_ms)
+    done = asyncio.Event()
+    persisted = 0
+
+    async def on_persisted(batch):
+        nonlocal persisted
+        persisted += len(batch)
+        if persisted >= messages:
+            done.set()
+
+    writer.on_persisted = on_persisted
+    start = time.perf_counter()
+    for index in range(messages):
+        writer.submit(index % chats + 1, 1, 2, f"Сообщение {index}")
+        if index % batch_size == 0:
+            # Отдаем управление, как между кадрами WebSocket
+            await asyncio.sleep(0)
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    await writer.stop()
+
+    stats = writer.get_stats()
+    print(f"Пакетов: {stats['batches']}, максимальный пакет: {stats['max_batch']}, ошибок: {stats['failed']}")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк групповой записи сообщений чата")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--interval-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        single = write_one_by_one(create_session_factory(f"{tmp}/single.db", args.chats), args.messages, args.chats)
+        grouped = asyncio.run(write_grouped(
+            create_session_factory(f"{tmp}/grouped.db", args.chats),
+            args.messages, args.chats, args.batch_size, args.interval_ms
+        ))
+
+    print(f"Сообщений: {args.messages}, чатов: {args.chats}")
+    print(f"Коммит на сообщение: {args.messages / single:.0f} сообщ/с")
+    print(f"Групповой коммит:    {args.messages / grouped:.0f} сообщ/с (цель: 5000)")
+
+if __name__ == "__main__":
+    main()
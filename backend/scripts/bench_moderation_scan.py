@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пропускной способности проверки текста модерацией
+
+Сравнивает прежнюю проверку (три регулярных выражения + отдельные проходы
+для капса и повторов) с однопроходным ModerationMatcher и выводит МБ/с
+(по объему UTF-8) для обоих вариантов.
+
+Запуск из каталога backend:
+    python scripts/bench_moderation_scan.py --messages 20000 --rounds 3
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.moderation_service import ModerationService
+
+WORDS = (
+    "привет поеду завтра утром из москвы в тверь место есть багаж небольшой "
+    "водитель опытный машина чистая встречаемся у метро напишите если удобно "
+    "hello see you at the station цена договорная спасибо хорошо до встречи"
+).split()
+FLAGGED = ["купи", "КАЗИНО", "деньги", "срочно", "бесплатно", "к@зино", "100%", "дурак", "!!!!!!"]
+
+def build_corpus(messages: int, seed: int = 42):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(messages):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(5, 40))]
+        if rng.random() < 0.2:
+            words.insert(rng.randrange(len(words)), rng.choice(FLAGGED))
+        if rng.random() < 0.05:
+            words = [word.upper() for word in words]
+        corpus.append(" ".join(words))
+    return corpus
+
+class LegacyRegexChecker:
+    """Прежняя реализация: пять проходов по каждой строке"""
+
+    def __init__(self, service: ModerationService):
+        self.spam_regex = re.compile('|'.join(service.spam_patterns), re.IGNORECASE)
+        self.toxic_regex = re.compile('|'.join(service.toxic_patterns), re.IGNORECASE)
+        self.suspicious_regex = re.compile('|'.join(service.suspicious_patterns), re.IGNORECASE)
+
+    def check(self, text: str):
+        spam = self.spam_regex.findall(text)
+        toxic = self.toxic_regex.findall(text)
+        suspicious = self.suspicious_regex.findall(text)
+        caps_ratio = sum(1 for c in text if c.isupper()) / len(text) if text else 0
+        repeated = re.findall(r'(.)\1{4,}', text)
+        return spam, toxic, suspicious, caps_ratio, repeated
+
+def measure(check, corpus, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in corpus:
+            check(text)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк проверки текста модерацией")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    service = ModerationService()
+    legacy = LegacyRegexChecker(service)
+    corpus = build_corpus(args.messages)
+    megabytes = sum(len(text.encode("utf-8")) for text in corpus) * args.rounds / 1024 / 1024
+
+    legacy_time = measure(legacy.check, corpus, args.rounds)
+    matcher_time = measure(service.matcher.scan, corpus, args.rounds)
+    full_time = measure(service.check_text_content, corpus, args.rounds)
+
+    print(f"Сообщений: {args.messages}, раундов: {args.rounds}, объем: {megabytes:.1f} МБ")
+    print(f"Регулярные выражения (5 проходов):  {megabytes / legacy_time:.1f} МБ/с")
+    print(f"ModerationMatcher.scan (1 проход):  {megabytes / matcher_time:.1f} МБ/с")
+    print(f"check_text_content целиком:         {megabytes / full_time:.1f} МБ/с")
+
+if __name__ == "__main__":
+    main()
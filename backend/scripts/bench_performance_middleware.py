@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк накладных расходов middleware производительности
+
+Сравнивает прежний PerformanceMiddleware на BaseHTTPMiddleware с ASGI
+middleware на одном и том же приложении Starlette без сети: запросы подаются
+прямо в ASGI-приложение. Обе версии пишут одинаковые метрики, поэтому
+разница - стоимость самого механизма middleware. Отдельно замеряется
+потоковый ответ из многих частей.
+
+Запуск из каталога backend:
+    python scripts/bench_performance_middleware.py --requests 20000
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from app.middleware.performance import PerformanceMiddleware
+from app.monitoring.metrics import api_metrics
+from app.monitoring.prometheus import observe_http_request
+from app.utils.logger import performance_logger
+
+STREAM_CHUNKS = 100
+
+class LegacyPerformanceMiddleware(BaseHTTPMiddleware):
+    """Прежняя реализация: BaseHTTPMiddleware, time.time(), URL как endpoint"""
+
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.time()
+        method = request.method
+        url = str(request.url)
+        user_id = request.query_params.get("user_id")
+
+        response = await call_next(request)
+        duration_ms = (time.time() - start_time) * 1000
+        performance_logger.api_request(
+            endpoint=url,
+            method=method,
+            duration_ms=duration_ms,
+            status_code=response.status_code,
+            user_id=user_id
+        )
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        api_metrics.record_request(route, method, response.status_code, duration_ms)
+        observe_http_request(method, route, response.status_code, duration_ms / 1000)
+        response.headers["X-Response-Time"] = f"{duration_ms:.2f}ms"
+        response.headers["X-Request-ID"] = str(int(start_time * 1000))
+        return response
+
+async def ride(request: Request):
+    return PlainTextResponse(request.path_params["ride_id"])
+
+async def stream(request: Request):
+    async def chunks():
+        for _ in range(STREAM_CHUNKS):
+            yield b"x" * 64
+    return StreamingResponse(chunks())
+
+def build_app(middleware=None) -> Starlette:
+    app = Starlette(routes=[
+        Route("/api/rides/{ride_id}", ride),
+        Route("/api/stream", stream)
+    ])
+    if middleware is not None:
+        app.add_middleware(middleware)
+    return app
+
+def http_scope(path: str, query_string: bytes = b"") -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query_string,
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80)
+    }
+
+async def call(app, path: str, query_string: bytes = b"") -> int:
+    """Выполняет запрос и возвращает число полученных сообщений тела
+
+    Как и настоящий сервер, после тела запроса receive ждет завершения ответа
+    и только потом сообщает об отключении клиента.
+    """
+    body_messages = 0
+    request_sent = False
+    response_complete = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal body_messages
+        if message["type"] == "http.response.body":
+            body_messages += 1
+            if not message.get("more_body", False):
+                response_complete.set()
+
+    await app(http_scope(path, query_string), receive, send)
+    return body_messages
+
+async def measure(app, requests: int, stream_requests: int):
+    # Прогрев: сборка стека middleware и маршрутов
+    await call(app, "/api/rides/1")
+
+    start = time.perf_counter()
+    for ride_id in range(requests):
+        await call(app, f"/api/rides/{ride_id}", b"user_id=7")
+    per_request = (time.perf_counter() - start) / requests
+
+    start = time.perf_counter()
+    for _ in range(stream_requests):
+        messages = await call(app, "/api/stream")
+    per_stream = (time.perf_counter() - start) / stream_requests
+    return per_request, per_stream, messages
+
+async def run(requests: int, stream_requests: int):
+    results = {}
+    for name, middleware in (("без middleware", None),
+                             ("BaseHTTPMiddleware", LegacyPerformanceMiddleware),
+                             ("ASGI middleware", PerformanceMiddleware)):
+        results[name] = await measure(build_app(middleware), requests, stream_requests)
+
+    baseline, baseline_stream, _ = results["без middleware"]
+    print(f"Запросов: {requests}, потоковых ответов: {stream_requests} по {STREAM_CHUNKS} частей")
+    for name, (per_request, per_stream, messages) in results.items():
+        print(f"{name:20} {per_request * 1e6:8.1f} мкс/запрос "
+              f"(+{(per_request - baseline) * 1e6:6.1f}), "
+              f"поток {per_stream * 1e6:8.1f} мкс (+{(per_stream - baseline_stream) * 1e6:6.1f}), "
+              f"сообщений тела: {messages}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк накладных расходов middleware производительности")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--stream-requests", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.stream_requests))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк CPU-стоимости broadcast на 1000 WebSocket соединений
+
+Сравнивает сериализацию сообщения на каждого получателя (message.json())
+с однократной сериализацией в EncodedFrame на всю рассылку.
+
+Запуск из каталога backend:
+    python scripts/bench_websocket_broadcast.py --connections 1000 --rounds 200
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.utils.websocket_manager import WebSocketManager, NotificationMessage
+
+class NullWebSocket:
+    """WebSocket-заглушка, которая ничего не отправляет"""
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+def build_message() -> NotificationMessage:
+    return NotificationMessage(
+        type="ride_update",
+        title="Изменение поездки",
+        message="Водитель изменил время отправления",
+        data={"ride_id": 12345, "from": "Москва", "to": "Тверь", "seats": [1, 2, 3], "price": 950.0},
+        user_id=None
+    )
+
+async def run(connections: int, rounds: int):
+    manager = WebSocketManager(max_queue_size=rounds + 1)
+    for user_id in range(1, connections + 1):
+        await manager.connect(NullWebSocket(), user_id)
+
+    message = build_message()
+
+    # Старый путь: сериализация на каждого получателя
+    start = time.process_time()
+    for _ in range(rounds):
+        for _connection in manager.active_connections.values():
+            message.json()
+    per_socket = (time.process_time() - start) / rounds
+
+    # Новый путь: один EncodedFrame на рассылку + постановка в очереди
+    start = time.process_time()
+    for _ in range(rounds):
+        await manager.broadcast(message)
+    per_broadcast = (time.process_time() - start) / rounds
+
+    scale = 1000 / connections
+    print(f"Соединений: {connections}, раундов: {rounds}")
+    print(f"message.json() на каждого получателя: {per_socket * scale * 1000:.3f} мс CPU на 1k соединений")
+    print(f"EncodedFrame на рассылку:             {per_broadcast * scale * 1000:.3f} мс CPU на 1k соединений")
+
+    for connection_id in list(manager.active_connections):
+        manager.disconnect(connection_id)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк CPU-стоимости broadcast")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.connections, args.rounds))
+
+if __name__ == "__main__":
+    main()
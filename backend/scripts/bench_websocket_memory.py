@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк памяти учета WebSocket соединений
+
+Регистрирует N симулированных соединений в WebSocketManager (с подписками)
+и выводит прирост RSS в пересчете на 10 000 соединений.
+
+Запуск из каталога backend:
+    python scripts/bench_websocket_memory.py --connections 50000 --topics 20
+"""
+
+import argparse
+import asyncio
+import gc
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.utils.websocket_manager import WebSocketManager
+
+def get_rss_mb() -> float:
+    """Текущий RSS процесса в МБ"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        # Без psutil читаем /proc (Linux)
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        import resource
+        return pages * resource.getpagesize() / 1024 / 1024
+
+class SimulatedWebSocket:
+    """Минимальный WebSocket: объем самого сокета не должен искажать замер"""
+
+    __slots__ = ()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+async def run(connections: int, topics: int, subscriptions_per_connection: int):
+    manager = WebSocketManager()
+    topic_names = [f"ride_updates:{index}" for index in range(topics)]
+
+    gc.collect()
+    baseline = get_rss_mb()
+
+    for index in range(connections):
+        connection = manager.register(SimulatedWebSocket(), user_id=index + 1)
+        for offset in range(subscriptions_per_connection):
+            topic = topic_names[(index + offset) % topics]
+            await manager.subscribe(connection.connection_id, topic)
+
+    # Даем писателям отправить подтверждения подписки и завершиться
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    gc.collect()
+    used = get_rss_mb() - baseline
+
+    print(f"Соединений: {connections}, тем: {topics}, подписок на соединение: {subscriptions_per_connection}")
+    print(f"Прирост RSS: {used:.1f} МБ")
+    print(f"RSS на 10k соединений: {used / connections * 10000:.2f} МБ")
+    print(f"Байт на соединение: {used * 1024 * 1024 / connections:.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк памяти WebSocket соединений")
+    parser.add_argument("--connections", type=int, default=50000)
+    parser.add_argument("--topics", type=int, default=20)
+    parser.add_argument("--subscriptions", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(run(args.connections, args.topics, args.subscriptions))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Обслуживание агрегатов статистики
+
+Пересчитывает почасовые и суточные агрегаты за последние дни из исходных
+таблиц (начальное заполнение и исправление расхождений) и удаляет почасовые
+строки старше STATS_HOURLY_RETENTION_DAYS.
+
+Запускается по расписанию (cron) из каталога backend:
+    python scripts/rebuild_stat_rollups.py --days 2
+Начальное заполнение:
+    python scripts/rebuild_stat_rollups.py --days 365
+"""
+
+import argparse
+import logging
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.database import SessionLocal
+from app.services.stats_rollup import ROLLUP_SOURCES, rollup_now, stats_rollup
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчет агрегатов статистики")
+    parser.add_argument("--days", type=int, default=2, help="Сколько последних суток пересчитать (0 - только очистка)")
+    parser.add_argument("--metric", action="append", choices=sorted(ROLLUP_SOURCES), help="Пересчитать только эти метрики")
+    parser.add_argument("--no-compact", action="store_true", help="Не удалять старые почасовые строки")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.days > 0:
+            end = rollup_now() + timedelta(days=1)
+            written = stats_rollup.rebuild(db, end - timedelta(days=args.days + 1), end, args.metric)
+            logger.info(f"Записано строк агрегатов: {written}")
+        if not args.no_compact:
+            deleted = stats_rollup.compact(db)
+            logger.info(f"Удалено почасовых строк: {deleted}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Ежедневное обновление скоров доверия
+
+Начисляет бонус за возраст аккаунтам, перешедшим пороги 30 и 90 дней.
+С --backfill сначала создает строки trust_scores для пользователей без них.
+
+Запускается по расписанию (cron) из каталога backend:
+    python scripts/update_trust_scores.py --backfill
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.database import SessionLocal
+from app.services.trust_service import trust_service
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Обновление скоров доверия пользователей")
+    parser.add_argument("--backfill", action="store_true", help="Создать строки для пользователей без скора")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Строк в одной транзакции")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.backfill:
+            created = trust_service.backfill(db, args.batch_size)
+            logger.info(f"Создано скоров доверия: {created}")
+        updated = trust_service.sweep_account_age(db, args.batch_size)
+        logger.info(f"Обновлено бонусов за возраст аккаунта: {updated}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
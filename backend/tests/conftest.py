@@ -1,3 +1,12 @@
+import os
+import tempfile
+
+# Снимки индекса дубликатов из тестов не попадают в дерево исходников
+os.environ.setdefault(
+    "NEAR_DUPLICATE_SNAPSHOT_PATH",
+    os.path.join(tempfile.mkdtemp(prefix="near-duplicates-"), "near_duplicates.bin")
+)
+
 import pytest
 import asyncio
 from typing import Generator, AsyncGenerator
@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.chat import Chat, ChatMessage
+from app.services.chat_archive import ArchiveStore, ChatArchive, ChatArchiver, LocalArchiveStore
+from app.services.chat_service import ChatService
+
+class RecordingStore(LocalArchiveStore):
+    """Локальный архив, запоминающий записанные ключи"""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.writes = []
+
+    def put(self, key, data):
+        self.writes.append(key)
+        super().put(key, data)
+
+def make_record(message_id: int, seq: int = None) -> dict:
+    return {
+        "id": message_id, "chat_id": 1, "user_from_id": 1, "user_to_id": 2,
+        "message": f"сообщение {message_id}", "is_read": True, "read_at": None,
+        "timestamp": "2024-01-15T12:00:00", "seq": seq if seq is not None else message_id
+    }
+
+def test_archive_store_is_abstract():
+    with pytest.raises(TypeError):
+        ArchiveStore()
+
+def test_batches_do_not_rewrite_full_segments(tmp_path):
+    """Заполненные сегменты месяца не переписываются следующими пакетами"""
+    store = RecordingStore(tmp_path)
+    archive = ChatArchive(store, segment_size=4)
+    for first in (1, 3, 5, 7, 9):
+        archive.write(1, "2024-01", [make_record(first), make_record(first + 1)])
+
+    segment_writes = [key for key in store.writes if not key.endswith("index.json")]
+    assert segment_writes.count("chats/1/2024-01/1.json.gz") == 2
+    assert segment_writes.count("chats/1/2024-01/5.json.gz") == 2
+    assert segment_writes.count("chats/1/2024-01/9.json.gz") == 1
+
+    assert [m.id for m in archive.read_before(1, None, 3)] == [10, 9, 8]
+    assert [m.id for m in archive.read_after(1, 3, 3)] == [4, 5, 6]
+    assert [m.seq for m in archive.read_after_seq(1, 8, 10)] == [9, 10]
+
+def test_repeated_batch_has_no_duplicates(tmp_path):
+    """Повтор пакета после сбоя до удаления строк не дублирует сообщения"""
+    archive = ChatArchive(LocalArchiveStore(tmp_path), segment_size=2)
+    archive.write(1, "2024-01", [make_record(1), make_record(2)])
+    archive.write(1, "2024-01", [make_record(3), make_record(4)])
+    archive.write(1, "2024-01", [make_record(1), make_record(2)])
+    assert [m.id for m in archive.read_before(1, None, 10)] == [4, 3, 2, 1]
+
+def test_overlapping_segments_read_in_order(tmp_path):
+    """Сообщение, позже попавшее в архив, читается в порядке id"""
+    archive = ChatArchive(LocalArchiveStore(tmp_path), segment_size=2)
+    archive.write(1, "2024-01", [make_record(1), make_record(5)])
+    archive.write(1, "2024-01", [make_record(6), make_record(7)])
+    archive.write(1, "2024-01", [make_record(3)])
+    assert [m.id for m in archive.read_before(1, None, 3)] == [7, 6, 5]
+    assert [m.id for m in archive.read_after(1, 1, 2)] == [3, 5]
+
+def test_index_refreshed_by_watermark(tmp_path):
+    """Читатель с устаревшим оглавлением видит новый сегмент по границе из базы"""
+    reader = ChatArchive(LocalArchiveStore(tmp_path), index_ttl=3600)
+    writer = ChatArchive(LocalArchiveStore(tmp_path))
+    writer.write(1, "2024-01", [make_record(1)])
+    assert [m.id for m in reader.read_before(1, None, 10)] == [1]
+
+    writer.write(1, "2024-01", [make_record(2)])
+    assert [m.id for m in reader.read_before(1, None, 10)] == [1]
+    assert [m.id for m in reader.read_before(1, None, 10, archived_max_id=2)] == [2, 1]
+
+@pytest.fixture
+def chat_service(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'chat.db'}")
+    Base.metadata.create_all(engine, tables=[Chat.__table__, ChatMessage.__table__])
+    factory = sessionmaker(bind=engine)
+    session = factory()
+    session.add(Chat(id=1, ride_id=1, user1_id=1, user2_id=2, last_seq=5))
+    old = datetime.utcnow() - timedelta(days=100)
+    for seq in range(1, 6):
+        session.add(ChatMessage(
+            id=seq, chat_id=1, user_from_id=1, user_to_id=2, message=f"сообщение {seq}",
+            is_read=True, seq=seq, timestamp=old if seq <= 3 else datetime.utcnow()
+        ))
+    session.commit()
+    session.close()
+
+    archive = ChatArchive(LocalArchiveStore(tmp_path / "archive"))
+    assert ChatArchiver(archive, session_factory=factory).archive_older_than(days=90) == 3
+
+    service = ChatService()
+    service.archive = archive
+    service._db_session = factory()
+    yield service
+    service._db_session.close()
+    service._db_session = None
+    engine.dispose()
+
+def test_archiver_moves_watermark(chat_service):
+    assert chat_service.get_archived_max_id(1) == 3
+    assert chat_service.db.query(ChatMessage).count() == 2
+
+def test_resume_falls_through_to_archive(chat_service):
+    """Докачка по seq возвращает и архивные сообщения"""
+    assert [m.seq for m in chat_service.get_messages_since(1, 1, after_seq=1)] == [2, 3, 4, 5]
+    assert [m.seq for m in chat_service.get_messages_since(1, 1, after_seq=3)] == [4, 5]
+    assert [m.seq for m in chat_service.get_messages_since(1, 1, after_seq=0, limit=2)] == [1, 2]
+
+def test_history_falls_through_to_archive(chat_service):
+    assert [m.id for m in chat_service.get_messages(1, 2, limit=10)] == [5, 4, 3, 2, 1]
+    assert [m.id for m in chat_service.get_messages(1, 2, limit=2, before_id=4)] == [3, 2]
+
+def test_cursor_above_watermark_skips_archive(chat_service):
+    """Курсор after_id выше границы архива не обращается к хранилищу"""
+    class ForbiddenStore(ArchiveStore):
+        def get(self, key):
+            raise AssertionError(f"обращение к архиву: {key}")
+
+        def put(self, key, data):
+            raise AssertionError(f"запись в архив: {key}")
+
+    chat_service.archive = ChatArchive(ForbiddenStore())
+    assert [m.id for m in chat_service.get_messages(1, 2, limit=10, after_id=3)] == [5, 4]
+    assert [m.id for m in chat_service.get_messages(1, 2, limit=10, after_id=4)] == [5]
+
+def test_cursor_below_watermark_reads_archive(chat_service):
+    assert [m.id for m in chat_service.get_messages(1, 2, limit=10, after_id=1)] == [5, 4, 3, 2]
@@ -0,0 +1,48 @@
+import asyncio
+import json
+import time
+
+from app.api import chat
+from app.api.chat import ConnectionManager
+
+class FakeWebSocket:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.sent = []
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+def test_slow_client_does_not_stall_heartbeat(monkeypatch):
+    """Зависший клиент отключается по таймауту, остальные получают ping без ожидания"""
+    monkeypatch.setattr(chat.settings, "websocket_send_timeout", 0.2)
+
+    async def scenario():
+        manager = ConnectionManager()
+        manager.start_heartbeat = lambda: None
+        slow = FakeWebSocket(delay=60)
+        fast = [FakeWebSocket() for _ in range(5)]
+        await manager.connect(slow, 1)
+        for user_id, websocket in enumerate(fast, start=2):
+            await manager.connect(websocket, user_id)
+
+        now = time.monotonic() + chat.settings.websocket_heartbeat_interval + 1
+        started = asyncio.get_running_loop().time()
+        await manager.heartbeat(now=now)
+        elapsed = asyncio.get_running_loop().time() - started
+        return manager, slow, fast, elapsed
+
+    manager, slow, fast, elapsed = asyncio.run(scenario())
+    assert elapsed < 1.0
+    assert all(websocket.sent == [{"type": "ping"}] for websocket in fast)
+    assert slow.closed and 1 not in manager.active_connections
+    assert manager.stats['pings_sent'] == 5
+    assert manager.stats['ping_timeouts'] == 1
@@ -0,0 +1,37 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.chat import Chat
+from app.services.chat_service import ChatMembershipCache, ChatService
+
+def test_membership_cache_lru():
+    cache = ChatMembershipCache(max_size=2)
+    cache.put(1, 10, 20)
+    cache.put(2, 10, 30)
+    assert cache.get(1) == (10, 20)
+    cache.put(3, 10, 40)
+    # Вытесняется давно не использованный чат 2
+    assert cache.get(2) is None
+    assert cache.get(1) == (10, 20)
+    cache.invalidate_many([1, 3])
+    assert cache.get_stats()['size'] == 0
+
+def test_warm_up_does_not_evict_other_users():
+    """Прогрев одного пользователя занимает не больше десятой части кэша"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[Chat.__table__])
+    session = sessionmaker(bind=engine)()
+    session.add_all([Chat(id=chat_id, ride_id=1, user1_id=1, user2_id=chat_id + 1) for chat_id in range(1, 301)])
+    session.commit()
+
+    service = ChatService()
+    service._db_session = session
+    service.membership_cache = ChatMembershipCache(max_size=100)
+    service.membership_cache.put(1000, 5, 6)
+    try:
+        assert service.warm_membership_cache(1) == 10
+        assert service.membership_cache.get(1000) == (5, 6)
+    finally:
+        service._db_session = None
+        session.close()
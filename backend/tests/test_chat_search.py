@@ -0,0 +1,70 @@
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.chat import Chat, ChatMessage
+from app.services.chat_search import ChatSearchIndex, SearchUnavailableError
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Base.metadata.create_all(engine, tables=[Chat.__table__, ChatMessage.__table__])
+    factory = sessionmaker(bind=engine)
+    session = factory()
+    session.add(Chat(id=1, ride_id=1, user1_id=1, user2_id=2))
+    session.commit()
+    session.close()
+    yield factory
+    engine.dispose()
+
+def add_message(factory, message_id: int, text_value: str):
+    session = factory()
+    session.add(ChatMessage(id=message_id, chat_id=1, user_from_id=1, user_to_id=2, message=text_value))
+    session.commit()
+    session.close()
+
+def found_ids(index: ChatSearchIndex, query: str):
+    return {row["id"] for row in index.search(1, query)["results"]}
+
+def test_late_committed_lower_id_is_indexed(session_factory):
+    """Сообщение с меньшим id, закоммиченное после проиндексированного, попадает в поиск"""
+    add_message(session_factory, 1, "встречаемся у вокзала")
+    index = ChatSearchIndex(session_factory, batch_size=10, interval=1)
+    assert index.index_pending() == 1
+
+    add_message(session_factory, 5, "вокзал через час")
+    assert index.index_pending() == 1
+    add_message(session_factory, 3, "опоздаю к вокзалу")
+    assert index.index_pending() == 1
+    assert index.index_pending() == 0
+    assert found_ids(index, "вокзалу") == {3}
+    assert found_ids(index, "вокзал") == {5}
+
+def test_existing_messages_queued_on_first_run(session_factory):
+    add_message(session_factory, 1, "первое сообщение")
+    add_message(session_factory, 2, "второе сообщение")
+    index = ChatSearchIndex(session_factory, batch_size=1, interval=1)
+    assert index.index_pending() == 1
+    assert index.index_pending() == 1
+    assert index.index_pending() == 0
+    assert found_ids(index, "сообщение") == {1, 2}
+
+def test_missing_postgres_column_disables_search(tmp_path, caplog):
+    """Без миграции 008 индексатор предупреждает один раз и отключается"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'pg.db'}")
+
+    @event.listens_for(engine, "connect")
+    def attach_information_schema(dbapi_connection, connection_record):
+        dbapi_connection.execute("ATTACH DATABASE ':memory:' AS information_schema")
+        dbapi_connection.execute("CREATE TABLE information_schema.columns (table_name TEXT, column_name TEXT)")
+
+    index = ChatSearchIndex(sessionmaker(bind=engine), batch_size=10, interval=1)
+    index._dialect = lambda session: "postgresql"
+    assert index.index_pending() == 0
+    assert index.index_pending() == 0
+    assert index.available is False
+    with pytest.raises(SearchUnavailableError):
+        index.search(1, "вокзал")
+    assert sum("search_vector" in record.getMessage() for record in caplog.records) == 1
+    engine.dispose()
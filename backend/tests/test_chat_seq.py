@@ -0,0 +1,92 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.chat import Chat, ChatMessage
+from app.services.chat_archive import ArchiveStore, ChatArchive
+from app.services.chat_service import ChatService
+
+class ForbiddenStore(ArchiveStore):
+    def get(self, key):
+        raise AssertionError(f"обращение к архиву: {key}")
+
+    def put(self, key, data):
+        raise AssertionError(f"запись в архив: {key}")
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'seq.db'}")
+    Base.metadata.create_all(engine, tables=[Chat.__table__, ChatMessage.__table__])
+    factory = sessionmaker(bind=engine)
+    session = factory()
+    session.add_all([
+        Chat(id=1, ride_id=1, user1_id=1, user2_id=2, archived_max_id=0),
+        Chat(id=2, ride_id=1, user1_id=1, user2_id=3, archived_max_id=0)
+    ])
+    session.commit()
+    session.close()
+    yield factory
+    engine.dispose()
+
+def make_service(factory):
+    service = ChatService()
+    service.archive = ChatArchive(ForbiddenStore())
+    service._db_session = factory()
+    return service
+
+def add_messages(service, chat_id, count):
+    for _ in range(count):
+        seq = service.allocate_seq(chat_id)
+        service.db.add(ChatMessage(chat_id=chat_id, user_from_id=1, user_to_id=2, message=f"сообщение {seq}", seq=seq))
+        service.db.commit()
+
+def test_seq_per_chat(session_factory):
+    service = make_service(session_factory)
+    assert [service.allocate_seq(1) for _ in range(3)] == [1, 2, 3]
+    assert service.allocate_seq(2) == 1
+    # Пакет из count номеров: возвращается последний
+    assert service.allocate_seq(1, count=4) == 7
+    service.db.commit()
+    assert service.db.get(Chat, 1).last_seq == 7
+    assert service.db.get(Chat, 2).last_seq == 1
+
+def test_rolled_back_seq_is_reused(session_factory):
+    """Откат отправки возвращает номер: в последовательности чата нет дыр"""
+    service = make_service(session_factory)
+    assert service.allocate_seq(1) == 1
+    service.db.commit()
+    assert service.allocate_seq(1) == 2
+    service.db.rollback()
+    assert service.allocate_seq(1) == 2
+
+def test_sessions_continue_committed_seq(session_factory):
+    first, second = make_service(session_factory), make_service(session_factory)
+    assert first.allocate_seq(1) == 1
+    first.db.commit()
+    assert second.allocate_seq(1) == 2
+    second.db.commit()
+    assert first.allocate_seq(1) == 3
+
+def test_resume_from_hot_rows(session_factory):
+    """Докачка без архива читает только горячие строки по (chat_id, seq)"""
+    service = make_service(session_factory)
+    add_messages(service, 1, 5)
+    add_messages(service, 2, 2)
+    assert [m.seq for m in service.get_messages_since(1, 1, after_seq=2)] == [3, 4, 5]
+    assert [m.seq for m in service.get_messages_since(1, 2, after_seq=0, limit=2)] == [1, 2]
+    assert service.get_messages_since(1, 1, after_seq=5) == []
+    assert [m.chat_id for m in service.get_messages_since(2, 3, after_seq=0)] == [2, 2]
+
+def test_resume_requires_membership(session_factory):
+    service = make_service(session_factory)
+    with pytest.raises(ValueError):
+        service.get_messages_since(1, 3, after_seq=0)
+
+def test_history_without_archive_skips_store(session_factory):
+    """Чат с границей 0 (в том числе после миграции 014) не читает оглавление архива"""
+    service = make_service(session_factory)
+    add_messages(service, 1, 3)
+    assert [m.id for m in service.get_messages(1, 1, limit=10)] == [3, 2, 1]
+    assert [m.id for m in service.get_messages(1, 1, limit=10, before_id=2)] == [1]
+    assert [m.id for m in service.get_messages(1, 1, limit=10, after_id=1)] == [3, 2]
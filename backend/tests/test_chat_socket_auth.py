@@ -0,0 +1,59 @@
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.models.user import User
+from app.services.chat_service import chat_service
+from app.utils.jwt_auth import jwt_auth
+
+@pytest.fixture
+def users(db_session):
+    owner = User(telegram_id="5001", phone="+79000000001", full_name="Владелец", birth_date=date(1990, 1, 1), city="Москва")
+    other = User(telegram_id="5002", phone="+79000000002", full_name="Другой", birth_date=date(1990, 1, 1), city="Москва")
+    db_session.add_all([owner, other])
+    db_session.commit()
+    return owner, other
+
+@pytest.fixture
+def history_calls(monkeypatch):
+    """Запросы истории и докачки, дошедшие до сервиса чатов"""
+    calls = []
+    monkeypatch.setattr(chat_service, "warm_membership_cache", lambda user_id: 0)
+    monkeypatch.setattr(chat_service, "get_messages", lambda *args, **kwargs: calls.append(args) or [])
+    monkeypatch.setattr(chat_service, "get_messages_since", lambda *args, **kwargs: calls.append(args) or [])
+    return calls
+
+def token_for(user: User) -> str:
+    return jwt_auth.create_token_pair(user.id, user.telegram_id)["access_token"]
+
+def assert_rejected(client: TestClient, url: str):
+    with pytest.raises(WebSocketDisconnect) as error:
+        with client.websocket_connect(url) as websocket:
+            websocket.send_json({"type": "history", "chat_id": 1, "limit": 10})
+            websocket.receive_json()
+    assert error.value.code == 1008
+
+def test_socket_without_token_gets_no_history(client: TestClient, users, history_calls):
+    owner, _ = users
+    assert_rejected(client, f"/api/chat/ws/{owner.id}")
+    assert_rejected(client, f"/api/chat/ws/{owner.id}?token=invalid")
+    assert history_calls == []
+
+def test_socket_with_foreign_token_gets_no_history(client: TestClient, users, history_calls):
+    """Чужой действительный токен не открывает сокет владельца user_id"""
+    owner, other = users
+    assert_rejected(client, f"/api/chat/ws/{owner.id}?token={token_for(other)}")
+    assert history_calls == []
+
+def test_owner_socket_serves_history(client: TestClient, users, history_calls):
+    owner, _ = users
+    with client.websocket_connect(f"/api/chat/ws/{owner.id}?token={token_for(owner)}") as websocket:
+        websocket.send_json({"type": "history", "chat_id": 1, "limit": 10})
+        assert websocket.receive_json() == {"type": "history", "chat_id": 1, "messages": [], "has_more": False}
+        websocket.send_json({"type": "resume", "chats": {"1": 3}})
+        assert websocket.receive_json() == {
+            "type": "resume_complete", "chats": {"1": {"last_seq": 3, "count": 0, "has_more": False}}
+        }
+    assert history_calls == [(1, owner.id, 11), (1, owner.id, 3)]
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.chat import Chat, ChatMessage
+from app.services.chat_writer import ChatMessageWriter, ChatWriterOverloadedError
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """SQLite с рабочими SAVEPOINT (pysqlite сам открывает транзакции)"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'chat.db'}", connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def do_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    Base.metadata.create_all(engine, tables=[Chat.__table__, ChatMessage.__table__])
+    factory = sessionmaker(bind=engine)
+    session = factory()
+    session.add_all([Chat(id=1, ride_id=1, user1_id=1, user2_id=2), Chat(id=2, ride_id=1, user1_id=1, user2_id=3)])
+    session.commit()
+    session.close()
+    yield factory
+    engine.dispose()
+
+def test_stop_flushes_batch_in_progress(session_factory):
+    """Остановка посреди набора пакета записывает все принятые сообщения"""
+    async def scenario():
+        writer = ChatMessageWriter(session_factory, batch_size=100, batch_interval_ms=10000)
+        persisted = []
+
+        async def on_persisted(batch):
+            persisted.extend(batch)
+
+        writer.on_persisted = on_persisted
+        messages = [writer.submit(1, 1, 2, f"сообщение {i}") for i in range(5)]
+        # Писатель вынул сообщения в пакет и ждет добора до batch_size
+        await asyncio.sleep(0.05)
+        assert writer.queue.empty()
+        messages += [writer.submit(1, 1, 2, "последнее")]
+        await writer.stop()
+        return messages, persisted
+
+    messages, persisted = asyncio.run(scenario())
+    assert len(persisted) == 6
+    assert all(pending.error is None for pending in messages)
+    assert [pending.seq for pending in messages] == [1, 2, 3, 4, 5, 6]
+
+    session = session_factory()
+    try:
+        assert session.query(ChatMessage).count() == 6
+        assert session.get(Chat, 1).last_seq == 6
+    finally:
+        session.close()
+
+def test_missing_chat_does_not_fail_batch(session_factory):
+    """Сообщения удаленного чата помечаются ошибкой, остальные чаты пакета записываются"""
+    writer = ChatMessageWriter(session_factory)
+    async def submit_all():
+        return [
+            writer.submit(1, 1, 2, "первый чат"),
+            writer.submit(404, 1, 5, "удаленный чат"),
+            writer.submit(2, 1, 3, "второй чат")
+        ]
+
+    async def scenario():
+        batch = await submit_all()
+        await writer.stop()
+        return batch
+
+    first, missing, second = asyncio.run(scenario())
+    assert first.error is None and first.message_id is not None and first.seq == 1
+    assert second.error is None and second.message_id is not None and second.seq == 1
+    assert missing.error is not None and missing.message_id is None and missing.seq is None
+    assert writer.stats['persisted'] == 2
+    assert writer.stats['failed'] == 1
+
+    session = session_factory()
+    try:
+        assert session.query(ChatMessage).count() == 2
+    finally:
+        session.close()
+
+def test_full_queue_rejects_messages(session_factory):
+    """Заполненная очередь отклоняет сообщение, а не копит его в памяти"""
+    async def scenario():
+        writer = ChatMessageWriter(session_factory, batch_size=100, batch_interval_ms=10000, queue_size=2)
+        # Писатель еще не успел вынуть сообщения: очередь заполнена
+        accepted = [writer.submit(1, 1, 2, "первое"), writer.submit(1, 1, 2, "второе")]
+        with pytest.raises(ChatWriterOverloadedError):
+            writer.submit(1, 1, 2, "третье")
+        await writer.stop()
+        return writer, accepted
+
+    writer, accepted = asyncio.run(scenario())
+    assert writer.stats['rejected'] == 1
+    assert [pending.seq for pending in accepted] == [1, 2]
+
+    session = session_factory()
+    try:
+        assert session.query(ChatMessage).count() == 2
+    finally:
+        session.close()
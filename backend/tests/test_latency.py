@@ -0,0 +1,110 @@
+import math
+import random
+
+import pytest
+
+from app.monitoring.latency import LatencyHistogram, LatencyHistograms
+
+def exact_quantile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def histogram_of(values, relative_error=0.01):
+    histogram = LatencyHistogram(relative_error)
+    for value in values:
+        histogram.record(value)
+    return histogram
+
+@pytest.fixture
+def samples():
+    rng = random.Random(42)
+    return [rng.lognormvariate(3, 1.2) for _ in range(5000)]
+
+def test_quantiles_within_relative_error(samples):
+    histogram = histogram_of(samples)
+    for fraction in (0.5, 0.9, 0.99, 0.999):
+        exact = exact_quantile(samples, fraction)
+        assert histogram.quantile(fraction) == pytest.approx(exact, rel=0.011)
+    assert histogram.quantile(0) == min(samples)
+    assert histogram.quantile(1) == pytest.approx(max(samples), rel=0.011)
+
+def test_merge_equals_histogram_of_union(samples):
+    """Сумма гистограмм воркеров дает те же квантили, что общая гистограмма"""
+    first, second = histogram_of(samples[:1000]), histogram_of(samples[1000:])
+    first.merge(second)
+    combined = histogram_of(samples)
+    assert first.buckets == combined.buckets
+    assert first.count == combined.count
+    assert first.summary() == combined.summary()
+
+def test_merge_rejects_different_precision():
+    with pytest.raises(ValueError):
+        LatencyHistogram(0.01).merge(LatencyHistogram(0.02))
+
+def test_add_buckets_and_serialization(samples):
+    histogram = histogram_of(samples)
+    restored = LatencyHistogram.from_dict(histogram.to_dict())
+    assert restored.summary() == histogram.summary()
+
+    # Из Redis приходят только корзины и сумма: границы берутся по корзинам
+    rebuilt = LatencyHistogram()
+    rebuilt.add_buckets(histogram.buckets, histogram.sum)
+    assert rebuilt.count == histogram.count
+    assert rebuilt.quantile(0.99) == pytest.approx(histogram.quantile(0.99), rel=0.011)
+
+def test_empty_and_out_of_range():
+    histogram = LatencyHistogram()
+    assert histogram.quantile(0.5) is None
+    assert histogram.summary()["count"] == 0
+    histogram.record(-5)
+    histogram.record(10 ** 9)
+    assert histogram.count == 2
+    assert max(histogram.buckets) == histogram.index(10 * 60 * 1000)
+
+class FakeBackend:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.buckets = {}
+
+    def push(self, deltas):
+        if self.fail:
+            raise ConnectionError("Redis недоступен")
+        for key, histogram in deltas.items():
+            merged = self.buckets.setdefault(key, LatencyHistogram())
+            merged.merge(histogram)
+
+    def read(self):
+        return {key: (dict(histogram.buckets), histogram.sum) for key, histogram in self.buckets.items()}
+
+def make_histograms(backend):
+    histograms = LatencyHistograms()
+    histograms.backend = backend
+    return histograms
+
+def test_workers_merge_through_backend():
+    """Сводная гистограмма включает сброшенные приращения всех воркеров и свои несброшенные"""
+    backend = FakeBackend()
+    first, second = make_histograms(backend), make_histograms(backend)
+    for value in (10, 20, 30):
+        first.record("GET", "/api/rides", 200, value)
+    second.record("GET", "/api/rides", 200, 40)
+    first.flush()
+    second.flush()
+    first.record("GET", "/api/rides", 200, 50)
+
+    merged = first.snapshot()[("GET", "/api/rides", "2xx")]
+    assert merged.count == 5
+    assert second.snapshot()[("GET", "/api/rides", "2xx")].count == 4
+    assert first.snapshot(merged=False)[("GET", "/api/rides", "2xx")].count == 4
+
+def test_failed_flush_keeps_deltas():
+    histograms = make_histograms(FakeBackend(fail=True))
+    histograms.record("POST", "/api/chat/{chat_id}/messages", 201, 12)
+    histograms.flush()
+    assert histograms.stats['flush_errors'] == 1
+    assert histograms.pending[("POST", "/api/chat/{chat_id}/messages", "2xx")].count == 1
+
+    histograms.backend.fail = False
+    histograms.flush()
+    assert histograms.pending == {}
+    assert histograms.snapshot()[("POST", "/api/chat/{chat_id}/messages", "2xx")].count == 1
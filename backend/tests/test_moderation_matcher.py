@@ -0,0 +1,63 @@
+import re
+
+import pytest
+
+from app.services.moderation_service import ModerationService
+from app.utils.moderation_matcher import ModerationMatcher, normalize, tokenize
+
+WORD_LISTS = {
+    "spam": [r"\b(купить|скидка)\b", "бесплатно"],
+    "toxic": ["дурак"]
+}
+
+@pytest.fixture
+def matcher():
+    return ModerationMatcher.build(WORD_LISTS, rules=[(7, "пиши в телеграм"), (8, r"\d{3}-\d{2}-\d{2}")])
+
+def test_normalize_lookalikes():
+    """Латинские двойники и leetspeak приводятся к кириллице"""
+    assert normalize("CKИДKA") == "скидка"
+    assert tokenize("Д0РОГ0!!") == ("дорого", "!!")
+
+def test_word_lists_and_rules(matcher):
+    result = matcher.scan("Купить со СКИДKОЙ? Нет, скидка тут. Пиши в телеграм, дурак")
+    assert result.matches["spam"] == ["Купить", "скидка"]
+    assert result.matches["toxic"] == ["дурак"]
+    assert result.matches["rule:7"] == ["Пиши в телеграм"]
+
+def test_regex_rule(matcher):
+    assert matcher.scan("звони 123-45-67").regex_matches == {"rule:8": ["123-45-67"]}
+
+def test_caps_ratio(matcher):
+    assert matcher.scan("ВСЕ СЮДА").caps_ratio == pytest.approx(7 / 8)
+    assert matcher.scan("все сюда").caps_ratio == 0
+
+@pytest.mark.parametrize("text", [
+    "Пооооока",
+    "ну!!!!! когда",
+    "пробелы     между словами",
+    "аааааа и еще ббббб",
+    "Zzzzzz"
+])
+def test_repeated_chars_match_legacy(matcher, text):
+    """Повторы ищутся так же, как прежняя проверка (.)\\1{4,} по исходному тексту"""
+    assert matcher.scan(text).repeated == re.findall(r"(.)\1{4,}", text)
+    assert matcher.scan(text).repeated
+
+def test_no_false_repeats(matcher):
+    assert matcher.scan("Выезжаем в 10:00, место есть").repeated == []
+
+def test_builtin_regex_pattern_counts_for_category():
+    """Встроенный шаблон, который не сводится к словам, учитывается в своей категории"""
+    service = ModerationService()
+    service.spam_patterns = service.spam_patterns + [r"\+7\d{10}"]
+    service.rule_set = service.compile_rule_set(0, {})
+
+    scan = service.matcher.scan("мой номер +79001234567")
+    assert scan.matches == {}
+    assert scan.labeled("spam") == ["+79001234567"]
+
+    result = service.check_text_content("мой номер +79001234567")
+    assert [violation["type"] for violation in result["violations"]] == ["spam"]
+    assert result["violations"][0]["matches"] == ["+79001234567"]
+    assert result["score"] == 50
@@ -0,0 +1,95 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.models.moderation import ModerationReport
+from app.models.user import User
+from app.services.moderation_service import moderation_service
+
+def add_reports(factory, *reports):
+    session = factory()
+    created = datetime.now() - timedelta(hours=1)
+    for offset, (report_id, score, target_reports) in enumerate(reports):
+        session.add(ModerationReport(
+            id=report_id, reporter_id=None, target_type="message", target_id=report_id,
+            reason="spam", status="pending", score=score, target_reports=target_reports,
+            created_at=created + timedelta(minutes=offset)
+        ))
+    session.commit()
+    session.close()
+
+def make_factory(url):
+    engine = create_engine(url)
+    tables = [User.__table__, ModerationReport.__table__]
+    ModerationReport.metadata.drop_all(engine, tables=tables)
+    ModerationReport.metadata.create_all(engine, tables=tables)
+    return engine, sessionmaker(bind=engine)
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine, factory = make_factory(f"sqlite:///{tmp_path / 'queue.db'}")
+    yield factory
+    engine.dispose()
+
+def claim(factory, moderator_id, limit=10, lease_seconds=None):
+    session = factory()
+    try:
+        return [report.id for report in moderation_service.claim_reports(session, moderator_id, limit, lease_seconds)]
+    finally:
+        session.close()
+
+def test_claim_order_by_priority(session_factory):
+    """Сначала скор автомодерации, затем число жалоб на цель, затем возраст"""
+    add_reports(session_factory, (1, 0, 1), (2, 50, 1), (3, 0, 4), (4, 50, 2), (5, 0, 1))
+    assert claim(session_factory, moderator_id=10) == [4, 2, 3, 1, 5]
+
+def test_moderators_get_disjoint_reports(session_factory):
+    add_reports(session_factory, (1, 10, 1), (2, 20, 1), (3, 30, 1))
+    assert claim(session_factory, moderator_id=10, limit=2) == [3, 2]
+    assert claim(session_factory, moderator_id=20, limit=2) == [1]
+    assert claim(session_factory, moderator_id=30) == []
+
+def test_expired_lease_returns_to_queue(session_factory):
+    add_reports(session_factory, (1, 10, 1))
+    assert claim(session_factory, moderator_id=10, lease_seconds=1) == [1]
+    assert claim(session_factory, moderator_id=20) == []
+
+    session = session_factory()
+    session.query(ModerationReport).update({ModerationReport.lease_expires_at: datetime.now() - timedelta(seconds=1)})
+    session.commit()
+    session.close()
+
+    assert claim(session_factory, moderator_id=20) == [1]
+    session = session_factory()
+    try:
+        with pytest.raises(ValueError):
+            moderation_service.extend_lease(session, 1, moderator_id=10)
+        moderation_service.release_report(session, 1, moderator_id=20)
+    finally:
+        session.close()
+    assert claim(session_factory, moderator_id=10) == [1]
+
+@pytest.fixture
+def postgres_factory():
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url or not url.startswith("postgresql"):
+        pytest.skip("TEST_DATABASE_URL (PostgreSQL) не задан")
+    engine, factory = make_factory(url)
+    yield factory
+    ModerationReport.metadata.drop_all(engine, tables=[ModerationReport.__table__, User.__table__])
+    engine.dispose()
+
+def test_locked_rows_are_skipped(postgres_factory):
+    """Строка, заблокированная другой транзакцией, пропускается, а не ждет ее завершения"""
+    add_reports(postgres_factory, (1, 30, 1), (2, 20, 1), (3, 10, 1))
+    holder = postgres_factory()
+    try:
+        holder.execute(text("SELECT id FROM moderation_reports WHERE id = 1 FOR UPDATE"))
+        assert claim(postgres_factory, moderator_id=10, limit=2) == [2, 3]
+    finally:
+        holder.rollback()
+        holder.close()
+    assert claim(postgres_factory, moderator_id=20) == [1]
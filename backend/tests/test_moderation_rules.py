@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.models.moderation import ModerationRule, ModerationRulesVersion
+from app.services import auth_service, moderation_pipeline as pipeline_module
+from app.services.auth_service import get_admin_user
+from app.services.moderation_service import moderation_service
+from app.utils.moderation_matcher import UnsafePatternError, check_rule_pattern
+
+@pytest.mark.parametrize("pattern", [
+    r"спам|реклама",
+    r"\b(казино|ставки)\b",
+    r"\d{3}-\d{2}-\d{2}",
+    r"продам\s+\w+"
+])
+def test_rule_pattern_accepted(pattern):
+    """Обычные шаблоны проходят проверку"""
+    check_rule_pattern(pattern, max_length=300, timeout=5.0)
+
+@pytest.mark.parametrize("pattern", [
+    "",
+    "x" * 301,
+    r"[",
+    r".*",
+    r"\w"
+])
+def test_rule_pattern_rejected_without_trial(pattern):
+    """Пустые, длинные, некорректные и совпадающие с любым текстом шаблоны отклоняются"""
+    with pytest.raises(UnsafePatternError):
+        check_rule_pattern(pattern, max_length=300, timeout=5.0)
+
+@pytest.mark.parametrize("pattern", [r"(a+)+$", r"^(\w+\s?)+$"])
+def test_rule_pattern_redos_rejected(pattern):
+    """Шаблон с катастрофическим перебором не укладывается в пробный прогон"""
+    with pytest.raises(UnsafePatternError):
+        check_rule_pattern(pattern, max_length=300, timeout=0.5)
+
+def test_bump_rules_version_upsert():
+    """Версия правил создается и увеличивается одним upsert"""
+    engine = create_engine("sqlite://")
+    ModerationRulesVersion.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        assert moderation_service.get_rules_version(session) == 0
+        moderation_service.bump_rules_version(session)
+        moderation_service.bump_rules_version(session)
+        session.commit()
+        assert moderation_service.get_rules_version(session) == 2
+        assert session.query(ModerationRulesVersion).count() == 1
+    finally:
+        session.close()
+
+def test_rules_hot_reload(monkeypatch):
+    """Процесс подхватывает изменения правил по версии, не перечитывая их без изменений"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    ModerationRule.metadata.create_all(engine, tables=[ModerationRule.__table__, ModerationRulesVersion.__table__])
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(pipeline_module, "SessionLocal", factory)
+    monkeypatch.setattr(moderation_service, "rule_set", moderation_service.compile_rule_set(0, {}))
+    pipeline = pipeline_module.ModerationPipeline()
+    text = "пиши в дискорд"
+
+    assert pipeline._compile_if_changed() is None
+    session = factory()
+    try:
+        rule = moderation_service.create_rule(session, "discord", "дискорд", "flag", severity="high")
+        rule_set = pipeline._compile_if_changed()
+        assert rule_set.version == 1
+        # До применения нового набора процесс проверяет по старым правилам
+        assert moderation_service.check_text_content(text)["clean"]
+        asyncio.run(pipeline.apply_rule_set(rule_set))
+        violations = moderation_service.check_text_content(text)["violations"]
+        assert [violation["rule_id"] for violation in violations] == [rule.id]
+        assert pipeline._compile_if_changed() is None
+        assert pipeline.stats['rule_reloads'] == 1
+
+        moderation_service.update_rule(session, rule.id, is_active=False)
+        asyncio.run(pipeline.apply_rule_set(pipeline._compile_if_changed()))
+        assert moderation_service.rule_set.version == 2
+        assert moderation_service.check_text_content(text)["clean"]
+    finally:
+        session.close()
+        engine.dispose()
+
+def test_admin_user_allowlist(monkeypatch):
+    """Права администратора только у Telegram ID из ADMIN_TELEGRAM_IDS"""
+    monkeypatch.setattr(auth_service.settings, "admin_telegram_ids", "111, 222")
+
+    class FakeUser:
+        id = 1
+        telegram_id = "222"
+
+    assert get_admin_user(FakeUser()) is not None
+    FakeUser.telegram_id = "333"
+    with pytest.raises(HTTPException) as error:
+        get_admin_user(FakeUser())
+    assert error.value.status_code == 403
+
+def test_create_rule_requires_auth(client: TestClient):
+    """Создание правила без токена запрещено"""
+    response = client.post("/api/moderation/rules", json={
+        "name": "all", "pattern": ".*", "action": "block", "severity": "high"
+    })
+    assert response.status_code in [401, 403]
@@ -0,0 +1,36 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services import auth_service
+from app.services.auth_service import get_current_user
+
+class FakeUser:
+    id = 1
+    telegram_id = "111"
+
+@pytest.fixture
+def as_user(client: TestClient, monkeypatch):
+    """Клиент от имени пользователя; admin=True добавляет его в ADMIN_TELEGRAM_IDS"""
+    def login(admin: bool) -> TestClient:
+        monkeypatch.setattr(auth_service.settings, "admin_telegram_ids", "111" if admin else "222")
+        app.dependency_overrides[get_current_user] = lambda: FakeUser()
+        return client
+    return login
+
+def test_db_queries_requires_auth(client: TestClient):
+    assert client.get("/api/monitoring/db-queries").status_code in [401, 403]
+
+def test_db_queries_admin_only(as_user):
+    assert as_user(admin=False).get("/api/monitoring/db-queries").status_code == 403
+    assert as_user(admin=True).get("/api/monitoring/db-queries").status_code == 200
+
+def test_slow_queries_admin_only(as_user):
+    """Планы запросов читает и журнал очищает только администратор"""
+    client = as_user(admin=False)
+    assert client.get("/api/monitoring/slow-queries").status_code == 403
+    assert client.delete("/api/monitoring/slow-queries").status_code == 403
+
+    client = as_user(admin=True)
+    assert client.get("/api/monitoring/slow-queries").status_code == 200
+    assert client.delete("/api/monitoring/slow-queries").status_code == 200
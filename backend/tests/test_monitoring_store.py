@@ -0,0 +1,66 @@
+import pytest
+
+from app.utils.monitoring_store import InMemoryMonitoringBackend, MonitoringStore
+
+# Начало минуты: 2024-03-10 12:00:00 UTC
+NOW = 1710072000.0
+
+@pytest.fixture
+def store():
+    store = MonitoringStore()
+    store.backend = InMemoryMonitoringBackend(metrics_size=3, errors_size=2, alerts_size=2, retention_minutes=5)
+    store.use_redis = False
+    return store
+
+def test_rings_keep_latest_entries(store):
+    for i in range(5):
+        store.record_metrics({"sessionId": f"s{i}", "apiCalls": 1}, now=NOW + i)
+    for i in range(3):
+        store.record_error({"type": "js", "message": f"ошибка {i}"}, now=NOW + i)
+
+    # Старые записи вытеснены, новые идут первыми
+    assert [entry["sessionId"] for entry in store.recent("metrics")] == ["s4", "s3", "s2"]
+    assert [entry["message"] for entry in store.recent("errors")] == ["ошибка 2", "ошибка 1"]
+    assert [entry["sessionId"] for entry in store.recent("metrics", limit=1)] == ["s4"]
+
+def test_stats_aggregate_per_minute(store):
+    """Агрегаты не зависят от размера буфера: в статистике все записи окна"""
+    store.record_metrics({"sessionId": "a", "apiCalls": 10, "errors": 1, "avgResponseTime": 80, "cacheHitRate": 90}, now=NOW)
+    store.record_metrics({"sessionId": "a", "apiCalls": 10, "errors": 0, "avgResponseTime": 400, "cacheHitRate": 70}, now=NOW + 30)
+    store.record_metrics({"sessionId": "b", "apiCalls": 20, "errors": 3, "avgResponseTime": 3000, "cacheHitRate": 80}, now=NOW + 90)
+    store.record_metrics({"sessionId": "c", "apiCalls": 5, "errors": 0, "avgResponseTime": 50, "cacheHitRate": 100}, now=NOW + 60)
+    store.record_error({"type": "js"}, now=NOW)
+    store.record_error({"type": "js"}, now=NOW + 70)
+    store.record_error({"type": "network"}, now=NOW + 70)
+
+    stats = store.get_stats(minutes=2, now=NOW + 90)
+    assert stats["total_sessions"] == 3
+    assert stats["total_api_calls"] == 45
+    assert stats["total_errors"] == 4
+    assert stats["error_rate"] == round(4 / 45 * 100, 2)
+    assert stats["avg_response_time"] == round((80 + 400 + 3000 + 50) / 4, 2)
+    assert stats["avg_cache_hit_rate"] == 85
+    assert stats["error_types"] == {"js": 2, "network": 1}
+    assert stats["response_time_p50"] == 100
+    assert stats["response_time_p95"] == 5000
+
+    # Окно в одну минуту видит только текущую минуту
+    last_minute = store.get_stats(minutes=1, now=NOW + 90)
+    assert last_minute["total_sessions"] == 2
+    assert last_minute["total_api_calls"] == 25
+    assert last_minute["error_types"] == {"js": 1, "network": 1}
+
+def test_old_buckets_are_pruned(store):
+    store.record_metrics({"sessionId": "old", "apiCalls": 7}, now=NOW)
+    store.record_metrics({"sessionId": "new", "apiCalls": 1}, now=NOW + 10 * 60)
+
+    assert sorted(store.backend.buckets) == [int(NOW // 60) + 10]
+    assert store.get_stats(minutes=60, now=NOW + 10 * 60)["total_api_calls"] == 1
+
+def test_alerts_window(store):
+    assert store.record_metrics({"sessionId": "a", "errorRate": 50}, now=NOW)[0]["type"] == "high_error_rate"
+    store.record_metrics({"sessionId": "b", "avgResponseTime": 6000}, now=NOW + 30 * 60)
+
+    assert [alert["type"] for alert in store.get_alerts(minutes=60, now=NOW + 30 * 60)] == ["slow_response", "high_error_rate"]
+    assert [alert["type"] for alert in store.get_alerts(minutes=10, now=NOW + 30 * 60)] == ["slow_response"]
+    assert "ts" not in store.get_alerts(minutes=60, now=NOW + 30 * 60)[0]
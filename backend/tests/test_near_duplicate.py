@@ -0,0 +1,123 @@
+import asyncio
+import os
+
+import pytest
+import redis
+
+from app.services import moderation_pipeline as pipeline_module
+from app.utils.near_duplicate import NearDuplicateIndex, RedisNearDuplicateIndex, SnapshotSlot, minhash, similarity
+
+SPAM = "Дешевые поездки до Москвы, пишите в телеграм @cheap_rides, скидка 50% только сегодня"
+SPAM_VARIANT = "Дешевые поездки до Москвы!!! пишите в телеграм @cheap_rides, скидка 50% только сегодня"
+OTHER = "Выезжаю из Казани в субботу утром, есть два свободных места, багаж небольшой"
+
+def test_minhash_similarity():
+    """Похожие тексты дают близкие подписи, разные - далекие"""
+    assert similarity(minhash(SPAM), minhash(SPAM_VARIANT)) >= 0.8
+    assert similarity(minhash(SPAM), minhash(OTHER)) < 0.3
+    assert minhash("коротко") is None
+
+def test_index_counts_senders_in_window():
+    index = NearDuplicateIndex(window_seconds=60)
+    now = 1_000_000.0
+    assert index.check_and_add(minhash(SPAM), 1, now) == {}
+    assert index.check_and_add(minhash(SPAM_VARIANT), 2, now + 1) == {1: 1}
+    assert index.check_and_add(minhash(OTHER), 3, now + 2) == {}
+    # За пределами окна прежние записи не учитываются
+    assert index.check_and_add(minhash(SPAM), 4, now + 120) == {}
+
+def test_prune_by_age():
+    """Устаревшие записи удаляются по таймеру, без переполнения max_entries"""
+    index = NearDuplicateIndex(window_seconds=60, max_entries=1000)
+    index.add(minhash(SPAM), 1, 1000.0)
+    index.add(minhash(OTHER), 2, 1050.0)
+    assert not index.prune(now=1055.0)
+    assert index.prune(now=1070.0)
+    assert len(index) == 1
+    assert index.find(minhash(SPAM), now=1070.0) == {}
+
+def test_snapshots_per_worker_are_merged(tmp_path):
+    """Снимки разных воркеров не перезаписывают друг друга и загружаются вместе"""
+    base = str(tmp_path / "near_duplicates.bin")
+    first, second = NearDuplicateIndex(), NearDuplicateIndex()
+    first.add(minhash(SPAM), 1)
+    second.add(minhash(SPAM_VARIANT), 2)
+    first.save(f"{base}.101")
+    second.save(f"{base}.202")
+
+    merged = NearDuplicateIndex()
+    assert merged.load_snapshots(base) == 2
+    assert set(merged.find(minhash(SPAM))) == {1, 2}
+
+def test_stale_snapshot_removed(tmp_path):
+    base = str(tmp_path / "near_duplicates.bin")
+    index = NearDuplicateIndex(window_seconds=60)
+    index.add(minhash(SPAM), 1)
+    index.save(f"{base}.101")
+    os.utime(f"{base}.101", (0, 0))
+    assert NearDuplicateIndex(window_seconds=60).load_snapshots(base) == 0
+    assert not os.path.exists(f"{base}.101")
+
+def test_snapshot_slots_are_reused(tmp_path):
+    """Слот освобожденного воркера занимает следующий, а не новый файл"""
+    base = str(tmp_path / "near_duplicates.bin")
+    first, second = SnapshotSlot(base), SnapshotSlot(base)
+    assert first.acquire() == f"{base}.0"
+    assert second.acquire() == f"{base}.1"
+    first.release()
+    assert SnapshotSlot(base).acquire() == f"{base}.0"
+    second.release()
+
+def test_merge_into_shared_snapshot(tmp_path):
+    """Остановленные воркеры дописывают общий снимок без повторов"""
+    base = str(tmp_path / "near_duplicates.bin")
+    first = NearDuplicateIndex()
+    first.add(minhash(SPAM), 1)
+    first.merge_into(base)
+
+    # Второй воркер загрузил общий снимок при старте и добавил свою запись
+    second = NearDuplicateIndex()
+    second.load_snapshots(base)
+    second.add(minhash(SPAM_VARIANT), 2)
+    second.merge_into(base)
+    first.merge_into(base)
+
+    merged = NearDuplicateIndex()
+    assert merged.load_snapshots(base) == 2
+    assert set(merged.find(minhash(SPAM))) == {1, 2}
+
+def test_pipeline_stop_removes_worker_snapshot(tmp_path, monkeypatch):
+    base = str(tmp_path / "near_duplicates.bin")
+    monkeypatch.setattr(pipeline_module.settings, "near_duplicate_snapshot_path", base)
+    monkeypatch.setattr(pipeline_module.settings, "redis_url", None)
+
+    async def scenario():
+        pipeline = pipeline_module.ModerationPipeline(workers=0)
+        pipeline.start()
+        assert pipeline.snapshot_slot.path == f"{base}.0"
+        pipeline.near_duplicates.add(minhash(SPAM), 1)
+        pipeline.near_duplicates.save(pipeline.snapshot_slot.path)
+        await pipeline.stop()
+
+    asyncio.run(scenario())
+    assert not os.path.exists(f"{base}.0")
+    assert NearDuplicateIndex().load_snapshots(base) == 1
+
+@pytest.fixture
+def redis_client():
+    url = os.environ.get("TEST_REDIS_URL")
+    if not url:
+        pytest.skip("TEST_REDIS_URL не задан")
+    client = redis.from_url(url)
+    yield client
+    keys = list(client.scan_iter(f"{RedisNearDuplicateIndex.key_prefix}*"))
+    if keys:
+        client.delete(*keys)
+
+def test_redis_index_shared_between_workers(redis_client):
+    """Два воркера с общим Redis видят рассылку друг друга"""
+    first = RedisNearDuplicateIndex(redis_client, window_seconds=60)
+    second = RedisNearDuplicateIndex(redis_client, window_seconds=60)
+    assert first.check_and_add(minhash(SPAM), 1) == {}
+    assert second.check_and_add(minhash(SPAM_VARIANT), 2) == {1: 1}
+    assert second.check_and_add(minhash(OTHER), 3) == {}
@@ -0,0 +1,62 @@
+from app.services.notification_service import NotificationService
+from app.utils.notification_templates import CompiledTemplate, NotificationTemplateRegistry
+
+RIDE = {
+    "id": 7,
+    "from": "Москва",
+    "to": "<b>Казань</b>",
+    "date": "01.02.2025",
+    "time": "10:00",
+    "price": 900,
+    "driver_name": "Иван & Co"
+}
+
+def test_compiled_template_escapes_user_fields():
+    template = CompiledTemplate.compile("<b>{from}</b> → {to}", trusted=("from",))
+    assert template.fields == ("from", "to")
+    assert template.render({"from": "<i>A</i>", "to": "<i>B</i>"}) == "<b><i>A</i></b> → &lt;i&gt;B&lt;/i&gt;"
+
+def test_ride_template_escapes_and_fills_defaults():
+    registry = NotificationTemplateRegistry()
+    rendered = registry.render("new_ride", RIDE, language="ru")
+    assert "&lt;b&gt;Казань&lt;/b&gt;" in rendered["text"]
+    assert "Иван &amp; Co" in rendered["text"]
+    # Значение по умолчанию для незаданного рейтинга
+    assert "<b>Рейтинг:</b> 0" in rendered["text"]
+    assert rendered["reply_markup"]["inline_keyboard"][0][0]["callback_data"] == "view_ride_7"
+
+def test_system_fields_keep_admin_markup():
+    """Заголовок и текст системного уведомления задает администратор и не экранируются"""
+    registry = NotificationTemplateRegistry()
+    rendered = registry.render("system", {
+        "icon": registry.get_icon("warning", "ru"),
+        "title": "Технические <i>работы</i>",
+        "message": "Сервис недоступен <b>с 02:00</b>"
+    }, language="ru")
+    assert "Технические <i>работы</i>" in rendered["text"]
+    assert "<b>с 02:00</b>" in rendered["text"]
+
+def test_render_cache_returns_copies():
+    registry = NotificationTemplateRegistry()
+    first = registry.render("new_ride", RIDE, language="ru")
+    first["text"] = "испорчено"
+    first["reply_markup"]["inline_keyboard"][0][0]["text"] = "испорчено"
+
+    second = registry.render("new_ride", RIDE, language="ru")
+    assert registry.stats["cache_hits"] == 1
+    assert second["text"] != "испорчено"
+    assert second["reply_markup"]["inline_keyboard"][0][0]["text"] != "испорчено"
+
+def test_unknown_language_falls_back_to_default():
+    registry = NotificationTemplateRegistry()
+    assert registry.resolve_language("xx") == registry.default_language
+    assert registry.get("new_ride", "xx").language == registry.default_language
+    assert registry.render("missing", RIDE) is None
+
+def test_notifications_use_default_language():
+    class FakeUser:
+        id = 1
+        telegram_id = "111"
+
+    service = NotificationService()
+    assert service.get_user_language(FakeUser()) == "ru"
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.monitoring import prometheus
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_metrics_closed_without_token(client: TestClient, monkeypatch):
+    monkeypatch.setattr(prometheus.settings, "metrics_token", None)
+    assert client.get("/metrics").status_code == 404
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 404
+
+def test_metrics_require_scrape_token(client: TestClient, monkeypatch):
+    monkeypatch.setattr(prometheus.settings, "metrics_token", "scrape-secret")
+    assert client.get("/metrics").status_code == 404
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 404
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert "http_requests_total" in response.text
+
+def run_worker(env, code: str) -> str:
+    result = subprocess.run(
+        [sys.executable, "-c", textwrap.dedent(code)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def test_multiprocess_collection(tmp_path):
+    """/metrics любого воркера складывает значения всех воркеров из общего каталога"""
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path), "SECRET_KEY": os.environ.get("SECRET_KEY", "x")}
+    record = """
+        from app.monitoring import prometheus
+        prometheus.observe_http_request("GET", "/api/rides/{{ride_id}}", 200, 0.02)
+        prometheus.TELEGRAM_MESSAGES.labels("sent").inc({count})
+    """
+    run_worker(env, record.format(count=1))
+    run_worker(env, record.format(count=2))
+
+    output = run_worker(env, """
+        from app.monitoring import prometheus
+        assert prometheus.MULTIPROCESS
+        print(prometheus.render_metrics()[0].decode())
+    """)
+    samples = {}
+    for line in output.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+
+    route = 'method="GET",route="/api/rides/{ride_id}",status_class="2xx"'
+    assert samples[f"http_requests_total{{{route}}}"] == 2
+    assert samples['telegram_messages_total{result="sent"}'] == 3
+    assert samples['http_request_duration_seconds_count{method="GET",route="/api/rides/{ride_id}"}'] == 2
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.moderation import ModerationAction, ModerationReport
+from app.models.stats import StatRollup
+from app.services import stats_rollup as rollup_module
+from app.services.moderation_service import moderation_service
+from app.services.stats_rollup import ACTIONS, DAY, HOUR, REPORTS, REPORTS_RESOLVED, stats_rollup
+
+NOW = datetime(2024, 3, 10, 15, 30)
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    Base.metadata.create_all(engine, tables=[
+        ModerationReport.__table__, ModerationAction.__table__, StatRollup.__table__
+    ])
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+def rows(db, granularity):
+    return {
+        (row.metric, row.dimension, row.bucket_start): row.count
+        for row in db.query(StatRollup).filter(StatRollup.granularity == granularity)
+    }
+
+def test_record_upserts_hour_and_day(db):
+    stats_rollup.record(db, ACTIONS, at=NOW, dimension="warn")
+    stats_rollup.record(db, ACTIONS, at=NOW + timedelta(minutes=20), dimension="warn")
+    stats_rollup.record(db, ACTIONS, at=NOW + timedelta(hours=1), dimension="ban")
+    db.commit()
+
+    assert rows(db, HOUR) == {
+        (ACTIONS, "warn", datetime(2024, 3, 10, 15)): 2,
+        (ACTIONS, "ban", datetime(2024, 3, 10, 16)): 1
+    }
+    assert rows(db, DAY) == {
+        (ACTIONS, "warn", datetime(2024, 3, 10)): 2,
+        (ACTIONS, "ban", datetime(2024, 3, 10)): 1
+    }
+
+def test_rebuild_matches_incremental(db, monkeypatch):
+    """Пересчет из исходных таблиц дает те же корзины, что и запись по событиям"""
+    clock = iter([NOW - timedelta(days=1, hours=3), NOW - timedelta(hours=2), NOW])
+    monkeypatch.setattr(rollup_module, "rollup_now", lambda: next(clock))
+    monkeypatch.setattr("app.services.moderation_service.rollup_now", rollup_module.rollup_now)
+    first = moderation_service.create_report(db, 1, "message", 7, "spam")
+    moderation_service.create_report(db, 1, "message", 8, "spam")
+    moderation_service.review_report(db, first.id, moderator_id=2, action="dismiss")
+
+    incremental = {granularity: rows(db, granularity) for granularity in (HOUR, DAY)}
+    assert incremental[HOUR][(REPORTS_RESOLVED, "", datetime(2024, 3, 9, 12))] == 1
+
+    # Расхождение (например, сбой до фикса часов) исправляется пересчетом
+    stats_rollup.record(db, REPORTS, at=NOW, count=5)
+    db.commit()
+    stats_rollup.rebuild(db, NOW - timedelta(days=3), NOW + timedelta(days=1), [REPORTS, REPORTS_RESOLVED, ACTIONS])
+    assert {granularity: rows(db, granularity) for granularity in (HOUR, DAY)} == incremental
+
+def test_totals_and_compact_use_given_clock(db, monkeypatch):
+    monkeypatch.setattr(rollup_module.settings, "stats_hourly_retention_days", 7)
+    stats_rollup.record(db, REPORTS, at=NOW - timedelta(days=20))
+    stats_rollup.record(db, REPORTS, at=datetime(2024, 3, 9, 10))
+    stats_rollup.record(db, REPORTS, at=datetime(2024, 3, 9, 20))
+    stats_rollup.record(db, REPORTS, at=NOW)
+    db.commit()
+
+    # Неполные первые сутки - из почасовых строк
+    assert stats_rollup.totals(db, [REPORTS], datetime(2024, 3, 9, 12), now=NOW)[(REPORTS, "")][0] == 2
+    assert stats_rollup.totals(db, [REPORTS], None, now=NOW)[(REPORTS, "")][0] == 4
+
+    assert stats_rollup.compact(db, now=NOW) == 1
+    assert len(rows(db, HOUR)) == 3
+    assert len(rows(db, DAY)) == 3
+    # Почасовых строк за те сутки больше нет: начало округляется до суток
+    old_start = NOW - timedelta(days=20, hours=-3)
+    assert stats_rollup.totals(db, [REPORTS], old_start, now=NOW)[(REPORTS, "")][0] == 4
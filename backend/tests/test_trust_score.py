@@ -0,0 +1,104 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.moderation import ModerationAction, ModerationReport, TrustScore
+from app.models.user import User
+from app.services.trust_service import TrustScoreService
+
+def make_user(user_id: int, days_registered: int = 0) -> User:
+    return User(
+        id=user_id,
+        telegram_id=str(user_id),
+        phone=f"+7900000000{user_id}",
+        full_name=f"User {user_id}",
+        birth_date=date(1990, 1, 1),
+        city="Moscow",
+        created_at=datetime.now() - timedelta(days=days_registered)
+    )
+
+def test_read_does_not_commit_caller_session(tmp_path):
+    """Создание строки скора не коммитит и не откатывает изменения вызывающего"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'trust.db'}")
+    Base.metadata.create_all(engine, tables=[
+        User.__table__, ModerationReport.__table__, ModerationAction.__table__, TrustScore.__table__
+    ])
+    factory = sessionmaker(bind=engine, autoflush=False)
+    setup = factory()
+    setup.add(make_user(1, days_registered=40))
+    setup.commit()
+    setup.close()
+
+    caller = factory()
+    caller.add(make_user(2))
+
+    service = TrustScoreService()
+    score = service.get_trust_score(caller, 1)
+    assert score["trust_score"] == 110
+    assert score["level"] == "high"
+
+    # Несвязанная вставка вызывающего не записана и не отброшена
+    assert len(caller.new) == 1
+    caller.close()
+
+    check = factory()
+    try:
+        assert check.query(User).filter(User.id == 2).count() == 0
+        assert check.query(TrustScore).filter(TrustScore.user_id == 1).count() == 1
+    finally:
+        check.close()
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'trust.db'}")
+    Base.metadata.create_all(engine, tables=[
+        User.__table__, ModerationReport.__table__, ModerationAction.__table__, TrustScore.__table__
+    ])
+    factory = sessionmaker(bind=engine)
+    setup = factory()
+    setup.add(make_user(1))
+    setup.commit()
+    setup.close()
+    yield factory
+    engine.dispose()
+
+def get_row(factory, user_id: int) -> TrustScore:
+    session = factory()
+    try:
+        return session.query(TrustScore).filter(TrustScore.user_id == user_id).one()
+    finally:
+        session.close()
+
+def test_first_event_builds_row_from_history(session_factory):
+    """Первая строка строится по истории, уже включающей событие, без двойного учета"""
+    caller = session_factory()
+    report = ModerationReport(id=1, target_type="user", target_id=1, reason="spam", status="resolved")
+    caller.add_all([report, ModerationAction(report_id=1, moderator_id=2, action="warn")])
+    TrustScoreService().record_event(caller, 1, warnings=1, reports=1)
+    caller.commit()
+    caller.close()
+
+    row = get_row(session_factory, 1)
+    assert (row.warnings_count, row.reports_count, row.score) == (1, 1, 65)
+
+def test_concurrent_first_event_does_not_conflict(session_factory):
+    """Строку между проверкой и вставкой создал другой запрос: событие добавляется к ней"""
+    class RacingService(TrustScoreService):
+        def _initial_values(self, db, user):
+            values = super()._initial_values(db, user)
+            other = session_factory()
+            other.add(TrustScore(**{**values, "warnings_count": 1, "score": 80, "level": "high"}))
+            other.commit()
+            other.close()
+            return values
+
+    caller = session_factory()
+    RacingService().record_event(caller, 1, warnings=1)
+    caller.commit()
+    caller.close()
+
+    row = get_row(session_factory, 1)
+    assert (row.warnings_count, row.score, row.level) == (2, 60, "medium")
@@ -0,0 +1,83 @@
+import asyncio
+import json
+from decimal import Decimal
+
+import pytest
+
+from app.utils import websocket_manager as websocket_module
+from app.utils.websocket_manager import EncodedFrame, NotificationMessage, WebSocketManager
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_subscription_delivery_and_cleanup():
+    async def scenario():
+        manager = WebSocketManager()
+        first, second = FakeWebSocket(), FakeWebSocket()
+        a = manager.register(first, user_id=1).connection_id
+        b = manager.register(second, user_id=2).connection_id
+        await manager.subscribe(a, "rides:moscow")
+        await manager.subscribe(b, "rides:moscow")
+        await manager.send_to_subscription("rides:moscow", NotificationMessage(type="info", title="t", message="m"))
+        await asyncio.sleep(0)
+
+        manager.disconnect(a)
+        assert manager.subscription_connections["rides:moscow"] == {b}
+        await manager.unsubscribe(b, "rides:moscow")
+        assert manager.subscription_connections == {}
+        return first, second
+
+    first, second = run(scenario())
+    assert [frame["type"] for frame in first.sent] == ["subscription_confirmed", "info"]
+    assert [frame["type"] for frame in second.sent][:2] == ["subscription_confirmed", "info"]
+
+def test_invalid_subscription_rejected_without_disconnect():
+    """Некорректное имя темы от клиента не рвет соединение и не попадает в индекс"""
+    async def scenario():
+        manager = WebSocketManager()
+        websocket = FakeWebSocket()
+        connection_id = manager.register(websocket, user_id=1).connection_id
+        for bad in (["list"], {"a": 1}, 42, "", "x" * (manager.max_subscription_length + 1)):
+            await manager.subscribe(connection_id, bad)
+            await manager.unsubscribe(connection_id, bad)
+        await asyncio.sleep(0)
+        return manager, connection_id, websocket
+
+    manager, connection_id, websocket = run(scenario())
+    assert connection_id in manager.active_connections
+    assert manager.subscription_connections == {}
+    assert manager.stats['subscriptions_rejected'] == 10
+    assert {frame["type"] for frame in websocket.sent} == {"error"}
+
+def test_subscriptions_per_connection_capped():
+    async def scenario():
+        manager = WebSocketManager()
+        manager.max_subscriptions = 2
+        connection_id = manager.register(FakeWebSocket(), user_id=1).connection_id
+        for topic in ("a", "b", "c", "a"):
+            await manager.subscribe(connection_id, topic)
+        return manager, connection_id
+
+    manager, connection_id = run(scenario())
+    assert manager.active_connections[connection_id].subscriptions == ("a", "b")
+    assert set(manager.subscription_connections) == {"a", "b"}
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_frames_serialize_decimal(monkeypatch, use_orjson):
+    """Decimal в данных уведомления не обрывает рассылку ни с orjson, ни без него"""
+    if not use_orjson:
+        monkeypatch.setattr(websocket_module, "orjson", None)
+    data = {"ride_id": 1, "price": Decimal("1500.50")}
+
+    assert json.loads(EncodedFrame.from_data({"type": "ride_update", "data": data}).text)["data"]["price"] == "1500.50"
+    message = NotificationMessage(type="ride_update", title="Поездка", message="Цена изменилась", data=data)
+    frame = json.loads(EncodedFrame.from_message(message).text)
+    assert frame["data"]["price"] == "1500.50"
+    assert frame["title"] == "Поездка"
@@ -191,7 +191,20 @@ class ChatScreen {
     createMessageElement(message) {
         const messageElement = document.createElement('div');
         messageElement.className = `message ${message.user_from_id === this.stateManager.getCurrentUser().id ? 'sent' : 'received'}`;
-        messageElement.setAttribute('data-message-id', message.id);
+        if (message.id) {
+            messageElement.setAttribute('data-message-id', message.id);
+        }
+        if (message.provisional_id) {
+            messageElement.setAttribute('data-provisional-id', message.provisional_id);
+        }
+        // Сообщение принято сервером, но еще не записано в базу (id и seq появятся после коммита)
+        if (message.pending) {
+            messageElement.classList.add('pending');
+            messageElement.style.opacity = '0.6';
+        }
+        if (message.failed) {
+            messageElement.classList.add('failed');
+        }
         
         const content = document.createElement('div');
         content.className = 'message-content';
@@ -208,7 +221,11 @@ class ChatScreen {
         status.className = 'message-status';
         
         if (message.user_from_id === this.stateManager.getCurrentUser().id) {
-            if (message.is_read) {
+            if (message.failed) {
+                status.innerHTML = '<i class="fas fa-exclamation-circle"></i>';
+            } else if (message.pending) {
+                status.innerHTML = '<i class="far fa-clock"></i>';
+            } else if (message.is_read) {
                 status.innerHTML = '<i class="fas fa-check-double"></i>';
             } else {
                 status.innerHTML = '<i class="fas fa-check"></i>';
@@ -233,8 +250,9 @@ class ChatScreen {
         sendBtn.disabled = true;
         
         try {
-            // Отправляем через WebSocket
-            wsManager.sendMessage(this.currentChatId, message);
+            // Отправляем через WebSocket; client_id связывает ответы сервера с локальным сообщением
+            const clientId = `${Date.now()}-${Math.random().toString(36).slice(2, 10)}`;
+            wsManager.sendMessage(this.currentChatId, message, clientId);
             
             // Очищаем поле ввода
             chatInput.value = '';
@@ -243,7 +261,10 @@ class ChatScreen {
             
             // Добавляем сообщение в локальный список
             const newMessage = {
-                id: Date.now(),
+                id: null,
+                client_id: clientId,
+                provisional_id: null,
+                pending: true,
                 message: message,
                 user_from_id: this.stateManager.getCurrentUser().id,
                 user_to_id: null,
@@ -264,11 +285,25 @@ class ChatScreen {
     handleIncomingMessage(data) {
         switch (data.type) {
             case 'new_message':
-                this.handleNewMessage(data.message);
+                this.handleNewMessage({
+                    ...data.message,
+                    provisional_id: data.provisional_id || null,
+                    pending: !data.message.id
+                });
+                break;
+            case 'message_accepted':
+                this.handleMessageAccepted(data);
                 break;
             case 'message_sent':
+            case 'message_persisted':
                 this.handleMessageSent(data);
                 break;
+            case 'message_retracted':
+                this.handleMessageRetracted(data);
+                break;
+            case 'error':
+                this.handleMessageFailed(data);
+                break;
             case 'typing':
                 this.handleTypingIndicator(data);
                 break;
@@ -292,14 +327,48 @@ class ChatScreen {
         }
     }
 
+    findMessage(field, value) {
+        if (value === undefined || value === null) return null;
+        return this.messages.find(message => message[field] === value) || null;
+    }
+
+    handleMessageAccepted(data) {
+        // Сервер принял сообщение в очередь записи и выдал временный id
+        const message = this.findMessage('client_id', data.client_id);
+        if (message) {
+            message.provisional_id = data.provisional_id;
+            this.renderMessages();
+        }
+    }
+
     handleMessageSent(data) {
-        // Обновляем статус отправленного сообщения
-        const messageElement = document.querySelector(`[data-message-id="${data.message_id}"]`);
-        if (messageElement) {
-            const statusElement = messageElement.querySelector('.message-status');
-            if (statusElement) {
-                statusElement.innerHTML = '<i class="fas fa-check"></i>';
-            }
+        // Сообщение записано: временный id заменяется постоянным
+        const message = this.findMessage('provisional_id', data.provisional_id);
+        if (message) {
+            message.id = data.message_id;
+            message.seq = data.seq;
+            message.pending = false;
+            this.renderMessages();
+        }
+    }
+
+    handleMessageRetracted(data) {
+        // Сообщение не записалось у отправителя - убираем его из ленты получателя
+        const count = this.messages.length;
+        this.messages = this.messages.filter(message => message.provisional_id !== data.provisional_id);
+        if (this.messages.length !== count) {
+            this.renderMessages();
+        }
+    }
+
+    handleMessageFailed(data) {
+        // Ошибка отправки своего сообщения: до приема (client_id) или после (provisional_id)
+        const message = this.findMessage('provisional_id', data.provisional_id)
+            || this.findMessage('client_id', data.client_id);
+        if (message) {
+            message.pending = false;
+            message.failed = true;
+            this.renderMessages();
         }
     }
 
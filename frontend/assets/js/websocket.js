@@ -44,7 +44,9 @@ class WebSocketManager {
             ? 'ws://localhost:8000'
             : 'wss://pax-backend-2gng.onrender.com';
         
-        return `${baseURL}/api/chat/ws/${this.user_id}`;
+        // Браузер не передает заголовки в WebSocket, токен идет параметром запроса
+        const token = encodeURIComponent(localStorage.getItem('accessToken') || '');
+        return `${baseURL}/api/chat/ws/${this.user_id}?token=${token}`;
     }
 
     // Настройка обработчиков событий
@@ -79,6 +81,12 @@ class WebSocketManager {
                 this.onStatusChangeCallback('disconnected');
             }
 
+            // Сервер отклонил токен: переподключение с тем же токеном бесполезно
+            if (event.code === 1008) {
+                console.log('WebSocket соединение отклонено: требуется авторизация');
+                return;
+            }
+
             // Попытка переподключения только если это не было намеренное закрытие
             if (event.code !== 1000 && this.reconnectAttempts < this.maxReconnectAttempts) {
                 console.log('Планирование переподключения после неожиданного закрытия');
@@ -109,9 +117,18 @@ class WebSocketManager {
             case 'new_message':
                 this.handleNewMessage(data);
                 break;
+            case 'message_accepted':
             case 'message_sent':
+            case 'message_persisted':
                 this.handleMessageSent(data);
                 break;
+            case 'message_retracted':
+                console.log('Сообщение отозвано:', data);
+                break;
+            case 'resume_batch':
+            case 'resume_complete':
+            case 'history':
+                break;
             case 'typing':
                 this.handleTyping(data);
                 break;
@@ -163,12 +180,13 @@ class WebSocketManager {
         Utils.showNotification('Ошибка чата', data.message || 'Произошла ошибка в чате', 'error');
     }
 
-    // Отправка сообщения
-    sendMessage(chatId, message) {
+    // Отправка сообщения (client_id сервер возвращает в message_accepted и error)
+    sendMessage(chatId, message, clientId = null) {
         const messageData = {
             type: 'message',
             chat_id: chatId,
-            message: message
+            message: message,
+            client_id: clientId
         };
 
         this.send(messageData);